@@ -0,0 +1,315 @@
+import calendar
+import contextvars
+import datetime
+import functools
+import json
+import struct
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+from google.cloud.firestore_v1.base_document import BaseDocumentReference
+from google.cloud.firestore_v1.vector import Vector
+from pydantic import BaseModel
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+
+# msgpack and cbor2 are optional, JSON is always available
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# MessagePack extension types of the Firestore values; timestamps use the
+# standard timestamp extension (-1), with nanosecond precision
+GEOPOINT_EXT = 1  # latitude and longitude, two big-endian doubles
+REFERENCE_EXT = 2  # the document path, UTF-8
+VECTOR_EXT = 3  # the values, big-endian doubles
+
+# CBOR tags of the Firestore values; timestamps use the standard tag 0, an
+# RFC 3339 string with nanosecond precision. 103 is the registered tag of
+# geographic coordinates, the others are unregistered tags of the
+# first-come first-served range.
+TIMESTAMP_TAG = 0
+GEOPOINT_TAG = 103
+REFERENCE_TAG = 49601
+VECTOR_TAG = 49602
+
+# the wire format of the response of the current request, None for JSON
+response_format: contextvars.ContextVar = contextvars.ContextVar("response_format", default=None)
+
+
+def _document(path: str):
+    # imported here, the client is only needed once a reference is decoded
+    from app.init_firebase import db
+    return db.document(path)
+
+
+def _timestamp(value: datetime.datetime):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    nanoseconds = value.nanosecond if isinstance(value, DatetimeWithNanoseconds) else value.microsecond * 1000
+    return calendar.timegm(value.utctimetuple()), nanoseconds
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return msgpack.Timestamp(*_timestamp(obj))
+    if isinstance(obj, GeoPoint):
+        return msgpack.ExtType(GEOPOINT_EXT, struct.pack(">dd", obj.latitude, obj.longitude))
+    if isinstance(obj, BaseDocumentReference):
+        return msgpack.ExtType(REFERENCE_EXT, obj.path.encode())
+    if isinstance(obj, Vector):
+        return msgpack.ExtType(VECTOR_EXT, struct.pack(f">{len(obj)}d", *obj))
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} cannot be encoded as MessagePack")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == GEOPOINT_EXT:
+        return GeoPoint(*struct.unpack(">dd", data))
+    if code == REFERENCE_EXT:
+        return _document(data.decode())
+    if code == VECTOR_EXT:
+        return Vector(list(struct.unpack(f">{len(data) // 8}d", data)))
+    return msgpack.ExtType(code, data)
+
+
+def _cbor_timestamps(value):
+    # cbor2 encodes datetimes itself, with microsecond precision, so the
+    # timestamps are tagged beforehand with all their nanoseconds
+    if isinstance(value, datetime.datetime):
+        seconds, nanoseconds = _timestamp(value)
+        utc = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+        return cbor2.CBORTag(TIMESTAMP_TAG, f"{utc:%Y-%m-%dT%H:%M:%S}.{nanoseconds:09d}Z")
+    if isinstance(value, dict):
+        return {key: _cbor_timestamps(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_cbor_timestamps(item) for item in value]
+    return value
+
+
+def _cbor_default(encoder, obj):
+    if isinstance(obj, GeoPoint):
+        encoder.encode(cbor2.CBORTag(GEOPOINT_TAG, [obj.latitude, obj.longitude]))
+    elif isinstance(obj, BaseDocumentReference):
+        encoder.encode(cbor2.CBORTag(REFERENCE_TAG, obj.path))
+    elif isinstance(obj, Vector):
+        encoder.encode(cbor2.CBORTag(VECTOR_TAG, list(obj)))
+    elif isinstance(obj, set):
+        encoder.encode(list(obj))
+    else:
+        raise TypeError(f"Object of type {type(obj).__name__} cannot be encoded as CBOR")
+
+
+def _cbor_tag_hook(decoder, tag):
+    if tag.tag == GEOPOINT_TAG:
+        return GeoPoint(*tag.value[:2])
+    if tag.tag == REFERENCE_TAG:
+        return _document(tag.value)
+    if tag.tag == VECTOR_TAG:
+        return Vector(tag.value)
+    return tag
+
+
+class MsgpackFormat:
+    media_type = "application/msgpack"
+
+    @staticmethod
+    def encode(content) -> bytes:
+        return msgpack.packb(content, default=_msgpack_default, datetime=False)
+
+    @staticmethod
+    def decode(data: bytes):
+        # timestamps are decoded as datetimes, with microsecond precision
+        return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, timestamp=3)
+
+
+class CborFormat:
+    media_type = "application/cbor"
+
+    @staticmethod
+    def encode(content) -> bytes:
+        return cbor2.dumps(_cbor_timestamps(content), default=_cbor_default)
+
+    @staticmethod
+    def decode(data: bytes):
+        # timestamps are decoded as datetimes, with microsecond precision
+        return cbor2.loads(data, tag_hook=_cbor_tag_hook)
+
+
+# binary formats by media type, in order of preference
+FORMATS = {}
+if msgpack is not None:
+    FORMATS["application/msgpack"] = MsgpackFormat
+    FORMATS["application/x-msgpack"] = MsgpackFormat
+if cbor2 is not None:
+    FORMATS["application/cbor"] = CborFormat
+
+
+def request_format(content_type: Optional[str]):
+    """
+    The binary format of a request body, from its Content-Type, or None.
+    """
+    if not content_type:
+        return None
+    return FORMATS.get(content_type.split(";", 1)[0].strip().lower())
+
+
+def negotiate_format(accept: str):
+    """
+    Pick the response format from an Accept header.
+
+    A binary format is picked when it has a quality value above 0 and at least
+    as high as application/json's; ``*/*`` only stands for JSON.
+
+    :param accept: The header value, e.g. "application/msgpack, application/json;q=0.5".
+    :return: The format, or None for JSON.
+    """
+    qualities = {}
+    for item in accept.split(","):
+        media_type, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[media_type.strip().lower()] = quality
+    best, best_quality = None, qualities.get("application/json", 0.0)
+    for media_type, wire_format in FORMATS.items():
+        quality = qualities.get(media_type, 0.0)
+        if quality > 0 and quality >= best_quality and (best is None or quality > best_quality):
+            best, best_quality = wire_format, quality
+    return best
+
+
+class BinaryResponse(Response):
+    def __init__(self, content, wire_format, status_code: int = 200, headers: Optional[dict] = None, background=None):
+        self.wire_format = wire_format
+        self.media_type = wire_format.media_type
+        super().__init__(content, status_code, headers, self.media_type, background)
+
+    def render(self, content) -> bytes:
+        return self.wire_format.encode(content)
+
+
+def plain(value):
+    """
+    The content of an endpoint's return value, with the Firestore values
+    left as they are, where ``jsonable_encoder`` would turn them into strings.
+    """
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+
+def binary_response(result, wire_format, status_code: Optional[int], sub_response: Optional[Response]) -> Response:
+    """
+    Encode an endpoint's return value in a binary format.
+
+    JSON responses built by the endpoint are re-encoded with their status and
+    headers; other responses, e.g. streams, are returned as they are.
+    """
+    if isinstance(result, Response):
+        if type(result) is not JSONResponse:
+            return result
+        headers = MutableHeaders(raw=list(result.raw_headers))
+        del headers["content-length"]
+        del headers["content-type"]
+        return BinaryResponse(json.loads(result.body), wire_format, result.status_code, dict(headers), result.background)
+    response = BinaryResponse(plain(result), wire_format, status_code or 200)
+    if sub_response is not None:
+        # the headers and status the endpoint set on its Response parameter
+        response.raw_headers.extend(
+            (name, value) for name, value in sub_response.raw_headers if name != b"content-length"
+        )
+        if sub_response.status_code:
+            response.status_code = sub_response.status_code
+    return response
+
+
+class NegotiatedRoute(APIRoute):
+    """
+    Route whose request and response bodies may be MessagePack or CBOR
+    instead of JSON.
+
+    A request body sent with ``Content-Type: application/msgpack`` or
+    ``application/cbor`` is decoded into the same Pydantic models as JSON.
+    A request whose Accept header prefers one of them gets its response, and
+    its errors, in that format. Firestore timestamps, GeoPoints, references
+    and vectors are sent as extension types (MessagePack) or tags (CBOR)
+    instead of strings. Streaming responses stay as they are.
+    """
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        status_code = self.status_code
+
+        @functools.wraps(endpoint)
+        async def negotiated_endpoint(**values):
+            result = await endpoint(**values)
+            wire_format = response_format.get()
+            if wire_format is None:
+                return result
+            sub_response = next((value for value in values.values() if isinstance(value, Response)), None)
+            return binary_response(result, wire_format, status_code, sub_response)
+
+        self.dependant.call = negotiated_endpoint
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            body_format = request_format(request.headers.get("content-type"))
+            if body_format is not None:
+                request = BinaryRequest(request.scope, request.receive, body_format)
+            wire_format = negotiate_format(request.headers.get("accept", ""))
+            token = response_format.set(wire_format)
+            try:
+                response = await handler(request)
+            except HTTPException as e:
+                if wire_format is None:
+                    raise
+                return BinaryResponse({"detail": e.detail}, wire_format, e.status_code, e.headers)
+            except RequestValidationError as e:
+                if wire_format is None:
+                    raise
+                return BinaryResponse({"detail": e.errors()}, wire_format, 422)
+            finally:
+                response_format.reset(token)
+            if wire_format is not None:
+                MutableHeaders(raw=response.raw_headers).add_vary_header("Accept")
+            return response
+
+        return route_handler
+
+
+class BinaryRequest(Request):
+    """
+    Request with a binary body, which FastAPI reads through ``json()``.
+    """
+
+    def __init__(self, scope, receive, wire_format):
+        # FastAPI only parses the bodies it takes for JSON
+        headers = [(name, value) for name, value in scope["headers"] if name != b"content-type"]
+        super().__init__(dict(scope, headers=headers + [(b"content-type", b"application/json")]), receive)
+        self.wire_format = wire_format
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = self.wire_format.decode(await self.body())
+        return self._json
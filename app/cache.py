@@ -0,0 +1,420 @@
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.constants import (
+    AGGREGATION_CACHE_SIZE,
+    AGGREGATION_CACHE_TTL,
+    FIRESTORE_CACHE_DEFAULT_TTL,
+    FIRESTORE_CACHE_MAX_BYTES,
+    FIRESTORE_CACHE_TTLS,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
+from app.encoding import firestore_json_default
+
+# number of recently invalidated paths remembered to reject stale inserts
+MAX_TRACKED_INVALIDATIONS = 10000
+
+
+class DocumentCache:
+    """
+    In-process LRU cache of document data keyed by document path.
+
+    Entries expire after the TTL of their collection and the least recently used
+    ones are evicted once the cache grows past ``max_bytes``. Cached dicts are
+    shared between readers and must not be mutated.
+
+    A read takes a ``token()`` before fetching from Firestore and passes it to
+    ``set()``: if the path was invalidated in the meantime the insert is dropped,
+    so a slow read can never put back data that a write has just replaced.
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float, collection_ttls: Dict[str, float]):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.collection_ttls = collection_ttls
+        self._entries = OrderedDict()  # path -> (expires_at, size, data, update_time)
+        self._invalidations = OrderedDict()  # path -> counter value when invalidated
+        self._counter = 0
+        self._forgotten = 0  # counter value of the oldest invalidation no longer tracked
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def ttl(self, path: str) -> float:
+        """
+        TTL of a document path, looked up by the ID of its parent collection.
+        """
+        return self.collection_ttls.get(path.split("/")[-2], self.default_ttl)
+
+    def token(self) -> int:
+        return self._counter
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        Return the cached data of a document, or None on a miss.
+        """
+        entry = self.lookup(path)
+        return None if entry is None else entry[0]
+
+    def lookup(self, path: str) -> Optional[Tuple[dict, Optional[datetime.datetime]]]:
+        """
+        Return the cached data of a document and its update time, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(path)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def set(self, path: str, data: dict, token: int, update_time: Optional[datetime.datetime] = None):
+        """
+        Cache the data of a document read from Firestore.
+
+        :param path: The document path.
+        :param data: The document data.
+        :param token: The value of ``token()`` taken before the read.
+        :param update_time: The document's update time, if known.
+        """
+        ttl = self.ttl(path)
+        if ttl <= 0:
+            return
+        size = len(json.dumps(data, default=firestore_json_default))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if token < self._forgotten or self._invalidations.get(path, -1) > token:
+                return
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = (time.monotonic() + ttl, size, data, update_time)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        """
+        Drop a document from the cache after it was written or deleted.
+        """
+        with self._lock:
+            self._counter += 1
+            self.invalidations += 1
+            self._invalidations[path] = self._counter
+            self._invalidations.move_to_end(path)
+            if len(self._invalidations) > MAX_TRACKED_INVALIDATIONS:
+                _, self._forgotten = self._invalidations.popitem(last=False)
+            self._remove(path)
+
+    def invalidate_prefix(self, path: str):
+        """
+        Drop every document below a collection or document path.
+        """
+        prefix = path.rstrip("/") + "/"
+        with self._lock:
+            self._counter += 1
+            self.invalidations += 1
+            # reject every read that started before this point
+            self._forgotten = self._counter
+            for key in [key for key in self._entries if key.startswith(prefix) or key == path]:
+                self._remove(key)
+
+    def _remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+
+document_cache = DocumentCache(
+    max_bytes=FIRESTORE_CACHE_MAX_BYTES,
+    default_ttl=FIRESTORE_CACHE_DEFAULT_TTL,
+    collection_ttls=FIRESTORE_CACHE_TTLS,
+)
+
+
+class UserCache:
+    """
+    In-process LRU cache of serialized user records, keyed by uid and by email.
+
+    Works like ``DocumentCache``: entries expire after ``ttl`` seconds, at most
+    ``max_entries`` users are kept, and a lookup takes a ``token()`` before
+    calling Firebase so that ``set()`` drops a record fetched before the user
+    was invalidated. Cached records are shared between readers and must not be
+    mutated.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # uid -> (expires_at, record)
+        self._by_email = {}  # lowercased email -> uid
+        self._invalidations = OrderedDict()  # uid -> counter value when invalidated
+        self._counter = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def token(self) -> int:
+        return self._counter
+
+    def get(self, uid: str) -> Optional[dict]:
+        """
+        Return the cached record of a user, or None on a miss.
+        """
+        with self._lock:
+            return self._get(uid)
+
+    def get_by_email(self, email: str) -> Optional[dict]:
+        """
+        Return the cached record of the user with an email, or None on a miss.
+        """
+        with self._lock:
+            uid = self._by_email.get(email.lower())
+            if uid is None:
+                self.misses += 1
+                return None
+            return self._get(uid)
+
+    def _get(self, uid: str) -> Optional[dict]:
+        entry = self._entries.get(uid)
+        if entry is None or entry[0] < time.monotonic():
+            self._remove(uid)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(uid)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, record: dict, token: int):
+        """
+        Cache a user record read from Firebase Authentication.
+
+        :param record: The serialized user record, with at least its "uid".
+        :param token: The value of ``token()`` taken before the read.
+        """
+        if self.ttl <= 0:
+            return
+        uid = record["uid"]
+        with self._lock:
+            if token < self._forgotten or self._invalidations.get(uid, -1) > token:
+                return
+            self._remove(uid)
+            self._entries[uid] = (time.monotonic() + self.ttl, record)
+            if record.get("email"):
+                self._by_email[record["email"].lower()] = uid
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, uid: str):
+        """
+        Drop a user from the cache after it was updated or deleted.
+        """
+        with self._lock:
+            self._counter += 1
+            self.invalidations += 1
+            self._invalidations[uid] = self._counter
+            self._invalidations.move_to_end(uid)
+            if len(self._invalidations) > MAX_TRACKED_INVALIDATIONS:
+                _, self._forgotten = self._invalidations.popitem(last=False)
+            self._remove(uid)
+
+    def _remove(self, uid: str):
+        entry = self._entries.pop(uid, None)
+        if entry is not None and entry[1].get("email"):
+            email = entry[1]["email"].lower()
+            if self._by_email.get(email) == uid:
+                del self._by_email[email]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+user_cache = UserCache(ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE)
+
+
+class AggregationCache:
+    """
+    In-process LRU cache of aggregation results, e.g. counts, keyed by query.
+
+    Every entry belongs to the collection path it aggregates, or to the
+    collection ID of a collection group query. A write through the bridge to a
+    document drops the entries of its collection and of groups with its
+    collection ID; writes made elsewhere show after at most ``ttl`` seconds.
+    Like the other caches, ``set()`` takes a ``token()`` taken before the
+    query and drops results computed before an invalidation of their scope,
+    so writes to other collections do not hold back the insert.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, scope, result)
+        self._scopes = {}  # ("collection", path) or ("group", collection ID) -> keys
+        self._counter = 0
+        self._invalidations = OrderedDict()  # scope -> counter value when invalidated
+        self._prefix_invalidations = OrderedDict()  # invalidate_prefix() path -> counter value
+        self._forgotten = 0  # counter value of the newest invalidation no longer tracked
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def token(self) -> int:
+        return self._counter
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Return the cached result of a query, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key: str, scope: Tuple[str, str], result: dict, token: int):
+        """
+        Cache the result of a query.
+
+        :param key: The query, canonically serialized.
+        :param scope: ("collection", collection path) or ("group", collection ID).
+        :param result: The aggregation results.
+        :param token: The value of ``token()`` taken before the query.
+        """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if self._stale(scope, token):
+                return
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, scope, result)
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        """
+        Drop the results a write to the document at ``path`` may change.
+        """
+        collection_path = path.strip("/").rpartition("/")[0]
+        collection_id = collection_path.rpartition("/")[2]
+        with self._lock:
+            self._counter += 1
+            for scope in (("collection", collection_path), ("group", collection_id)):
+                self._drop_scope(scope)
+                self._track(self._invalidations, scope)
+
+    def invalidate_prefix(self, path: str):
+        """
+        Drop the results of every collection below a collection or document path.
+        """
+        prefix = path.strip("/")
+        with self._lock:
+            self._counter += 1
+            for scope in list(self._scopes):
+                if self._below(scope, prefix):
+                    self._drop_scope(scope)
+            self._track(self._prefix_invalidations, prefix)
+
+    @staticmethod
+    def _below(scope: Tuple[str, str], prefix: str) -> bool:
+        kind, name = scope
+        return kind == "group" or name == prefix or name.startswith(prefix + "/")
+
+    def _track(self, invalidations: OrderedDict, key):
+        invalidations[key] = self._counter
+        invalidations.move_to_end(key)
+        if len(invalidations) > MAX_TRACKED_INVALIDATIONS:
+            _, forgotten = invalidations.popitem(last=False)
+            self._forgotten = max(self._forgotten, forgotten)
+
+    def _stale(self, scope: Tuple[str, str], token: int) -> bool:
+        """
+        Whether results of ``scope`` computed after ``token()`` returned
+        ``token`` may predate an invalidation.
+        """
+        if token < self._forgotten or self._invalidations.get(scope, -1) > token:
+            return True
+        return any(
+            counter > token and self._below(scope, prefix)
+            for prefix, counter in self._prefix_invalidations.items()
+        )
+
+    def _drop_scope(self, scope: Tuple[str, str]):
+        keys = self._scopes.pop(scope, ())
+        for key in keys:
+            self._entries.pop(key, None)
+        self.invalidations += len(keys)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._scopes.get(entry[1])
+            keys.discard(key)
+            if not keys:
+                del self._scopes[entry[1]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+aggregation_cache = AggregationCache(ttl=AGGREGATION_CACHE_TTL, max_entries=AGGREGATION_CACHE_SIZE)
+
+
+def no_cache(cache_control: Optional[str]) -> bool:
+    """
+    Whether a request's Cache-Control header asks to bypass the cache.
+    """
+    if not cache_control:
+        return False
+    directives = {directive.strip().lower() for directive in cache_control.split(",")}
+    return "no-cache" in directives or "no-store" in directives
@@ -0,0 +1,284 @@
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+
+from app.constants import COMPRESSION_LEVELS, COMPRESSION_MIN_SIZE, MAX_REQUEST_BODY_BYTES
+
+# brotli and zstandard are optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_LEVELS = {"zstd": 3, "br": 5, "gzip": 6}
+
+# responses of these types are compressed files already, e.g. exports
+COMPRESSED_MEDIA_TYPES = ("application/gzip", "application/zstd")
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+# encodings in order of preference, when the client accepts several equally
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = ZstdCompressor
+if brotli is not None:
+    COMPRESSORS["br"] = BrotliCompressor
+COMPRESSORS["gzip"] = GzipCompressor
+
+
+def new_compressor(encoding: str, levels: Optional[dict] = None):
+    """
+    Create a streaming compressor for a content encoding.
+
+    :param encoding: One of the keys of ``COMPRESSORS``.
+    :param levels: Compression level per encoding, defaults to ``COMPRESSION_LEVELS``.
+    :return: An object with ``compress``, ``flush`` and ``finish`` methods.
+    """
+    levels = COMPRESSION_LEVELS if levels is None else levels
+    return COMPRESSORS[encoding](levels.get(encoding, DEFAULT_LEVELS[encoding]))
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the response encoding from an Accept-Encoding header.
+
+    :param accept_encoding: The header value, e.g. "gzip;q=0.8, br".
+    :return: The supported encoding with the highest quality value, or None.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in COMPRESSORS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def decompress(encoding: str, data: bytes, max_size: int) -> bytes:
+    """
+    Decompress a request body.
+
+    :param encoding: The request's Content-Encoding.
+    :param data: The compressed body.
+    :param max_size: Largest decompressed size accepted.
+    :return: The decompressed body.
+    :raises ValueError: If the encoding is not supported or the body is invalid.
+    :raises OverflowError: If the body decompresses to more than ``max_size`` bytes.
+    """
+    if encoding in ("gzip", "deflate"):
+        body = b""
+        try:
+            # a gzip body may hold several members, all counted against max_size
+            while data and len(body) <= max_size:
+                decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+                body += decompressor.decompress(data, max_size + 1 - len(body))
+                data = decompressor.unused_data if decompressor.eof else b""
+        except zlib.error as e:
+            raise ValueError(str(e))
+    elif encoding == "br" and brotli is not None:
+        decompressor = brotli.Decompressor()
+        try:
+            # output past max_size is never produced, so a small bomb cannot fill the memory
+            body = decompressor.process(data, output_buffer_limit=max_size + 1)
+            while len(body) <= max_size and not decompressor.can_accept_more_data():
+                body += decompressor.process(b"", output_buffer_limit=max_size + 1 - len(body))
+        except brotli.error as e:
+            raise ValueError(str(e))
+    elif encoding == "zstd" and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                body = reader.read(max_size + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(str(e))
+    else:
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+    if len(body) > max_size:
+        raise OverflowError("Request body too large")
+    return body
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses and decompressing request bodies.
+
+    Responses are compressed with the best encoding the client accepts. Complete
+    bodies under ``minimum_size`` bytes, and compressed files, are sent as is. Streaming responses
+    (NDJSON, Server-Sent Events) are compressed chunk by chunk and flushed
+    after every chunk, so clients receive each line as soon as it is produced.
+
+    Request bodies sent with a Content-Encoding of gzip, deflate, br or zstd are
+    decompressed before they reach the endpoints.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, max_request_size: int = MAX_REQUEST_BODY_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.max_request_size = max_request_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "identity").lower()
+        if content_encoding != "identity":
+            try:
+                scope, receive = await self._decompress_request(scope, receive, content_encoding)
+            except OverflowError as e:
+                await PlainTextResponse(str(e), status_code=413)(scope, receive, send)
+                return
+            except ValueError as e:
+                await PlainTextResponse(str(e), status_code=415)(scope, receive, send)
+                return
+
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressedResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+    async def _decompress_request(self, scope, receive, encoding):
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.max_request_size:
+                raise OverflowError("Request body too large")
+            more_body = message.get("more_body", False)
+        body = decompress(encoding, b"".join(chunks), self.max_request_size)
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+
+        sent = False
+
+        async def decompressed_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return scope, decompressed_receive
+
+
+class CompressedResponder:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            if (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith(COMPRESSED_MEDIA_TYPES)
+                or self.start_message["status"] in (204, 304)
+                or (not more_body and len(body) < self.minimum_size)
+            ):
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+            self.compressor = new_compressor(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+            await self._send(self.start_message)
+
+        if more_body:
+            data = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            data = self.compressor.compress(body) + self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -5,6 +5,102 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # get a environment variable called GOOGLE_APPLICATION_CREDENTIALS
-# and assign it to the variable GOOGLE_APPLICATION_CREDENTIALS
-GOOGLE_APPLICATION_CREDENTIALS = json.loads(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-TEST_USER_EMAIL = os.getenv("TEST_USER_EMAIL")
\ No newline at end of file
+# and assign it to the variable GOOGLE_APPLICATION_CREDENTIALS; the JSON is
+# parsed when Firebase is initialized, see app.init_firebase
+GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+TEST_USER_EMAIL = os.getenv("TEST_USER_EMAIL")
+
+# number of threads used to run the synchronous firebase_admin calls,
+# i.e. the maximum number of in-flight Firebase requests per worker
+FIREBASE_THREAD_POOL_SIZE = int(os.getenv("FIREBASE_THREAD_POOL_SIZE", "32"))
+
+# maximum number of resolved Firestore references kept in the LRU cache
+FIRESTORE_REF_CACHE_SIZE = int(os.getenv("FIRESTORE_REF_CACHE_SIZE", "4096"))
+
+# write rate used by the BulkWriter that deletes collections; Firestore's
+# 500/50/5 ramp-up rule applies to live traffic, test collections can go faster
+FIRESTORE_DELETE_OPS_PER_SECOND = int(os.getenv("FIRESTORE_DELETE_OPS_PER_SECOND", "2000"))
+
+# read-through document cache: seconds a document stays cached, per collection
+# ID (e.g. '{"config": 300, "profiles": 30}') and for every other collection.
+# A TTL of 0 disables caching, so by default nothing is cached.
+FIRESTORE_CACHE_TTLS = json.loads(os.getenv("FIRESTORE_CACHE_TTLS", "{}"))
+FIRESTORE_CACHE_DEFAULT_TTL = float(os.getenv("FIRESTORE_CACHE_DEFAULT_TTL", "0"))
+# approximate memory bound of the cache, in bytes of JSON-encoded documents
+FIRESTORE_CACHE_MAX_BYTES = int(os.getenv("FIRESTORE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# realtime change feed: events buffered per client before a slow client is
+# disconnected, and seconds between keep-alive comments on idle streams
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+REALTIME_HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "15"))
+
+# response compression: bodies smaller than COMPRESSION_MIN_SIZE bytes are sent
+# as is; COMPRESSION_LEVELS overrides the level per encoding,
+# e.g. '{"gzip": 6, "br": 5, "zstd": 3}'
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500"))
+COMPRESSION_LEVELS = json.loads(os.getenv("COMPRESSION_LEVELS", "{}"))
+# largest request body accepted once decompressed, in bytes
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(32 * 1024 * 1024)))
+
+# number of document deletions remembered to report as tombstones to /sync
+TOMBSTONE_LOG_SIZE = int(os.getenv("TOMBSTONE_LOG_SIZE", "100000"))
+
+# ID token verification: seconds verified tokens and the revocation state of
+# users stay cached, and how many of each are kept
+ID_TOKEN_CACHE_TTL = float(os.getenv("ID_TOKEN_CACHE_TTL", "300"))
+REVOCATION_CACHE_TTL = float(os.getenv("REVOCATION_CACHE_TTL", "30"))
+ID_TOKEN_CACHE_SIZE = int(os.getenv("ID_TOKEN_CACHE_SIZE", "10000"))
+# when true, every request outside ID_TOKEN_EXEMPT_PATHS (comma separated) needs an
+# "Authorization: Bearer <ID token>" header
+REQUIRE_ID_TOKEN = os.getenv("REQUIRE_ID_TOKEN", "false").lower() in ("1", "true", "yes")
+ID_TOKEN_EXEMPT_PATHS = os.getenv(
+    "ID_TOKEN_EXEMPT_PATHS", "/,/docs,/redoc,/openapi.json,/metrics,/healthz,/readyz,/user/verify_token"
+).split(",")
+
+# user record cache: seconds a user read from Firebase Authentication stays
+# cached, 0 disables it, and how many users are kept
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "0"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# aggregation cache: seconds a count/sum/avg result stays cached, 0 disables
+# it, and how many results are kept
+AGGREGATION_CACHE_TTL = float(os.getenv("AGGREGATION_CACHE_TTL", "0"))
+AGGREGATION_CACHE_SIZE = int(os.getenv("AGGREGATION_CACHE_SIZE", "1000"))
+
+# request and Firebase call metrics served at /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# write-behind queue for requests sent with "Prefer: respond-async": seconds
+# writes to a document are held and coalesced before they are committed, and
+# how many documents may have queued writes before new ones are refused
+WRITE_BEHIND_WINDOW = float(os.getenv("WRITE_BEHIND_WINDOW", "1.0"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+
+# initialize Firebase and make one Firestore read in the background at startup,
+# so that /readyz only reports ready once the connection is open
+FIREBASE_PREWARM = os.getenv("FIREBASE_PREWARM", "false").lower() in ("1", "true", "yes")
+
+# directory /firestore/export may write export files to; exports to files are
+# disabled when it is not set
+EXPORT_DIR = os.getenv("EXPORT_DIR", "")
+
+# upstream call layer, see app.upstream: the adaptive limit on Firebase calls in
+# flight ranges from UPSTREAM_MIN_CONCURRENCY to FIREBASE_THREAD_POOL_SIZE, and
+# calls over it wait in a queue of UPSTREAM_MAX_QUEUE calls for up to
+# UPSTREAM_QUEUE_TIMEOUT seconds before failing with 429
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "1"))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "1000"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10"))
+# attempts per call when Firebase is overloaded or unavailable, and the
+# exponential backoff between them, in seconds, before jitter
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.1"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "2"))
+# retry budget: a failed call takes a token, a successful one gives back
+# UPSTREAM_RETRY_TOKEN_RATIO, and retries stop below half the tokens
+UPSTREAM_RETRY_TOKENS = float(os.getenv("UPSTREAM_RETRY_TOKENS", "10"))
+UPSTREAM_RETRY_TOKEN_RATIO = float(os.getenv("UPSTREAM_RETRY_TOKEN_RATIO", "0.1"))
+# circuit breaker: consecutive unavailable errors that open it, and seconds it
+# fails calls fast before letting a probe call through
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "10"))
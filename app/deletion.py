@@ -0,0 +1,118 @@
+import threading
+import time
+
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+from google.cloud.firestore_v1.field_path import FieldPath
+from pydantic import BaseModel
+
+from app.constants import FIRESTORE_DELETE_OPS_PER_SECOND
+from app.init_firebase import db
+from app.tombstones import tombstones
+
+# attempts per document before a failed delete is given up and counted
+MAX_DELETE_ATTEMPTS = 10
+
+
+class DeletionStats(BaseModel):
+    documents_deleted: int = 0
+    documents_failed: int = 0
+    collections: int = 0
+    elapsed_seconds: float = 0.0
+
+
+def delete_collection(collection_ref, page_size: int = 500, recursive: bool = False) -> DeletionStats:
+    """
+    Delete every document in a collection.
+
+    Documents are paged through with query cursors and deleted with a BulkWriter,
+    which sends parallel batched writes and retries failed ones.
+
+    :param collection_ref: Reference to the collection to be deleted.
+    :param page_size: Number of documents fetched per page.
+    :param recursive: Also delete the subcollections of every document,
+        including documents that only exist as the parent of a subcollection.
+    :return: Counts of deleted and failed documents, visited collections and the
+        elapsed time.
+    """
+    return _run_deletion(lambda bulk_writer, stats: _delete_collection(
+        collection_ref, bulk_writer, stats, page_size, recursive
+    ))
+
+
+def delete_document(doc_ref, page_size: int = 500, recursive: bool = False) -> DeletionStats:
+    """
+    Delete a document, and optionally every subcollection below it.
+
+    :param doc_ref: Reference to the document to be deleted.
+    :param page_size: Number of documents fetched per page in subcollections.
+    :param recursive: Also delete the subcollections of the document.
+    :return: Counts of deleted and failed documents, visited collections and the
+        elapsed time.
+    """
+    return _run_deletion(lambda bulk_writer, stats: _delete_document(
+        doc_ref, bulk_writer, stats, page_size, recursive
+    ))
+
+
+def _run_deletion(delete) -> DeletionStats:
+    stats = DeletionStats()
+    lock = threading.Lock()
+
+    # BulkWriter reports results from its own sender threads
+    def on_write_result(reference, result, bulk_writer):
+        tombstones.record(reference.path)
+        with lock:
+            stats.documents_deleted += 1
+
+    def on_write_error(failure, bulk_writer):
+        if failure.attempts < MAX_DELETE_ATTEMPTS:
+            return True
+        with lock:
+            stats.documents_failed += 1
+        return False
+
+    start = time.perf_counter()
+    bulk_writer = db.bulk_writer(BulkWriterOptions(
+        initial_ops_per_second=FIRESTORE_DELETE_OPS_PER_SECOND,
+        max_ops_per_second=FIRESTORE_DELETE_OPS_PER_SECOND,
+    ))
+    bulk_writer.on_write_result(on_write_result)
+    bulk_writer.on_write_error(on_write_error)
+    try:
+        delete(bulk_writer, stats)
+    finally:
+        bulk_writer.close()
+    stats.elapsed_seconds = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def _delete_collection(collection_ref, bulk_writer, stats, page_size, recursive):
+    stats.collections += 1
+    if recursive:
+        # list_documents also returns "missing" documents, which have no fields
+        # but still hold subcollections, and are invisible to queries
+        for doc_ref in collection_ref.list_documents(page_size=page_size):
+            _delete_document(doc_ref, bulk_writer, stats, page_size, recursive)
+        return
+
+    query = (
+        collection_ref.order_by(FieldPath.document_id())
+        .select([FieldPath.document_id()])
+        .limit(page_size)
+    )
+    cursor = None
+    while True:
+        page = query.start_after(cursor) if cursor else query
+        docs = list(page.stream())
+        for doc in docs:
+            bulk_writer.delete(doc.reference)
+        if len(docs) < page_size:
+            return
+        cursor = docs[-1]
+
+
+def _delete_document(doc_ref, bulk_writer, stats, page_size, recursive):
+    if recursive:
+        for collection_ref in doc_ref.collections():
+            _delete_collection(collection_ref, bulk_writer, stats, page_size, recursive)
+    bulk_writer.delete(doc_ref)
@@ -0,0 +1,118 @@
+import base64
+import datetime
+import json
+import math
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+from google.cloud.firestore_v1.base_document import BaseDocumentReference
+from google.cloud.firestore_v1.vector import Vector
+
+# Tags of the lossless encoding of Firestore values used by exports: every
+# value JSON cannot hold exactly is an object with one of these keys, and maps
+# with a key starting with "$" are wrapped in {"$map": ...} to stay unambiguous.
+TIMESTAMP_TAG = "$timestamp"
+GEOPOINT_TAG = "$geopoint"
+REFERENCE_TAG = "$reference"
+BYTES_TAG = "$bytes"
+DOUBLE_TAG = "$double"
+VECTOR_TAG = "$vector"
+MAP_TAG = "$map"
+
+
+def firestore_json_default(obj):
+    """
+    ``json.dumps`` hook for the Firestore value types JSON has no encoding for.
+
+    :param obj: A value returned by Firestore.
+    :return: A JSON-serializable representation of ``obj``.
+    """
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    if isinstance(obj, GeoPoint):
+        return {"latitude": obj.latitude, "longitude": obj.longitude}
+    if isinstance(obj, BaseDocumentReference):
+        return obj.path
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode("ascii")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def ndjson_line(obj) -> bytes:
+    """
+    Encode one object as a newline-terminated JSON line.
+
+    :param obj: The object to encode.
+    :return: UTF-8 encoded JSON followed by a newline.
+    """
+    return json.dumps(obj, default=firestore_json_default, separators=(",", ":")).encode() + b"\n"
+
+
+def encode_value(value):
+    """
+    Encode a Firestore value as JSON-serializable data without losing its
+    type or precision, see ``decode_value``.
+
+    Timestamps keep their nanoseconds, references their full path, and
+    NaN and infinities are kept as strings.
+
+    :param value: A value returned by Firestore, e.g. ``snapshot.to_dict()``.
+    :return: The encoded value.
+    """
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else {DOUBLE_TAG: str(value)}
+    if isinstance(value, dict):
+        encoded = {key: encode_value(item) for key, item in value.items()}
+        if any(key.startswith("$") for key in value):
+            return {MAP_TAG: encoded}
+        return encoded
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    if isinstance(value, DatetimeWithNanoseconds):
+        return {TIMESTAMP_TAG: value.rfc3339()}
+    if isinstance(value, datetime.datetime):
+        return {TIMESTAMP_TAG: value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")}
+    if isinstance(value, GeoPoint):
+        return {GEOPOINT_TAG: [value.latitude, value.longitude]}
+    if isinstance(value, BaseDocumentReference):
+        return {REFERENCE_TAG: value.path}
+    if isinstance(value, bytes):
+        return {BYTES_TAG: base64.b64encode(value).decode("ascii")}
+    if isinstance(value, Vector):
+        return {VECTOR_TAG: list(value)}
+    raise TypeError(f"Cannot encode a value of type {type(value).__name__}")
+
+
+def decode_value(value, client=None):
+    """
+    Decode a value encoded by ``encode_value``.
+
+    :param value: The encoded value.
+    :param client: The Firestore client references are made with; they are
+        decoded to their path when None.
+    :return: The Firestore value.
+    """
+    if isinstance(value, list):
+        return [decode_value(item, client) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        tag, item = next(iter(value.items()))
+        if tag == MAP_TAG:
+            return {key: decode_value(member, client) for key, member in item.items()}
+        if tag == TIMESTAMP_TAG:
+            return DatetimeWithNanoseconds.from_rfc3339(item)
+        if tag == GEOPOINT_TAG:
+            return GeoPoint(*item)
+        if tag == REFERENCE_TAG:
+            return client.document(item) if client is not None else item
+        if tag == BYTES_TAG:
+            return base64.b64decode(item)
+        if tag == DOUBLE_TAG:
+            return float(item)
+        if tag == VECTOR_TAG:
+            return Vector(item)
+    return {key: decode_value(item, client) for key, item in value.items()}
+
@@ -0,0 +1,109 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from app.constants import FIREBASE_THREAD_POOL_SIZE, METRICS_ENABLED
+from app.init_firebase import initialize, initialized
+from app.metrics import UpstreamTimer, operation_name
+from app.upstream import RETRY_IDEMPOTENT, RETRY_NEVER, RETRY_REFUSED, call_upstream
+
+# The firebase_admin SDK is synchronous, so every upstream call made from an
+# async endpoint is handed to this bounded pool instead of blocking the event
+# loop. The pool size caps the number of in-flight Firebase calls per worker.
+executor = ThreadPoolExecutor(
+    max_workers=FIREBASE_THREAD_POOL_SIZE,
+    thread_name_prefix="firebridge",
+)
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run a blocking Firebase call on the shared thread pool.
+
+    The call goes through the upstream call layer, see ``app.upstream``: it
+    waits for a slot under the adaptive concurrency limit, and is only
+    retried when Firebase refused it as overloaded, since after any other
+    error it may have run. Use ``run_read`` for calls that may run twice.
+    Every attempt is timed under the name of ``func``, see
+    ``app.metrics.operation_name``.
+
+    :param func: The synchronous callable to run, e.g. ``doc_ref.update``.
+    :param args: Positional arguments passed to ``func``.
+    :param kwargs: Keyword arguments passed to ``func``.
+    :return: Whatever ``func`` returns.
+    :raises app.upstream.UpstreamError: If Firebase stayed overloaded or unavailable.
+    """
+    return await _run(operation_name(func), functools.partial(func, *args, **kwargs), RETRY_REFUSED)
+
+
+async def run_read(func, *args, **kwargs):
+    """
+    Run an idempotent blocking Firebase call, e.g. ``doc_ref.get``, on the
+    shared thread pool, like ``run_sync``, but also retried when Firebase is
+    unavailable or the call timed out.
+    """
+    return await _run(operation_name(func), functools.partial(func, *args, **kwargs), RETRY_IDEMPOTENT)
+
+
+async def ensure_initialized():
+    """
+    Initialize Firebase lazily, off the event loop, before its first use.
+
+    A failure is reported by /readyz, and by the call that needs Firebase.
+    """
+    if not initialized():
+        try:
+            await asyncio.get_running_loop().run_in_executor(executor, initialize)
+        except Exception:
+            pass
+
+
+async def _run(operation: str, call, retry):
+    loop = asyncio.get_running_loop()
+    await ensure_initialized()
+
+    async def attempt():
+        if not METRICS_ENABLED:
+            return await loop.run_in_executor(executor, call)
+        with UpstreamTimer(operation):
+            return await loop.run_in_executor(executor, call)
+
+    return await call_upstream(attempt, retry)
+
+
+def shutdown_executor():
+    """
+    Wait for the in-flight Firebase calls to finish and release the pool threads.
+    """
+    executor.shutdown(wait=True)
+
+
+def _next_chunk(iterator, chunk_size):
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            break
+    return chunk
+
+
+async def iterate_sync(iterable, chunk_size: int = 100):
+    """
+    Consume a blocking iterator, such as ``query.stream()``, on the shared thread pool.
+
+    Items are pulled ``chunk_size`` at a time, and the next chunk is only fetched
+    once the consumer has taken the previous one, so memory stays bounded.
+
+    :param iterable: The synchronous iterable to consume.
+    :param chunk_size: Number of items fetched per trip to the thread pool.
+    :return: An async iterator over the items of ``iterable``.
+    """
+    iterator = iter(iterable)
+    operation = f"{type(iterable).__name__}.__next__"
+    while True:
+        # a stream that failed cannot be resumed, so chunks are not retried
+        chunk = await _run(operation, functools.partial(_next_chunk, iterator, chunk_size), RETRY_NEVER)
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
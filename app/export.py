@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import string
+import time
+from typing import List, Optional, Tuple
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from app.compression import COMPRESSORS, new_compressor
+from app.encoding import encode_value
+from app.executor import executor, run_read
+
+# media type and file extension of an export, by encoding
+EXPORT_FORMATS = {
+    "gzip": ("application/gzip", ".ndjson.gz"),
+    "zstd": ("application/zstd", ".ndjson.zst"),
+    "identity": ("application/x-ndjson", ".ndjson"),
+}
+
+
+# the characters of auto-generated document IDs, in the order Firestore sorts them
+AUTO_ID_CHARACTERS = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_encodings() -> List[str]:
+    return [encoding for encoding in EXPORT_FORMATS if encoding == "identity" or encoding in COMPRESSORS]
+
+
+def collection_query(collection_ref, recursive: bool):
+    """
+    The query reading a collection in document ID order, with every document
+    below it when ``recursive``.
+
+    A recursive query also finds the documents of subcollections whose parent
+    document does not exist.
+    """
+    if recursive:
+        return collection_ref.recursive()
+    return collection_ref.order_by(FieldPath.document_id())
+
+
+def id_ranges(count: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Split document IDs into ``count`` contiguous ranges of about as many
+    auto-generated IDs, as (start, end) bounds of their first character.
+
+    The first range has no start and the last no end, so that every ID, e.g.
+    a custom one, falls in exactly one range.
+    """
+    count = min(count, len(AUTO_ID_CHARACTERS))
+    bounds = [AUTO_ID_CHARACTERS[len(AUTO_ID_CHARACTERS) * i // count] for i in range(1, count)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def partitioned_queries(collection_ref, recursive: bool, count: int) -> list:
+    """
+    The queries reading a collection in ``count`` ranges of document IDs, see
+    ``id_ranges``, which may be read in parallel. A recursive query's range
+    also holds the documents below the collection's documents in that range.
+    """
+    query = collection_query(collection_ref, recursive)
+    queries = []
+    for start, end in id_ranges(count):
+        part = query
+        # references rather than IDs: a recursive query's parent is the root
+        if start is not None:
+            part = part.start_at({"__name__": collection_ref.document(start)})
+        if end is not None:
+            part = part.end_before({"__name__": collection_ref.document(end)})
+        queries.append(part)
+    return queries
+
+
+def read_page(query, page_size: int, cursor=None) -> list:
+    """
+    Read the page of ``page_size`` documents after the ``cursor`` snapshot.
+    """
+    page = query.limit(page_size)
+    if cursor is not None:
+        page = page.start_after(cursor)
+    return list(page.stream())
+
+
+def list_collections(doc_ref) -> list:
+    return list(doc_ref.collections())
+
+
+def export_line(snapshot) -> bytes:
+    """
+    Encode a document as one NDJSON line, with its values encoded losslessly,
+    see ``app.encoding.encode_value``.
+    """
+    return json.dumps({
+        "path": snapshot.reference.path,
+        "create_time": encode_value(snapshot.create_time),
+        "update_time": encode_value(snapshot.update_time),
+        "data": encode_value(snapshot.to_dict()),
+    }, separators=(",", ":"), allow_nan=False).encode() + b"\n"
+
+
+class Export:
+    """
+    Export of a collection or document as NDJSON, one line per document,
+    optionally compressed.
+
+    Pages of ``page_size`` documents are read with query cursors, by up to
+    ``concurrency`` readers at a time, into a queue of at most
+    ``concurrency`` pages. A collection is split into ``concurrency`` ranges
+    of document IDs read in parallel, and the collections of a document are
+    read in parallel; documents are therefore not exported in ID order. Reading stops
+    while the queue is full, so a consumer slower than Firestore, e.g. a slow
+    client, holds back the reads and memory stays bounded by the page size.
+
+    The last line is a trailer with the number of documents exported and
+    whether the export is complete; an error is reported there, since the
+    response has already started.
+    """
+
+    def __init__(self, ref, is_document: bool, recursive: bool = False, page_size: int = 1000,
+                 concurrency: int = 2, encoding: str = "gzip"):
+        self.ref = ref
+        self.is_document = is_document
+        self.recursive = recursive
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.encoding = encoding
+        self.documents = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+        self.complete = False
+        self.elapsed_seconds = 0.0
+
+    async def chunks(self):
+        """
+        The export, as compressed chunks of about one page each.
+        """
+        start = time.perf_counter()
+        compressor = new_compressor(self.encoding) if self.encoding != "identity" else None
+        pages = asyncio.Queue(maxsize=self.concurrency)
+        reader = asyncio.ensure_future(self._read(pages))
+        try:
+            while True:
+                page = await pages.get()
+                if page is None:
+                    self.complete = True
+                    break
+                if isinstance(page, Exception):
+                    self.error = f"Error exporting documents: {page}"
+                    break
+                # local work, kept out of the upstream call layer
+                chunk = await asyncio.get_running_loop().run_in_executor(executor, self._encode, page, compressor)
+                self.documents += len(page)
+                if chunk:
+                    self.bytes += len(chunk)
+                    yield chunk
+            trailer = {"documents": self.documents, "complete": self.complete}
+            if self.error is not None:
+                trailer["error"] = self.error
+            chunk = self._encode_trailer(trailer, compressor)
+            self.bytes += len(chunk)
+            self.elapsed_seconds = round(time.perf_counter() - start, 3)
+            yield chunk
+        finally:
+            reader.cancel()
+
+    def _encode(self, page: list, compressor) -> bytes:
+        data = b"".join(export_line(snapshot) for snapshot in page)
+        return compressor.compress(data) if compressor is not None else data
+
+    def _encode_trailer(self, trailer: dict, compressor) -> bytes:
+        data = json.dumps({"export": trailer}, separators=(",", ":")).encode() + b"\n"
+        return compressor.compress(data) + compressor.finish() if compressor is not None else data
+
+    async def _read(self, pages: asyncio.Queue):
+        try:
+            if self.is_document:
+                snapshot = await run_read(self.ref.get)
+                if snapshot.exists:
+                    await pages.put([snapshot])
+                collections = await run_read(list_collections, self.ref) if self.recursive else []
+                queries = [collection_query(collection_ref, True) for collection_ref in collections]
+            else:
+                queries = partitioned_queries(self.ref, self.recursive, self.concurrency)
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            readers = [asyncio.ensure_future(self._read_query(query, pages, semaphore)) for query in queries]
+            try:
+                await asyncio.gather(*readers)
+            finally:
+                for task in readers:
+                    task.cancel()
+            await pages.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await pages.put(e)
+
+    async def _read_query(self, query, pages: asyncio.Queue, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            cursor = None
+            while True:
+                page = await run_read(read_page, query, self.page_size, cursor)
+                if page:
+                    await pages.put(page)
+                if len(page) < self.page_size:
+                    return
+                cursor = page[-1]
+
+
+def export_file_path(directory: str, name: str) -> str:
+    """
+    The path of an export file in the export directory.
+
+    :raises ExportError: If exports to files are disabled or ``name`` is not a plain file name.
+    """
+    if not directory:
+        raise ExportError("Exports to files are disabled, set EXPORT_DIR")
+    if os.path.basename(name) != name or name in (".", ".."):
+        raise ExportError("The export file must be a plain file name")
+    return os.path.join(directory, name)
+
+
+async def export_to_file(export: Export, path: str):
+    """
+    Write an export to a file, which only appears under its name once complete.
+
+    :raises ExportError: If the export failed; nothing is left behind.
+    """
+    part_path = path + ".part"
+    try:
+        loop = asyncio.get_running_loop()
+        with open(part_path, "wb") as file:
+            async for chunk in export.chunks():
+                await loop.run_in_executor(executor, file.write, chunk)
+        if not export.complete:
+            raise ExportError(export.error)
+        os.replace(part_path, path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
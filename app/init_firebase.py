@@ -1,9 +1,95 @@
+import json
+import threading
+
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
 
 from app.constants import GOOGLE_APPLICATION_CREDENTIALS
 
-cred = credentials.Certificate(GOOGLE_APPLICATION_CREDENTIALS)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
\ No newline at end of file
+# Firebase is initialized on first use instead of on import: importing the app
+# stays cheap and needs no credentials, health checks answer before Firebase is
+# reached, and workers forked from a preloaded parent each open their own
+# connections instead of inheriting the parent's.
+
+# document read by prewarm(); it does not need to exist
+PREWARM_DOCUMENT = "firebridge/prewarm"
+
+_lock = threading.Lock()
+_client = None
+_error = None
+_prewarmed = False
+
+
+def initialized() -> bool:
+    return _client is not None
+
+
+def initialize():
+    """
+    Initialize the default Firebase app and the Firestore client, once per process.
+
+    The firebase_admin.auth functions need the default app, so this runs
+    before every upstream call, see ``app.executor.run_sync``. An app
+    initialized elsewhere, e.g. by tests, is reused.
+
+    :return: The Firestore client.
+    """
+    global _client, _error
+    if _client is not None:
+        return _client
+    with _lock:
+        if _client is None:
+            try:
+                try:
+                    app = firebase_admin.get_app()
+                except ValueError:
+                    app = firebase_admin.initialize_app(credentials.Certificate(_service_account()))
+                _client = firestore.client(app)
+                _error = None
+            except Exception as e:
+                _error = f"{type(e).__name__}: {e}"
+                raise
+    return _client
+
+
+def _service_account() -> dict:
+    if not GOOGLE_APPLICATION_CREDENTIALS:
+        raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS is not set")
+    return json.loads(GOOGLE_APPLICATION_CREDENTIALS)
+
+
+def prewarm():
+    """
+    Initialize Firebase and make one Firestore read, so that the credentials,
+    the access token and the connection are ready before traffic arrives.
+
+    Errors are recorded in ``status()``: an app that failed to initialize
+    stays unready, a failed read is otherwise ignored.
+    """
+    global _prewarmed, _error
+    try:
+        client = initialize()
+    except Exception:
+        return
+    try:
+        client.document(PREWARM_DOCUMENT).get()
+    except Exception as e:
+        _error = f"{type(e).__name__}: {e}"
+    _prewarmed = True
+
+
+def status() -> dict:
+    return {"initialized": initialized(), "prewarmed": _prewarmed, "error": _error}
+
+
+class LazyClient:
+    """
+    Stand-in for the Firestore client that initializes Firebase on first use.
+    """
+
+    def __getattr__(self, name):
+        return getattr(initialize(), name)
+
+
+db = LazyClient()
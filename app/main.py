@@ -1,15 +1,84 @@
+import asyncio
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app import init_firebase, upstream
 from app.routers import user
 from app.routers import firestore
+from app.routers import pipeline
+from app.compression import CompressionMiddleware
+from app.constants import FIREBASE_PREWARM, METRICS_ENABLED, REQUIRE_ID_TOKEN
+from app.executor import run_read, shutdown_executor
+from app.metrics import MetricsMiddleware, registry
+from app.tokens import IdTokenMiddleware
 
 app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+if REQUIRE_ID_TOKEN:
+    app.add_middleware(IdTokenMiddleware)
+# outermost, so that latencies and sizes include authentication and compression
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 app.include_router(user.router, prefix="/user")
 app.include_router(firestore.router, prefix="/firestore")
+app.include_router(pipeline.router)
 
 @app.get("/")
 async def root():
     return {"message": "Hello, Firebridge!"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Request and Firebase call metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/upstream_stats")
+async def upstream_stats():
+    """
+    State of the upstream call layer: the adaptive concurrency limit, the
+    circuit breaker and the retry budget.
+    """
+    return upstream.stats()
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness check, answered without reaching Firebase.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness check: 503 while the startup prewarm runs, or when Firebase
+    could not be initialized, e.g. because of missing credentials.
+    """
+    status = init_firebase.status()
+    ready = (status["prewarmed"] or not FIREBASE_PREWARM) and (status["initialized"] or status["error"] is None)
+    return JSONResponse(dict(status, ready=ready), status_code=200 if ready else 503)
+
+
+prewarm_task = None
+
+
+@app.on_event("startup")
+async def on_startup():
+    global prewarm_task
+    if FIREBASE_PREWARM:
+        # in the background, so that health checks are served meanwhile
+        prewarm_task = asyncio.get_running_loop().create_task(run_read(init_firebase.prewarm))
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    # commit the queued writes while the thread pool still runs
+    try:
+        await firestore.write_queue.drain()
+    finally:
+        shutdown_executor()
@@ -0,0 +1,246 @@
+import time
+import types
+from bisect import bisect_left
+from typing import Sequence
+
+from starlette.routing import Match
+
+# Metrics are plain dicts of counters updated from the event loop thread only,
+# so recording a sample takes no lock: a dict lookup and a few additions.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# paths that match no route share one label, so scanners cannot blow up the label set
+UNMATCHED_ROUTE = "unmatched"
+MAX_CACHED_PATHS = 10000
+
+
+def _label_string(names: Sequence[str], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _label_string(self.label_names, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, labels: tuple = ()):
+        self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value: float, labels: tuple = ()):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def samples(self):
+        bucket_names = self.label_names + ("le",)
+        for labels, entry in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), entry):
+                cumulative += count
+                yield self.name + "_bucket", _label_string(bucket_names, labels + (bound,)), cumulative
+            yield self.name + "_sum", _label_string(self.label_names, labels), entry[-1]
+            yield self.name + "_count", _label_string(self.label_names, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in list(metric.samples()):
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    "firebridge_http_request_duration_seconds",
+    "Time from receiving a request to sending the end of its response.",
+    ("method", "route", "status"),
+))
+requests_in_flight = registry.register(Gauge(
+    "firebridge_http_requests_in_flight",
+    "Requests being served.",
+    ("method", "route"),
+))
+request_size = registry.register(Histogram(
+    "firebridge_http_request_size_bytes",
+    "Size of request bodies as received, before decompression.",
+    ("method", "route"),
+    SIZE_BUCKETS,
+))
+response_size = registry.register(Histogram(
+    "firebridge_http_response_size_bytes",
+    "Size of response bodies as sent, after compression.",
+    ("method", "route"),
+    SIZE_BUCKETS,
+))
+upstream_duration = registry.register(Histogram(
+    "firebridge_upstream_call_duration_seconds",
+    "Duration of the Firebase calls run on the thread pool, queueing included.",
+    ("operation", "outcome"),
+))
+upstream_in_flight = registry.register(Gauge(
+    "firebridge_upstream_calls_in_flight",
+    "Firebase calls submitted to the thread pool and not finished yet.",
+))
+
+
+_operation_names = {}
+
+
+def operation_name(func) -> str:
+    """
+    Name of the upstream operation a callable performs, e.g. "DocumentReference.get" or "auth.get_user".
+    """
+    owner = getattr(func, "__self__", None)
+    key = (type(owner), getattr(func, "__func__", func))
+    name = _operation_names.get(key)
+    if name is None:
+        if owner is not None and not isinstance(owner, types.ModuleType):
+            name = f"{type(owner).__name__}.{func.__name__}"
+        else:
+            module = getattr(func, "__module__", None) or ""
+            name = f"{module.rsplit('.', 1)[-1]}.{getattr(func, '__name__', type(func).__name__)}"
+        _operation_names[key] = name
+    return name
+
+
+class UpstreamTimer:
+    """
+    Context manager timing one upstream call, see ``app.executor.run_sync``.
+    """
+
+    __slots__ = ("operation", "start")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+
+    def __enter__(self):
+        upstream_in_flight.inc()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        upstream_duration.observe(
+            time.perf_counter() - self.start, (self.operation, "ok" if exc_type is None else "error")
+        )
+        upstream_in_flight.dec()
+        return False
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, status, in-flight count and payload
+    sizes of every request, labelled by route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = {}  # (method, path) -> route template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        labels = (method, route)
+        status = 500
+        received = 0
+        sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        requests_in_flight.inc(labels)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            request_duration.observe(time.perf_counter() - start, (method, route, str(status)))
+            requests_in_flight.dec(labels)
+            if received:
+                request_size.observe(received, labels)
+            response_size.observe(sent, labels)
+
+    def _route(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        route = self._routes.get(key)
+        if route is None:
+            route = UNMATCHED_ROUTE
+            for candidate in scope["app"].router.routes:
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = candidate.path
+                    break
+                if match == Match.PARTIAL and route == UNMATCHED_ROUTE:
+                    # the path exists for another method
+                    route = candidate.path
+            if len(self._routes) < MAX_CACHED_PATHS:
+                self._routes[key] = route
+        return route
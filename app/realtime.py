@@ -0,0 +1,232 @@
+import asyncio
+import json
+import threading
+from typing import Optional
+
+from google.cloud.firestore_v1.base_document import BaseDocumentReference
+
+from app.constants import REALTIME_HEARTBEAT_SECONDS, REALTIME_QUEUE_SIZE
+from app.encoding import firestore_json_default
+from app.executor import executor, run_read
+
+# queued in place of the events a slow client could not keep up with
+OVERFLOW = object()
+
+
+def sse_event(event: str, data) -> bytes:
+    """
+    Encode one Server-Sent Event.
+
+    :param event: The event name.
+    :param data: JSON-serializable event data.
+    :return: The encoded event, terminated by a blank line.
+    """
+    payload = json.dumps(data, default=firestore_json_default, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n".encode()
+
+
+def _document_data(snapshot) -> dict:
+    return {
+        "id": snapshot.id,
+        "path": snapshot.reference.path,
+        "exists": snapshot.exists,
+        "document_data": snapshot.to_dict(),
+        "update_time": snapshot.update_time,
+    }
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=REALTIME_QUEUE_SIZE)
+        self.initialized = False
+
+
+class SharedListener:
+    """
+    One upstream ``on_snapshot`` listener fanned out to every subscribed client.
+
+    Firestore calls ``_on_snapshot`` on its watch thread; events are encoded
+    once there and handed to each subscriber's queue on the event loop.
+    """
+
+    def __init__(self, ref, loop):
+        self.ref = ref
+        self.loop = loop
+        self.is_document = isinstance(ref, BaseDocumentReference)
+        self.subscribers = set()
+        self.latest = None
+        self.watch = None
+        self.started = None  # task starting the upstream listener
+        self.error = None  # why the upstream listener could not start
+        self._lock = threading.Lock()
+
+    def add(self, subscriber: Subscriber):
+        with self._lock:
+            self.subscribers.add(subscriber)
+            latest = self.latest
+            # under the lock, so that a snapshot arriving meanwhile sends changes only
+            subscriber.initialized = latest is not None
+        if latest is not None:
+            subscriber.queue.put_nowait(self._snapshot_event(latest))
+
+    def remove(self, subscriber: Subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def _snapshot_event(self, docs) -> bytes:
+        if self.is_document:
+            return sse_event("document", _document_data(docs[0]))
+        return sse_event("snapshot", {"documents": [_document_data(doc) for doc in docs]})
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            self.latest = docs
+            subscribers = [(subscriber, subscriber.initialized) for subscriber in self.subscribers]
+            for subscriber, _ in subscribers:
+                subscriber.initialized = True
+        if self.is_document:
+            snapshot_event = changes_event = self._snapshot_event(docs)
+        else:
+            snapshot_event = None
+            changes_event = sse_event("changes", {
+                "read_time": read_time,
+                "changes": [
+                    {"type": change.type.name, **_document_data(change.document)}
+                    for change in changes
+                ],
+            })
+        for subscriber, initialized in subscribers:
+            if initialized:
+                event = changes_event
+            else:
+                snapshot_event = snapshot_event or self._snapshot_event(docs)
+                event = snapshot_event
+            self.loop.call_soon_threadsafe(self._deliver, subscriber, event)
+
+    @staticmethod
+    def _deliver(subscriber: Subscriber, event: bytes):
+        queue = subscriber.queue
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(OVERFLOW)
+        else:
+            queue.put_nowait(event)
+
+
+class ListenerHub:
+    """
+    Registry of shared listeners, keyed by what they watch.
+
+    The first client watching a key starts the upstream listener, later clients
+    join it, and the listener is torn down when its last client leaves. The
+    registry is only touched from the event loop.
+    """
+
+    def __init__(self):
+        self.listeners = {}
+
+    async def subscribe(self, key: str, ref, subscriber: Optional[Subscriber] = None) -> Subscriber:
+        """
+        Subscribe to a document or query.
+
+        The upstream listener is started in a task of its own, so that a client
+        leaving while it starts does not lose the watch: it is stopped once
+        started if every client has left by then.
+
+        :param key: Identifies what is watched; clients using the same key share a listener.
+        :param ref: The ``DocumentReference``, ``CollectionReference`` or ``Query`` to watch.
+        :param subscriber: The subscriber to register, a new one by default.
+        :return: The subscriber, whose queue receives the encoded events.
+        :raises Exception: What starting the upstream listener raised, for
+            every client waiting for it.
+        """
+        subscriber = subscriber or Subscriber()
+        listener = self.listeners.get(key)
+        if listener is None:
+            listener = SharedListener(ref, asyncio.get_running_loop())
+            self.listeners[key] = listener
+            listener.started = asyncio.ensure_future(self._start(key, listener))
+        listener.add(subscriber)
+        try:
+            await asyncio.shield(listener.started)
+            if listener.error is not None:
+                raise listener.error
+        except BaseException:
+            self.unsubscribe(key, subscriber)
+            raise
+        return subscriber
+
+    async def _start(self, key: str, listener: SharedListener):
+        try:
+            listener.watch = await run_read(listener.ref.on_snapshot, listener._on_snapshot)
+        except BaseException as e:
+            # the clients waiting for the listener raise this error
+            listener.error = e
+            if self.listeners.get(key) is listener:
+                del self.listeners[key]
+            if not isinstance(e, Exception):
+                raise
+            return
+        if not listener.subscribers:
+            # every client left while the listener was starting
+            self._stop(key, listener)
+
+    def unsubscribe(self, key: str, subscriber: Subscriber):
+        """
+        Remove a subscriber, stopping the upstream listener if it was the last one.
+
+        This does not await, so it also works from a stream that is being cancelled
+        because its client went away. A listener still starting is stopped once
+        started.
+        """
+        listener = self.listeners.get(key)
+        if listener is None or subscriber not in listener.subscribers:
+            return
+        listener.remove(subscriber)
+        if not listener.subscribers and listener.watch is not None:
+            self._stop(key, listener)
+
+    def _stop(self, key: str, listener: SharedListener):
+        if self.listeners.get(key) is listener:
+            del self.listeners[key]
+        executor.submit(listener.watch.unsubscribe)
+
+    def stats(self) -> dict:
+        return {
+            "listeners": len(self.listeners),
+            "subscribers": sum(len(listener.subscribers) for listener in self.listeners.values()),
+        }
+
+    async def stream(self, key: str, ref):
+        """
+        Subscribe and yield the encoded events until the client disconnects.
+
+        Idle streams get a keep-alive comment every ``REALTIME_HEARTBEAT_SECONDS``.
+        A client that falls ``REALTIME_QUEUE_SIZE`` events behind receives an
+        "overflow" event and is disconnected, and should resubscribe. A
+        listener that fails to start ends the stream with an "error" event.
+        """
+        subscriber = Subscriber()
+        try:
+            try:
+                await self.subscribe(key, ref, subscriber)
+            except Exception as e:
+                # the status line is already sent, report the error in-band
+                yield sse_event("error", {"detail": f"Error starting listener: {e}"})
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), REALTIME_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if event is OVERFLOW:
+                    yield sse_event("overflow", {"detail": "Client fell behind, resubscribe"})
+                    return
+                yield event
+        finally:
+            self.unsubscribe(key, subscriber)
+
+
+listener_hub = ListenerHub()
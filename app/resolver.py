@@ -0,0 +1,98 @@
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from app.constants import FIRESTORE_REF_CACHE_SIZE
+from app.init_firebase import db
+
+# A Firestore path alternates collection and document segments, starting with
+# a collection: an odd number of segments names a collection, an even number
+# names a document.
+
+
+def path_segments(path_nodes: List) -> Tuple[str, ...]:
+    """
+    Flatten a list of path nodes into Firestore path segments.
+
+    Nodes may be ``FireStorePathNode`` instances or dicts with "type" and "name"
+    keys. A name may itself contain several "/"-separated segments.
+
+    :param path_nodes: List of path nodes, outermost first.
+    :return: Tuple of path segments.
+    :raises ValueError: If the path is empty or malformed, or if the type of a
+        node does not match the kind of reference the path up to it resolves to.
+    """
+    if not path_nodes:
+        raise ValueError("Path must contain at least one node")
+    segments = []
+    for node in path_nodes:
+        if isinstance(node, Dict):
+            name, node_type = node["name"], node["type"]
+        else:
+            name, node_type = node.name, node.type
+        segments.extend(name.split("/"))
+        if (len(segments) % 2 == 1) != (node_type == "collection"):
+            raise ValueError(f"Path {'/'.join(segments)} does not resolve to a {node_type}")
+    return _validate(segments)
+
+
+def path_str_segments(path: str) -> Tuple[str, ...]:
+    """
+    Split a compact "coll/doc/coll" path string into Firestore path segments.
+
+    :param path: Slash-separated path, leading and trailing slashes are ignored.
+    :return: Tuple of path segments.
+    :raises ValueError: If the path is empty or contains empty segments.
+    """
+    return _validate(path.strip("/").split("/"))
+
+
+def _validate(segments) -> Tuple[str, ...]:
+    segments = tuple(segments)
+    if not segments or any(not segment for segment in segments):
+        raise ValueError(f"Invalid Firestore path: {'/'.join(segments)!r}")
+    return segments
+
+
+@lru_cache(maxsize=FIRESTORE_REF_CACHE_SIZE)
+def get_db_ref_from_segments(segments: Tuple[str, ...]):
+    """
+    Build the Firestore reference for a tuple of path segments.
+
+    Results are kept in a bounded LRU cache, so hot paths are only built once.
+
+    :param segments: Tuple of path segments, as returned by ``path_segments``.
+    :return: A ``CollectionReference`` or a ``DocumentReference``.
+    """
+    if len(segments) % 2 == 1:
+        return db.collection(*segments)
+    return db.document(*segments)
+
+
+def get_db_ref(path_nodes: List):
+    """
+    Resolve a list of path nodes to a Firestore reference.
+
+    :param path_nodes: List of ``FireStorePathNode`` instances or equivalent dicts.
+    :return: A ``CollectionReference`` or a ``DocumentReference``.
+    """
+    return get_db_ref_from_segments(path_segments(path_nodes))
+
+
+def get_db_ref_from_path(path: str):
+    """
+    Resolve a compact "coll/doc/coll" path string to a Firestore reference.
+
+    :param path: Slash-separated Firestore path.
+    :return: A ``CollectionReference`` or a ``DocumentReference``.
+    """
+    return get_db_ref_from_segments(path_str_segments(path))
+
+
+def get_path_str(path_nodes: List) -> str:
+    """
+    The slash-separated Firestore path of a list of path nodes.
+
+    :param path_nodes: List of ``FireStorePathNode`` instances or equivalent dicts.
+    :return: The path, e.g. "coll/doc/coll".
+    """
+    return "/".join(path_segments(path_nodes))
@@ -1,15 +1,90 @@
 # GPT PROMPT
 # Give me an simple example to create a FastAPI router for "creating doc" in Firestore using Pydantic models and API documentation. Make sure there is doc along with function.
 
-from typing import Dict, List
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, constr
+import asyncio
+import base64
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from google.cloud.firestore_v1 import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from pydantic import BaseModel, conint, constr
 from firebase_admin import exceptions
 from app.init_firebase import db
+from app import deletion, export, transactions
+from app.binary import NegotiatedRoute
+from app.cache import aggregation_cache, document_cache, no_cache
+from app.constants import EXPORT_DIR, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_WINDOW
+from app.deletion import DeletionStats
+from app.encoding import ndjson_line
+from app.executor import ensure_initialized, iterate_sync, run_read, run_sync
+from app.realtime import listener_hub
+from app.singleflight import SingleFlight
+from app.resolver import get_db_ref, get_db_ref_from_path, get_path_str, path_str_segments
+from app.tombstones import tombstones
+from app.transactions import PreconditionFailed, TransactionContention
+from app.writebehind import QueueFullError, WriteBehindQueue
 
-router = APIRouter()
+# the endpoints resolve references on the event loop, so Firebase is initialized before, off the loop
+router = APIRouter(route_class=NegotiatedRoute, dependencies=[Depends(ensure_initialized)])
 # db = db
 
+# coalesces concurrent reads of the same document into one upstream call
+read_flights = SingleFlight()
+# and concurrent identical aggregation queries
+aggregate_flights = SingleFlight()
+
+
+def invalidate(path: str):
+    """
+    Forget what is known about a document after the bridge wrote or deleted it.
+    """
+    document_cache.invalidate(path)
+    read_flights.forget(path)
+    aggregation_cache.invalidate(path)
+
+
+def invalidate_prefix(path: str):
+    """
+    Forget what is known about every document below a collection or document path.
+    """
+    document_cache.invalidate_prefix(path)
+    read_flights.forget_prefix(path)
+    aggregation_cache.invalidate_prefix(path)
+
+
+def write_committed(path: str, op: str):
+    invalidate(path)
+    if op == "delete":
+        tombstones.record(path)
+
+
+# writes of requests sent with "Prefer: respond-async", coalesced per document
+write_queue = WriteBehindQueue(WRITE_BEHIND_WINDOW, WRITE_BEHIND_MAX_PENDING, on_committed=write_committed)
+
+
+def respond_async(prefer: Optional[str]) -> bool:
+    return prefer is not None and "respond-async" in prefer.lower()
+
+
+def queue_write(doc_ref, op: str, data: Optional[Dict] = None) -> JSONResponse:
+    """
+    Queue a write on the write-behind queue and answer 202 Accepted.
+    """
+    try:
+        coalesced = write_queue.enqueue(doc_ref, op, data)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(write_queue.window)))})
+    return JSONResponse(
+        {"detail": "Write queued", "path": doc_ref.path, "coalesced": coalesced},
+        status_code=202,
+        headers={"Preference-Applied": "respond-async"},
+    )
+
+
 class FireStorePathNode(BaseModel):
     type: constr(regex='^(collection|document)$')
     name: str
@@ -26,34 +101,43 @@ class DocumentCreateResponse(BaseModel):
     summary="Create a new document in Firestore",
     response_description="JSON object representing the newly created document ID"
 )
-async def create_document(doc: DocumentCreateRequest):
+async def create_document(doc: DocumentCreateRequest, prefer: Optional[str] = Header(None)):
     """
     Create a new document in Firestore.
 
+    With a ``Prefer: respond-async`` header, a document path is written by the
+    write-behind queue and the response is 202 Accepted.
+
     :param doc: Pydantic model representing the document data to be created.
+    :param prefer: The Prefer header.
     :return: Pydantic model representing the newly created document ID.
     """
     try:
         
 
-        base_path_str = get_db_ref_str(doc.path_nodes)
+        db_ref = get_db_ref(doc.path_nodes)
         if doc.path_nodes[-1].type == "document":
-            db_ref_str = base_path_str + ".set(doc.document_data)"        
-            eval(f"{db_ref_str}")
+            if respond_async(prefer):
+                return queue_write(db_ref, "set", doc.document_data)
+            await run_sync(db_ref.set, doc.document_data)
+            invalidate(db_ref.path)
             return {"detail": "Document created successfully"}
         elif doc.path_nodes[-1].type == "collection":
-            db_ref_str = base_path_str + ".add(doc.document_data)"        
-            doc_ref = eval(f"{db_ref_str}")
+            doc_ref = await run_sync(db_ref.add, doc.document_data)
+            invalidate(doc_ref[1].path)
             return DocumentCreateResponse(document_id=doc_ref[1].id)
 
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"Error creating document: {e}")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Unknown Error creating document: {e}")
     
 
 class DocumentReadRequest(BaseModel):
     path_nodes: List[FireStorePathNode]
+    field_paths: Optional[List[str]] = None
 
 class DocumentReadResponse(BaseModel):
     document_data: Dict
@@ -63,20 +147,58 @@ class DocumentReadResponse(BaseModel):
     summary="Read a document from Firestore",
     response_description="JSON object representing the document data"
 )
-async def read_document(doc: DocumentReadRequest):
+async def read_document(
+    doc: DocumentReadRequest,
+    response: Response,
+    cache_control: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Read a document from Firestore.
 
-    :param doc: Pydantic model representing the document path to be read.
+    Documents of collections with a cache TTL are served from the document cache,
+    unless the request sends ``Cache-Control: no-cache``. With ``field_paths``
+    only those fields are fetched from Firestore and returned.
+
+    The response carries the document's update time as an ETag; a request whose
+    If-None-Match holds the current ETag gets an empty 304 Not Modified.
+
+    :param doc: Pydantic model representing the document path to be read and an
+        optional field mask.
+    :param response: The response, to set the ETag header on.
+    :param cache_control: The Cache-Control request header.
+    :param if_none_match: The If-None-Match request header.
     :return: Pydantic model representing the document data.
     """
     try:
         
-        db_ref_str = get_db_ref_str(doc.path_nodes)
-        doc_ref = eval(f"{db_ref_str}")
-        doc_data = doc_ref.get().to_dict()
-        if not doc_data:
-            raise HTTPException(status_code=404, detail="Document not found")
+        doc_ref = get_db_ref(doc.path_nodes)
+        entry = None if no_cache(cache_control) else document_cache.lookup(doc_ref.path)
+        if entry is not None:
+            doc_data, update_time = entry
+            if doc.field_paths is not None:
+                doc_data = project_fields(doc_data, doc.field_paths)
+        elif doc.field_paths is not None:
+            snapshot = await read_flights.do(
+                (doc_ref.path, tuple(doc.field_paths)), run_read, doc_ref.get, field_paths=doc.field_paths
+            )
+            if not snapshot.exists:
+                raise HTTPException(status_code=404, detail="Document not found")
+            doc_data, update_time = snapshot.to_dict(), snapshot.update_time
+        else:
+            token = document_cache.token()
+            snapshot = await read_flights.do((doc_ref.path, None), run_read, doc_ref.get)
+            doc_data, update_time = snapshot.to_dict(), snapshot.update_time
+            if doc_data:
+                document_cache.set(doc_ref.path, doc_data, token, update_time)
+            if not doc_data:
+                raise HTTPException(status_code=404, detail="Document not found")
+
+        if update_time is not None:
+            etag = document_etag(update_time, doc.field_paths)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
         return DocumentReadResponse(document_data=doc_data)
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"Error reading document: {e}")
@@ -85,7 +207,601 @@ async def read_document(doc: DocumentReadRequest):
             raise e
         else:
             raise HTTPException(status_code=400, detail=f"Unknown Error reading document: {e}")
-        
+
+
+def document_etag(update_time, field_paths: Optional[List[str]] = None) -> str:
+    """
+    Build the ETag of a document from its update time.
+
+    Masked reads return a different representation of the same version, so the
+    mask is folded into the tag.
+
+    :param update_time: The document's update time.
+    :param field_paths: The field mask of the read, if any.
+    :return: A quoted strong ETag.
+    """
+    timestamp = update_time.timestamp_pb()
+    etag = f"{timestamp.seconds}.{timestamp.nanos:09d}"
+    if field_paths is not None:
+        etag += "-%08x" % zlib.crc32("\n".join(sorted(field_paths)).encode())
+    return f'"{etag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an ETag, using weak comparison.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+# documents requested per get_all call, larger requests are split and fetched concurrently
+MAX_GET_ALL_DOCUMENTS = 100
+
+
+class DocumentsReadRequest(BaseModel):
+    documents: List[List[FireStorePathNode]]
+    field_paths: Optional[List[str]] = None
+
+class DocumentsReadResult(BaseModel):
+    exists: bool
+    document_data: Optional[Dict] = None
+
+class DocumentsReadResponse(BaseModel):
+    documents: Dict[str, DocumentsReadResult]
+
+@router.post(
+    "/read_documents",
+    summary="Read many documents from Firestore in one request",
+    response_description="JSON object mapping every document path to its data"
+)
+async def read_documents(doc: DocumentsReadRequest, cache_control: Optional[str] = Header(None)):
+    """
+    Read many documents from Firestore with batched get_all calls.
+
+    Cached documents are served from the document cache and only the others are
+    fetched, unless the request sends ``Cache-Control: no-cache``. With
+    ``field_paths`` only those fields are fetched and returned.
+
+    :param doc: Pydantic model representing the document paths to be read and an
+        optional field mask.
+    :param cache_control: The Cache-Control request header.
+    :return: Pydantic model mapping every document path to its data, or marking it
+        as missing.
+    """
+    try:
+        doc_refs = {}
+        for path_nodes in doc.documents:
+            if not path_nodes or path_nodes[-1].type != "document":
+                raise HTTPException(status_code=400, detail="Every path must end with a document")
+            doc_ref = get_db_ref(path_nodes)
+            doc_refs[doc_ref.path] = doc_ref
+
+        documents = {path: DocumentsReadResult(exists=False) for path in doc_refs}
+        # masked reads return partial documents, which are not cached
+        use_cache = doc.field_paths is None
+        refs = []
+        for path, doc_ref in doc_refs.items():
+            doc_data = None if no_cache(cache_control) else document_cache.get(path)
+            if doc_data is None:
+                refs.append(doc_ref)
+            else:
+                if not use_cache:
+                    doc_data = project_fields(doc_data, doc.field_paths)
+                documents[path] = DocumentsReadResult(exists=True, document_data=doc_data)
+
+        token = document_cache.token()
+        chunks = [refs[i:i + MAX_GET_ALL_DOCUMENTS] for i in range(0, len(refs), MAX_GET_ALL_DOCUMENTS)]
+        snapshot_chunks = await asyncio.gather(
+            *(run_read(_get_all, chunk, doc.field_paths) for chunk in chunks)
+        )
+
+        for snapshots in snapshot_chunks:
+            for snapshot in snapshots:
+                if snapshot.exists:
+                    doc_data = snapshot.to_dict()
+                    documents[snapshot.reference.path] = DocumentsReadResult(
+                        exists=True, document_data=doc_data
+                    )
+                    if use_cache and doc_data:
+                        document_cache.set(snapshot.reference.path, doc_data, token, snapshot.update_time)
+        return DocumentsReadResponse(documents=documents)
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error reading documents: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error reading documents: {e}")
+
+
+def _get_all(doc_refs, field_paths=None):
+    """
+    Fetch a list of documents with a single get_all RPC.
+
+    :param doc_refs: List of document references.
+    :param field_paths: Optional list of field paths to return.
+    :return: List of document snapshots.
+    """
+    return list(db.get_all(doc_refs, field_paths=field_paths))
+
+
+def project_fields(doc_data: Dict, field_paths: List[str]) -> Dict:
+    """
+    Keep only the given fields of a document, as a Firestore field mask would.
+
+    :param doc_data: The full document data.
+    :param field_paths: Field paths, e.g. "name" or "address.city".
+    :return: A new dict with the selected fields; missing fields are left out.
+    """
+    projected = {}
+    selected = set()
+    # shortest paths first, so a field selected whole is never written into
+    for parts in sorted((FieldPath.from_string(field_path).parts for field_path in field_paths), key=len):
+        if any(parts[:i] in selected for i in range(1, len(parts) + 1)):
+            continue
+        selected.add(parts)
+        value = doc_data
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+
+class QueryFilter(BaseModel):
+    field: str
+    op: constr(regex='^(<|<=|==|!=|>=|>|array-contains|array-contains-any|in|not-in)$')
+    value: Any
+
+class QueryOrder(BaseModel):
+    field: str
+    direction: constr(regex='^(ASCENDING|DESCENDING)$') = "ASCENDING"
+
+class QueryRequest(BaseModel):
+    path_nodes: Optional[List[FireStorePathNode]] = None
+    collection_group: Optional[str] = None
+    where: List[QueryFilter] = []
+    order_by: List[QueryOrder] = []
+    limit: Optional[conint(gt=0)] = None
+    select: Optional[List[str]] = None
+    start_after: Optional[str] = None
+
+@router.post(
+    "/query",
+    summary="Query a collection or collection group in Firestore",
+    response_description="Newline-delimited JSON, one line per document, then a line with the resume cursor"
+)
+async def query_documents(doc: QueryRequest):
+    """
+    Query a collection, or every collection with a given ID, and stream the results.
+
+    Each matching document is sent as one JSON line with its "id", "path" and
+    "document_data". The last line holds a "cursor": pass it back as
+    ``start_after`` to get the next page. It is null when the results are
+    exhausted.
+
+    :param doc: Pydantic model representing the collection, filters, ordering,
+        limit, field selection and resume cursor of the query.
+    :return: Streaming response of newline-delimited JSON.
+    """
+    try:
+        query = await build_query(doc)
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error building query: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error building query: {e}")
+
+    async def stream_results():
+        count = 0
+        last_path = None
+        try:
+            async for snapshot in iterate_sync(query.stream()):
+                count += 1
+                last_path = snapshot.reference.path
+                yield ndjson_line({
+                    "id": snapshot.id,
+                    "path": last_path,
+                    "document_data": snapshot.to_dict(),
+                })
+        except Exception as e:
+            # the status line is already sent, report the error in-band
+            yield ndjson_line({"error": f"Error streaming query: {e}"})
+            return
+        more = doc.limit is not None and count == doc.limit
+        yield ndjson_line({"cursor": encode_cursor(last_path) if more else None})
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+async def build_query(doc: QueryRequest):
+    """
+    Build a Firestore query from a query request.
+
+    :param doc: Pydantic model representing the query.
+    :return: The Firestore ``Query``.
+    """
+    if doc.collection_group:
+        query = db.collection_group(doc.collection_group)
+    elif doc.path_nodes and doc.path_nodes[-1].type == "collection":
+        query = get_db_ref(doc.path_nodes)
+    else:
+        raise HTTPException(status_code=400, detail="Query needs a collection path or a collection_group")
+
+    for condition in doc.where:
+        query = query.where(filter=FieldFilter(condition.field, condition.op, condition.value))
+    for order in doc.order_by:
+        query = query.order_by(order.field, direction=order.direction)
+    if doc.select is not None:
+        query = query.select(doc.select)
+    if doc.limit is not None:
+        query = query.limit(doc.limit)
+    if doc.start_after:
+        cursor = await run_read(get_db_ref_from_path(decode_cursor(doc.start_after)).get)
+        if not cursor.exists:
+            raise HTTPException(status_code=400, detail="The cursor document no longer exists")
+        query = query.start_after(cursor)
+    return query
+
+
+# Firestore runs at most 5 aggregations per query
+MAX_AGGREGATIONS = 5
+
+class Aggregation(BaseModel):
+    op: constr(regex='^(count|sum|avg)$')
+    field: Optional[str] = None
+    alias: Optional[constr(regex=r'^[A-Za-z_][A-Za-z0-9_]*$')] = None
+
+class AggregationRequest(QueryRequest):
+    aggregations: List[Aggregation] = [Aggregation(op="count")]
+
+class AggregationResponse(BaseModel):
+    results: Dict[str, Any]
+    read_time: Optional[datetime] = None
+    cached: bool = False
+
+@router.post(
+    "/aggregate",
+    summary="Count, sum or average the documents of a collection or query in Firestore",
+    response_description="JSON object with the value of every aggregation by alias"
+)
+async def aggregate(doc: AggregationRequest, cache_control: Optional[str] = Header(None)):
+    """
+    Run aggregations over a collection, a collection group or a query on it,
+    without transferring the documents.
+
+    Takes the same collection and filters as ``/query``. The aliases default
+    to "count", "sum_<field>" and "avg_<field>". An average over no numeric
+    value is null. Results are cached for ``AGGREGATION_CACHE_TTL`` seconds,
+    unless the request sends ``Cache-Control: no-cache``.
+
+    :param doc: Pydantic model representing the query and its aggregations.
+    :param cache_control: The Cache-Control request header.
+    :return: Pydantic model representing the aggregation results by alias.
+    """
+    try:
+        if not 0 < len(doc.aggregations) <= MAX_AGGREGATIONS:
+            raise HTTPException(status_code=400, detail=f"Give between 1 and {MAX_AGGREGATIONS} aggregations")
+        aliases = []
+        for aggregation in doc.aggregations:
+            if (aggregation.op == "count") != (aggregation.field is None):
+                raise HTTPException(status_code=400, detail="sum and avg need a field, count takes none")
+            aliases.append(aggregation.alias or aggregation_alias(aggregation))
+        if len(set(aliases)) != len(aliases):
+            raise HTTPException(status_code=400, detail="Aggregation aliases must be unique")
+
+        key = json.dumps(doc.dict(), sort_keys=True, default=str)
+        if not no_cache(cache_control):
+            cached = aggregation_cache.get(key)
+            if cached is not None:
+                return AggregationResponse(**cached, cached=True)
+        token = aggregation_cache.token()
+
+        query = await build_query(doc)
+        for aggregation, alias in zip(doc.aggregations, aliases):
+            if aggregation.op == "count":
+                query = query.count(alias=alias)
+            else:
+                query = getattr(query, aggregation.op)(aggregation.field, alias=alias)
+        result_sets = await aggregate_flights.do((key,), run_read, query.get)
+        results = {result.alias: result.value for result in result_sets[0]}
+        read_time = result_sets[0][0].read_time if result_sets[0] else None
+
+        result = {"results": results, "read_time": read_time}
+        scope = ("group", doc.collection_group) if doc.collection_group else ("collection", get_path_str(doc.path_nodes))
+        aggregation_cache.set(key, scope, result, token)
+        return AggregationResponse(**result)
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error running aggregation: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error running aggregation: {e}")
+
+
+def aggregation_alias(aggregation: Aggregation) -> str:
+    if aggregation.op == "count":
+        return "count"
+    return f"{aggregation.op}_{aggregation.field.replace('.', '_')}"
+
+
+def encode_cursor(path: str) -> str:
+    """
+    Encode the path of the last returned document as an opaque cursor token.
+    """
+    return base64.urlsafe_b64encode(path.encode()).decode("ascii")
+
+
+def decode_cursor(token: str) -> str:
+    """
+    Decode a cursor token back into a document path.
+    """
+    try:
+        return base64.urlsafe_b64decode(token.encode("ascii")).decode()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# headers keeping proxies from buffering or caching Server-Sent Events
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@router.get(
+    "/listen",
+    summary="Stream realtime changes of a document or collection",
+    response_description="Server-Sent Events with the document, or the snapshot and changes of the collection"
+)
+async def listen(path: str):
+    """
+    Stream the changes of a document or a whole collection as Server-Sent Events.
+
+    Clients watching the same path share one upstream Firestore listener. A
+    document sends a "document" event on every change. A collection first sends
+    a "snapshot" event with every document, then "changes" events.
+
+    :param path: Slash-separated path of the document or collection, e.g. "coll/doc".
+    :return: Streaming response of Server-Sent Events.
+    """
+    try:
+        key = "path:" + "/".join(path_str_segments(path))
+        ref = get_db_ref_from_path(path)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Unknown Error listening to path: {e}")
+    return StreamingResponse(
+        listener_hub.stream(key, ref), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+@router.post(
+    "/listen",
+    summary="Stream realtime changes of a query",
+    response_description="Server-Sent Events with the snapshot and changes of the query results"
+)
+async def listen_query(doc: QueryRequest):
+    """
+    Stream the results of a query as Server-Sent Events.
+
+    Clients sending the same query share one upstream Firestore listener. The
+    first event is a "snapshot" with every matching document, then "changes"
+    events report added, modified and removed documents.
+
+    :param doc: Pydantic model representing the query, as for ``/query``.
+    :return: Streaming response of Server-Sent Events.
+    """
+    try:
+        query = await build_query(doc)
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error building query: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error building query: {e}")
+    return StreamingResponse(
+        listener_hub.stream("query:" + doc.json(), query), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+@router.get(
+    "/listen_stats",
+    summary="Statistics of the realtime listeners",
+    response_description="JSON object with the number of upstream listeners and connected clients"
+)
+async def listen_stats():
+    """
+    Report how many upstream listeners are open and how many clients share them.
+    """
+    return listener_hub.stats()
+
+
+class SyncRequest(BaseModel):
+    path_nodes: List[FireStorePathNode]
+    since: datetime
+    timestamp_field: Optional[str] = None
+
+class SyncDocument(BaseModel):
+    id: str
+    path: str
+    document_data: Dict
+    update_time: datetime
+
+class SyncTombstone(BaseModel):
+    path: str
+    deleted_at: datetime
+
+class SyncResponse(BaseModel):
+    documents: List[SyncDocument]
+    deleted: List[SyncTombstone]
+    tombstones_complete: bool
+    sync_time: datetime
+
+@router.post(
+    "/sync",
+    summary="Fetch the changes of a collection since a point in time",
+    response_description="JSON object with the changed documents, the deleted ones and the next sync time"
+)
+async def sync_collection(doc: SyncRequest):
+    """
+    Return the documents of a collection changed after ``since``, and tombstones
+    for the documents deleted through the bridge after it.
+
+    Without ``timestamp_field`` the bridge scans the collection and compares
+    each document's update time, so only changed documents are sent to the
+    client but every document is read upstream. With ``timestamp_field``, a
+    field the clients keep set to the write time (e.g. with a server
+    timestamp), the filter runs in Firestore instead.
+
+    Tombstones only cover deletions made through this bridge process.
+    ``tombstones_complete`` is false when the log no longer reaches back to
+    ``since``, and the client should then resync from scratch. Pass
+    ``sync_time`` as ``since`` on the next call.
+
+    :param doc: Pydantic model representing the collection path and the time of the last sync.
+    :return: Pydantic model representing the changes.
+    """
+    try:
+        if doc.path_nodes[-1].type != "collection":
+            raise HTTPException(status_code=400, detail="Sync needs a collection path")
+        since = doc.since if doc.since.tzinfo else doc.since.replace(tzinfo=timezone.utc)
+        query = get_db_ref(doc.path_nodes)
+        if doc.timestamp_field:
+            query = query.where(filter=FieldFilter(doc.timestamp_field, ">", since))
+        snapshots, read_time = await run_read(_changed_documents, query, None if doc.timestamp_field else since)
+
+        documents = [
+            SyncDocument(
+                id=snapshot.id,
+                path=snapshot.reference.path,
+                document_data=snapshot.to_dict(),
+                update_time=snapshot.update_time,
+            )
+            for snapshot in snapshots
+        ]
+        updated = {document.path: document.update_time for document in documents}
+        deleted = [
+            SyncTombstone(path=path, deleted_at=deleted_at)
+            for path, deleted_at in tombstones.deleted_since(get_path_str(doc.path_nodes), since)
+            # a document written again after its deletion is reported as a document
+            if path not in updated or updated[path] < deleted_at
+        ]
+        return SyncResponse(
+            documents=documents,
+            deleted=deleted,
+            tombstones_complete=tombstones.complete_since(since),
+            sync_time=read_time or since,
+        )
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error syncing collection: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error syncing collection: {e}")
+
+
+def _changed_documents(query, since=None):
+    """
+    Stream a query, keeping only the documents updated after ``since``.
+
+    :param query: The collection or query to stream.
+    :param since: Keep documents whose update time is after this, or all when None.
+    :return: Tuple of (list of document snapshots, read time of the query or None).
+    """
+    changed = []
+    read_time = None
+    for snapshot in query.stream():
+        read_time = snapshot.read_time
+        if since is None or snapshot.update_time > since:
+            changed.append(snapshot)
+    return changed, read_time
+
+
+class ExportRequest(BaseModel):
+    path_nodes: List[FireStorePathNode]
+    recursive: bool = False
+    page_size: conint(gt=0, le=10000) = 1000
+    concurrency: conint(gt=0, le=16) = 2
+    encoding: constr(regex='^(gzip|zstd|identity)$') = "gzip"
+    file: Optional[str] = None
+
+class ExportResponse(BaseModel):
+    detail: str = "Export written successfully"
+    file: str
+    documents: int
+    bytes: int
+    elapsed_seconds: float
+
+@router.post(
+    "/export",
+    summary="Export a collection or document to NDJSON, optionally compressed",
+    response_description="The export file, one JSON line per document and a trailer line, or the stats of the file written"
+)
+async def export_documents(doc: ExportRequest):
+    """
+    Export every document of a collection, or a document, as newline-delimited JSON.
+
+    Each line holds a document's "path", "create_time", "update_time" and
+    "data", with Firestore values encoded losslessly: timestamps, GeoPoints,
+    references, bytes, NaN and infinities are tagged objects such as
+    ``{"$timestamp": "2024-01-02T03:04:05.123456789Z"}``, see
+    ``app.encoding.encode_value``. The last line is
+    ``{"export": {"documents": n, "complete": true}}``; a failed export ends
+    with ``"complete": false`` and an "error".
+
+    With ``recursive`` the documents of every subcollection below are exported
+    too. The export is compressed with ``encoding`` and streamed as the
+    response, or written to ``file`` in EXPORT_DIR. A collection is read in
+    ``concurrency`` ranges of document IDs in parallel, so documents are not
+    exported in ID order. Memory stays bounded by ``page_size`` and
+    ``concurrency`` whatever the size of the collection.
+
+    :param doc: Pydantic model representing the path, page size, number of
+        concurrent reads, encoding and file of the export.
+    :return: Streaming response of the export, or Pydantic model representing
+        the file written.
+    """
+    try:
+        if doc.encoding not in export.export_encodings():
+            raise HTTPException(status_code=400, detail=f"Unsupported export encoding: {doc.encoding}")
+        db_ref = get_db_ref(doc.path_nodes)
+        is_document = doc.path_nodes[-1].type == "document"
+        job = export.Export(db_ref, is_document, doc.recursive, doc.page_size, doc.concurrency, doc.encoding)
+        media_type, extension = export.EXPORT_FORMATS[doc.encoding]
+
+        if doc.file is None:
+            filename = get_path_str(doc.path_nodes).strip("/").replace("/", "_") + extension
+            return StreamingResponse(
+                job.chunks(),
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            )
+
+        path = export.export_file_path(EXPORT_DIR, doc.file)
+        await export.export_to_file(job, path)
+        return ExportResponse(file=path, documents=job.documents, bytes=job.bytes, elapsed_seconds=job.elapsed_seconds)
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error exporting documents: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error exporting documents: {e}")
+
+
 class DocumentUpdateRequest(BaseModel):
     path_nodes: List[FireStorePathNode]
     update_data: Dict
@@ -99,21 +815,30 @@ class DocumentUpdateResponse(BaseModel):
     summary="Update an existing document in Firestore",
     response_description="JSON object representing the update status"
 )
-async def update_document(doc: DocumentUpdateRequest):
+async def update_document(doc: DocumentUpdateRequest, prefer: Optional[str] = Header(None)):
     """
     Update an existing document in Firestore.
 
+    With a ``Prefer: respond-async`` header, the update is queued and the
+    response is 202 Accepted. Updates of the same document queued within
+    ``WRITE_BEHIND_WINDOW`` seconds are merged into one write.
+
     :param doc: Pydantic model representing the document data to be updated.
+    :param prefer: The Prefer header.
     :return: Pydantic model representing the update status.
     """
     try:
         
-        db_ref_str = get_db_ref_str(doc.path_nodes)
-        doc_ref = eval(f"{db_ref_str}")
-        doc_ref.update(doc.update_data)
+        doc_ref = get_db_ref(doc.path_nodes)
+        if respond_async(prefer):
+            return queue_write(doc_ref, "update", doc.update_data)
+        await run_sync(doc_ref.update, doc.update_data)
+        invalidate(doc_ref.path)
         return DocumentUpdateResponse()
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"Error updating document: {e}")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Unknown Error updating document: {e}")
 
@@ -126,11 +851,15 @@ class DocumentDeleteRequest(BaseModel):
     summary="Delete a document from Firestore",
     response_description="JSON object representing the success or failure of the delete operation"
 )
-async def delete_document(doc: DocumentDeleteRequest):
+async def delete_document(doc: DocumentDeleteRequest, prefer: Optional[str] = Header(None)):
     """
     Delete a document from Firestore.
 
+    With a ``Prefer: respond-async`` header, the delete is queued and the
+    response is 202 Accepted.
+
     :param doc: Pydantic model representing the document path to be deleted.
+    :param prefer: The Prefer header.
     :return: Pydantic model representing the success or failure of the delete operation.
     """
     try:
@@ -139,8 +868,12 @@ async def delete_document(doc: DocumentDeleteRequest):
         if doc.path_nodes[-1].type == "collection":
             raise HTTPException(status_code=400, detail="Cannot delete a collection")
 
-        db_ref_str = get_db_ref_str(doc.path_nodes)
-        eval(f"{db_ref_str}").delete()
+        doc_ref = get_db_ref(doc.path_nodes)
+        if respond_async(prefer):
+            return queue_write(doc_ref, "delete")
+        await run_sync(doc_ref.delete)
+        invalidate(doc_ref.path)
+        tombstones.record(doc_ref.path)
 
         return {"detail": "Document deleted successfully"}
     except exceptions.FirebaseError as e:
@@ -154,6 +887,11 @@ async def delete_document(doc: DocumentDeleteRequest):
 
 class CollectionDeleteRequest(BaseModel):
     path_nodes: List[FireStorePathNode]
+    recursive: bool = False
+    page_size: conint(gt=0) = 500
+
+class CollectionDeleteResponse(DeletionStats):
+    detail: str = "Collection deleted successfully"
 
 @router.delete(
     "/delete_collection",
@@ -165,7 +903,8 @@ async def delete_collection(doc: CollectionDeleteRequest):
     Delete a collection from Firestore.
 
     :param doc: Pydantic model representing the collection path to be deleted.
-    :return: Pydantic model representing the success or failure of the delete operation.
+    :return: Pydantic model representing the success or failure of the delete operation,
+        with the number of deleted documents and the elapsed time.
     """
     try:
         
@@ -173,15 +912,13 @@ async def delete_collection(doc: CollectionDeleteRequest):
         if doc.path_nodes[-1].type == "document":
             raise HTTPException(status_code=400, detail="Cannot delete a document")
         
-        db_ref_str = get_db_ref_str(doc.path_nodes)
+        collection_ref = get_db_ref(doc.path_nodes)
+        try:
+            stats = await run_sync(deletion.delete_collection, collection_ref, doc.page_size, doc.recursive)
+        finally:
+            invalidate_prefix(get_path_str(doc.path_nodes))
 
-        # docs = eval(f"{db_ref_str}").stream()
-        collection_ref = eval(f"{db_ref_str}")
-        batch_delete_docs_in_coll(collection_ref, 100)
-        # for doc in docs:
-        #     doc.reference.delete()
-
-        return {"detail": "Collection deleted successfully"}
+        return CollectionDeleteResponse(**stats.dict())
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"Error deleting collection: {e}")
     except Exception as e:
@@ -190,33 +927,11 @@ async def delete_collection(doc: CollectionDeleteRequest):
         else:
             raise HTTPException(status_code=400, detail=f"Unknown Error deleting document: {e}")
 
-def batch_delete_docs_in_coll(collection_ref, batch_size):
-    """
-    Delete all documents in a collection and the collection itself.
-
-    :param collection_ref: Reference to the collection to be deleted.
-    :param batch_size: The batch size for deleting documents.
-    """
-    docs = collection_ref.limit(batch_size).stream()
-    deleted = 0
-
-    # Delete documents in batches
-    for doc in docs:
-        print(f"Deleting document {doc.id}...")
-        doc.reference.delete()
-        deleted += 1
-
-    # Recurse on the next batch of documents
-    if deleted >= batch_size:
-        return delete_collection(collection_ref, batch_size)
-
-    # # Delete the collection itself
-    # print(f"Deleting collection {collection_ref.id}...")
-    # collection_ref.delete()
-
 
 class CollectionOrDocumentDeleteRequest(BaseModel):
     path_nodes: List[FireStorePathNode]
+    recursive: bool = False
+    page_size: conint(gt=0) = 500
 
 
 @router.delete(
@@ -234,16 +949,26 @@ async def delete_collection_or_document(doc: CollectionOrDocumentDeleteRequest):
     try:
         
 
-        db_ref_str = get_db_ref_str(doc.path_nodes)
+        db_ref = get_db_ref(doc.path_nodes)
 
         if doc.path_nodes[-1].type == "document":
-            eval(f"{db_ref_str}").delete()
+            if doc.recursive:
+                try:
+                    stats = await run_sync(deletion.delete_document, db_ref, doc.page_size, True)
+                finally:
+                    invalidate_prefix(db_ref.path)
+                return {"detail": "Document deleted successfully", **stats.dict()}
+            await run_sync(db_ref.delete)
+            invalidate(db_ref.path)
+            tombstones.record(db_ref.path)
             return {"detail": "Document deleted successfully"}
 
         if doc.path_nodes[-1].type == "collection":
-            collection_ref = eval(f"{db_ref_str}")
-            batch_delete_docs_in_coll(collection_ref, 100)
-            return {"detail": "Collection deleted successfully"}
+            try:
+                stats = await run_sync(deletion.delete_collection, db_ref, doc.page_size, doc.recursive)
+            finally:
+                invalidate_prefix(get_path_str(doc.path_nodes))
+            return CollectionDeleteResponse(**stats.dict())
 
         raise HTTPException(status_code=400, detail="Invalid path, must end with document or collection")
     except exceptions.FirebaseError as e:
@@ -255,15 +980,256 @@ async def delete_collection_or_document(doc: CollectionOrDocumentDeleteRequest):
             raise HTTPException(status_code=400, detail=f"Unknown Error deleting document/collection: {e}")
 
 
-def get_db_ref_str(path_nodes: List[FireStorePathNode]):
+# Firestore rejects commits with more than 500 writes
+MAX_BATCH_WRITES = 500
+# upper bound of the attempts a client may ask a transaction to make
+MAX_TRANSACTION_ATTEMPTS = 10
+
+
+class BatchWriteOperation(BaseModel):
+    op: constr(regex='^(set|add|update|delete)$')
+    path_nodes: List[FireStorePathNode]
+    data: Optional[Dict] = None
+    merge: bool = False
+
+class BatchWriteRequest(BaseModel):
+    operations: List[BatchWriteOperation]
+    concurrent: bool = False
+
+class BatchWriteResult(BaseModel):
+    index: int
+    op: str
+    path: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+
+class BatchWriteResponse(BaseModel):
+    results: List[BatchWriteResult]
+    succeeded: int
+    failed: int
+
+@router.post(
+    "/batch_write",
+    summary="Apply many set/add/update/delete operations in batched commits",
+    response_description="JSON object representing the result of every operation"
+)
+async def batch_write(doc: BatchWriteRequest):
+    """
+    Apply a list of write operations using WriteBatch commits.
+
+    Operations are split into chunks of at most 500 writes, each committed
+    atomically. Chunks are committed one after another, or all at once when
+    ``concurrent`` is set. An operation that cannot be added to a batch (bad
+    path or missing data) fails on its own without affecting the others.
+
+    :param doc: Pydantic model representing the operations to apply.
+    :return: Pydantic model representing the result of every operation.
+    """
+    results = [BatchWriteResult(index=i, op=op.op, success=False) for i, op in enumerate(doc.operations)]
+    staged = []
+    for i, op in enumerate(doc.operations):
+        try:
+            staged.append((i, op, _batch_write_target(op)))
+        except Exception as e:
+            results[i].error = str(e)
+
+    chunks = [staged[i:i + MAX_BATCH_WRITES] for i in range(0, len(staged), MAX_BATCH_WRITES)]
+    if doc.concurrent:
+        await asyncio.gather(*(_commit_batch_chunk(chunk, results) for chunk in chunks))
+    else:
+        for chunk in chunks:
+            await _commit_batch_chunk(chunk, results)
+
+    succeeded = sum(1 for result in results if result.success)
+    return BatchWriteResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
+
+
+def _batch_write_target(op: BatchWriteOperation):
+    """
+    Resolve the document reference a batch operation writes to.
+
+    :param op: The batch operation.
+    :return: The target ``DocumentReference``, with a generated ID for "add".
+    """
+    if op.op != "delete" and op.data is None:
+        raise ValueError(f"Operation {op.op} requires data")
+    db_ref = get_db_ref(op.path_nodes)
+    if op.op == "add":
+        if op.path_nodes[-1].type != "collection":
+            raise ValueError("Operation add requires a collection path")
+        return db_ref.document()
+    if op.path_nodes[-1].type != "document":
+        raise ValueError(f"Operation {op.op} requires a document path")
+    return db_ref
+
+
+async def _commit_batch_chunk(chunk, results: List[BatchWriteResult]):
+    """
+    Commit one chunk of staged operations as a single WriteBatch.
+
+    :param chunk: List of (index, operation, document reference) tuples.
+    :param results: The per-operation results, updated in place.
+    """
+    batch = db.batch()
+    for i, op, doc_ref in chunk:
+        results[i].path = doc_ref.path
+        if op.op in ("set", "add"):
+            batch.set(doc_ref, op.data, merge=op.merge)
+        elif op.op == "update":
+            batch.update(doc_ref, op.data)
+        else:
+            batch.delete(doc_ref)
+    try:
+        await run_sync(batch.commit)
+    except Exception as e:
+        for i, _, _ in chunk:
+            results[i].error = f"Error committing batch: {e}"
+        return
+    for i, op, doc_ref in chunk:
+        results[i].success = True
+        invalidate(doc_ref.path)
+        if op.op == "delete":
+            tombstones.record(doc_ref.path)
+
+
+class TransactionRead(BaseModel):
+    name: constr(regex=r'^[A-Za-z_][A-Za-z0-9_]*$')
+    path_nodes: List[FireStorePathNode]
+
+class TransactionPrecondition(BaseModel):
+    read: str
+    field: Optional[str] = None
+    op: constr(regex='^(exists|missing|==|!=|<|<=|>|>=|in|not-in|array-contains)$')
+    value: Any = None
+
+class TransactionWrite(BaseModel):
+    op: constr(regex='^(set|create|update|delete)$')
+    path_nodes: List[FireStorePathNode]
+    data: Optional[Dict] = None
+    merge: bool = False
+
+class TransactionRequest(BaseModel):
+    reads: List[TransactionRead] = []
+    preconditions: List[TransactionPrecondition] = []
+    writes: List[TransactionWrite] = []
+    max_attempts: conint(ge=1, le=MAX_TRANSACTION_ATTEMPTS) = 5
+
+class TransactionResponse(BaseModel):
+    detail: str = "Transaction committed"
+    reads: Dict[str, Optional[Dict]]
+    attempts: int
+
+@router.post(
+    "/transaction",
+    summary="Read, check and write documents in one Firestore transaction",
+    response_description="JSON object with the documents read and the number of attempts"
+)
+async def run_transaction(doc: TransactionRequest):
+    """
+    Run a read-modify-write transaction on the server.
+
+    Every document in ``reads`` is read under the transaction, the
+    ``preconditions`` are checked on them, then the ``writes`` are applied.
+    Write data may refer to the values read with ``{"$ref": "name.field"}``
+    and use the transforms ``$increment``, ``$maximum``, ``$minimum``,
+    ``$array_union``, ``$array_remove``, ``$server_timestamp`` and ``$delete``,
+    see ``app.transactions``. When another client writes a document read
+    before the commit, the transaction is retried, up to ``max_attempts`` times.
+
+    :param doc: Pydantic model representing the reads, preconditions and writes.
+    :return: Pydantic model representing the documents read by the committed attempt.
+    """
+    try:
+        names = [read.name for read in doc.reads]
+        if len(set(names)) != len(names):
+            raise HTTPException(status_code=400, detail="Read names must be unique")
+        if len(doc.writes) > MAX_BATCH_WRITES:
+            raise HTTPException(status_code=400, detail=f"A transaction writes at most {MAX_BATCH_WRITES} documents")
+        for write in doc.writes:
+            if write.path_nodes[-1].type != "document":
+                raise HTTPException(status_code=400, detail="Transaction writes need a document path")
+            if write.op != "delete" and write.data is None:
+                raise HTTPException(status_code=400, detail=f"A {write.op} needs data")
+        reads = [(read.name, get_db_ref(read.path_nodes)) for read in doc.reads]
+        preconditions = [(p.read, p.field, p.op, p.value) for p in doc.preconditions]
+        writes = [(write.op, get_db_ref(write.path_nodes), write.data, write.merge) for write in doc.writes]
+
+        values, attempts = await run_sync(
+            transactions.run_transaction, reads, preconditions, writes, max_attempts=doc.max_attempts
+        )
+        for op, doc_ref, _, _ in writes:
+            invalidate(doc_ref.path)
+            if op == "delete":
+                tombstones.record(doc_ref.path)
+        return TransactionResponse(reads=values, attempts=attempts)
+    except PreconditionFailed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except TransactionContention as e:
+        raise HTTPException(status_code=409, detail=f"Transaction aborted by contention: {e}")
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"Error running transaction: {e}")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown Error running transaction: {e}")
+
+
+@router.get(
+    "/cache_stats",
+    summary="Statistics of the document cache",
+    response_description="JSON object with the hit, miss, eviction and invalidation counters"
+)
+async def cache_stats():
+    """
+    Report the document cache counters and its current size.
+
+    :return: JSON object with the cache counters, entry count and size in bytes.
+    """
+    return document_cache.stats()
+
+
+@router.get(
+    "/aggregation_cache_stats",
+    summary="Statistics of the aggregation result cache",
+    response_description="JSON object with the hit, miss, eviction and invalidation counters"
+)
+async def aggregation_cache_stats():
+    """
+    Report the aggregation cache counters and its current size.
+
+    :return: JSON object with the cache counters and entry count.
+    """
+    return aggregation_cache.stats()
+
+
+@router.get(
+    "/coalescing_stats",
+    summary="Statistics of the coalescing of concurrent document reads",
+    response_description="JSON object with the number of upstream reads and of requests that shared one"
+)
+async def coalescing_stats():
+    """
+    Report how many document reads went upstream and how many were coalesced into another one.
+
+    :return: JSON object with the upstream call, coalesced request and in-flight counts.
+    """
+    return read_flights.stats()
+
+
+@router.get(
+    "/write_queue_stats",
+    summary="Statistics of the write-behind queue",
+    response_description="JSON object with the queue depth and the queued, coalesced, committed and failed write counts"
+)
+async def write_queue_stats():
+    """
+    Report the state of the queue of writes sent with ``Prefer: respond-async``.
+
+    :return: JSON object with the queue depth, the age of its oldest write and the write counters.
+    """
+    return write_queue.stats()
 
-    path_node_str_list = []
-    for node in path_nodes:
-        if isinstance(node, FireStorePathNode):
-            path_node_str_list.append(f"{node.type}('{node.name}')")
-        elif isinstance(node, Dict):
-            path_node_str_list.append(f"{node['type']}('{node['name']}')")
-    return "db."+".".join(path_node_str_list)
 
 def convert_to_path_nodes(path_list: List[Dict[str, str]]) -> List[FireStorePathNode]:
     """
@@ -0,0 +1,236 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, constr
+
+from app.encoding import firestore_json_default
+
+router = APIRouter()
+
+# most operations accepted in one pipeline
+MAX_PIPELINE_OPERATIONS = 50
+
+# request headers not passed on to the operations: the body and its encoding
+# are the operation's own, and responses are collected uncompressed
+DROPPED_HEADERS = {
+    b"content-length", b"content-type", b"content-encoding", b"accept", b"accept-encoding", b"transfer-encoding"
+}
+
+
+class PipelineOperation(BaseModel):
+    id: Optional[constr(regex=r'^[A-Za-z_][A-Za-z0-9_]*$')] = None
+    method: constr(regex='^(GET|POST|PUT|DELETE)$') = "POST"
+    path: constr(regex='^/(user|firestore)/')
+    body: Any = None
+    headers: Dict[str, str] = {}
+    depends_on: List[str] = []
+
+class PipelineRequest(BaseModel):
+    operations: List[PipelineOperation]
+    ordered: bool = False
+
+class PipelineResult(BaseModel):
+    id: Optional[str] = None
+    status: int
+    body: Any = None
+
+class PipelineResponse(BaseModel):
+    results: List[PipelineResult]
+    succeeded: int
+    failed: int
+
+
+class OperationFailed(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class EventStream(Exception):
+    pass
+
+
+@router.post(
+    "/pipeline",
+    summary="Run many user and firestore operations in one request",
+    response_description="JSON object with the status and body of every operation, in request order"
+)
+async def run_pipeline(doc: PipelineRequest, request: Request):
+    """
+    Run a list of operations on the ``/user`` and ``/firestore`` endpoints in one round trip.
+
+    Every operation is the method, path, body and extra headers of a request
+    to one endpoint, and runs with the headers of the pipeline request, e.g.
+    its Authorization. Operations run concurrently unless one depends on
+    another: an operation waits for the operations it names in
+    ``depends_on``, and for those whose results its body refers to with
+    ``{"$result": "<id>.<field>..."}``, e.g. ``{"$result": "profile.document_data.team"}``.
+    With ``ordered`` every operation waits for the previous one. An operation
+    whose dependency failed is not run and gets status 424.
+
+    Streaming endpoints answer with their lines as a list; change feeds
+    cannot be pipelined.
+
+    :param doc: Pydantic model representing the operations.
+    :param request: The pipeline request, whose headers the operations inherit.
+    :return: Pydantic model representing the status and body of every operation.
+    """
+    operations = doc.operations
+    if not 0 < len(operations) <= MAX_PIPELINE_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Give between 1 and {MAX_PIPELINE_OPERATIONS} operations")
+    indexes = {}
+    dependencies = []
+    for i, op in enumerate(operations):
+        if op.id is not None:
+            if op.id in indexes:
+                raise HTTPException(status_code=400, detail=f"Duplicate operation id: {op.id}")
+            indexes[op.id] = i
+        names = set(op.depends_on) | result_references(op.body)
+        unknown = names - indexes.keys()
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Operation {i} depends on unknown or later operations: {', '.join(sorted(unknown))}"
+            )
+        deps = {indexes[name] for name in names}
+        if doc.ordered and i > 0:
+            deps.add(i - 1)
+        dependencies.append(sorted(deps))
+
+    headers = [(name, value) for name, value in request.scope["headers"] if name not in DROPPED_HEADERS]
+    results: List[Optional[PipelineResult]] = [None] * len(operations)
+    done = [asyncio.Event() for _ in operations]
+
+    async def run(i: int, op: PipelineOperation):
+        try:
+            for dep in dependencies[i]:
+                await done[dep].wait()
+            failed = [dep for dep in dependencies[i] if results[dep].status >= 400]
+            if failed:
+                raise OperationFailed(424, f"Dependency failed: operation {failed[0]}")
+            bodies = {name: results[index].body for name, index in indexes.items() if index in dependencies[i]}
+            body = resolve_results(op.body, bodies)
+            status, response_body = await call_endpoint(request, op, body, headers)
+            results[i] = PipelineResult(id=op.id, status=status, body=response_body)
+        except OperationFailed as e:
+            results[i] = PipelineResult(id=op.id, status=e.status, body={"detail": e.detail})
+        except Exception as e:
+            results[i] = PipelineResult(id=op.id, status=500, body={"detail": f"Error running operation: {e}"})
+        finally:
+            done[i].set()
+
+    await asyncio.gather(*(run(i, op) for i, op in enumerate(operations)))
+    succeeded = sum(1 for result in results if result.status < 400)
+    return PipelineResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
+
+
+def result_references(value: Any) -> set:
+    """
+    The ids of the operations whose results a body refers to.
+    """
+    if isinstance(value, dict):
+        if len(value) == 1 and isinstance(value.get("$result"), str):
+            return {value["$result"].split(".", 1)[0]}
+        return set().union(*(result_references(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(result_references(item) for item in value))
+    return set()
+
+
+def resolve_results(value: Any, bodies: Dict[str, Any]) -> Any:
+    """
+    Replace the ``{"$result": ...}`` references in a body with the values they point at.
+
+    :raises OperationFailed: If a reference points at nothing.
+    """
+    if isinstance(value, dict):
+        if len(value) == 1 and isinstance(value.get("$result"), str):
+            reference = value["$result"]
+            name, *parts = reference.split(".")
+            resolved = bodies[name]
+            for part in parts:
+                if isinstance(resolved, dict) and part in resolved:
+                    resolved = resolved[part]
+                elif isinstance(resolved, list) and part.isdigit() and int(part) < len(resolved):
+                    resolved = resolved[int(part)]
+                else:
+                    raise OperationFailed(400, f"Unresolved reference: {reference}")
+            return resolved
+        return {key: resolve_results(item, bodies) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_results(item, bodies) for item in value]
+    return value
+
+
+async def call_endpoint(request: Request, op: PipelineOperation, body: Any, headers: list):
+    """
+    Run one operation through the app, as a request with the pipeline request's headers.
+
+    :return: The status and the decoded body of the response.
+    """
+    path, _, query_string = op.path.partition("?")
+    extra_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in op.headers.items()]
+    overridden = {name for name, _ in extra_headers}
+    payload = b"" if body is None else json.dumps(body, default=firestore_json_default).encode()
+    scope = dict(
+        request.scope,
+        method=op.method,
+        path=path,
+        raw_path=path.encode(),
+        query_string=query_string.encode(),
+        headers=[header for header in headers if header[0] not in overridden]
+        + extra_headers
+        + [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+    )
+    scope.pop("router", None)
+    scope.pop("endpoint", None)
+    scope.pop("path_params", None)
+    scope.pop("route", None)
+    scope["state"] = {}
+
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            # the operation's body was read, wait as a client that keeps the connection open
+            await asyncio.Event().wait()
+        received = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    status = 500
+    content_type = ""
+    chunks = []
+
+    async def send(message):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                if name.lower() == b"content-type":
+                    content_type = value.decode("latin-1")
+            if content_type.startswith("text/event-stream"):
+                # abort the endpoint, the stream never ends
+                raise EventStream()
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception:
+        if content_type.startswith("text/event-stream"):
+            raise OperationFailed(400, f"{path} streams events and cannot be pipelined") from None
+        raise
+    return status, decode_body(b"".join(chunks), content_type)
+
+
+def decode_body(content: bytes, content_type: str) -> Any:
+    if not content:
+        return None
+    if content_type.startswith("application/x-ndjson"):
+        return [json.loads(line) for line in content.splitlines() if line]
+    if content_type.startswith("application/json"):
+        return json.loads(content)
+    return content.decode("utf-8", errors="replace")
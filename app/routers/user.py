@@ -1,11 +1,34 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import base64
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from firebase_admin import auth, exceptions
-from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, conint, constr
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
 
+from app.binary import NegotiatedRoute
+from app.cache import no_cache, user_cache
+from app.encoding import ndjson_line
+from app.executor import run_read, run_sync
+from app.singleflight import SingleFlight
+from app.tokens import token_verifier
 
-router = APIRouter()
+
+router = APIRouter(route_class=NegotiatedRoute)
+
+# coalesces concurrent lookups of the same user into one upstream call
+user_flights = SingleFlight()
+
+
+def forget_user(uid: str):
+    """
+    Forget what is known about a user after the bridge changed or deleted it.
+    """
+    user_flights.forget(uid)
+    token_verifier.invalidate(uid)
+    user_cache.invalidate(uid)
 
 
 class UserMetadata(BaseModel):
@@ -31,27 +54,44 @@ class UserRecord(BaseModel):
     provider_id: Optional[str] = None
 
 
-def user_record_from_user_data(user_data):
-    userMetadata = UserMetadata(
-        creation_timestamp=user_data.user_metadata.creation_timestamp,
-        last_sign_in_timestamp=user_data.user_metadata.last_sign_in_timestamp,
-        last_refresh_timestamp=user_data.user_metadata.last_refresh_timestamp,
-    )
-    userRecord = UserRecord(
-        uid=user_data.uid,
-        email=user_data.email,
-        email_verified=user_data.email_verified,
-        display_name=user_data.display_name,
-        photo_url=user_data.photo_url,
-        phone_number=user_data.phone_number,
-        disabled=user_data.disabled,
-        user_metadata=userMetadata,
-        custom_claims=user_data.custom_claims,
-        tokens_valid_after_timestamp=user_data.tokens_valid_after_timestamp,
-        provider_data=user_data.provider_data,
-        provider_id=user_data.provider_id,
-    )
-    return userRecord
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def user_record_from_user_data(user_data) -> dict:
+    """
+    Serialize a firebase_admin user record to the JSON shape of ``UserRecord``.
+
+    The dict is built directly instead of validating a ``UserMetadata`` and a
+    ``UserRecord`` model, and is ready to be sent or cached as is.
+
+    :param user_data: A ``firebase_admin.auth.UserRecord``.
+    :return: JSON-ready dict with the fields of ``UserRecord``.
+    """
+    metadata = user_data.user_metadata
+    return {
+        "uid": user_data.uid,
+        "email": user_data.email,
+        "email_verified": user_data.email_verified,
+        "display_name": user_data.display_name,
+        "photo_url": user_data.photo_url,
+        "phone_number": user_data.phone_number,
+        "disabled": user_data.disabled,
+        "user_metadata": {
+            "creation_timestamp": _millis_to_iso(metadata.creation_timestamp),
+            "last_sign_in_timestamp": _millis_to_iso(metadata.last_sign_in_timestamp),
+            "last_refresh_timestamp": _millis_to_iso(metadata.last_refresh_timestamp),
+        },
+        "custom_claims": user_data.custom_claims,
+        "tokens_valid_after_timestamp": _millis_to_iso(user_data.tokens_valid_after_timestamp),
+        "provider_data": jsonable_encoder(user_data.provider_data),
+        "provider_id": user_data.provider_id,
+    }
+
+
+def _millis_to_iso(millis: Optional[int]) -> Optional[str]:
+    if millis is None:
+        return None
+    return (EPOCH + timedelta(milliseconds=millis)).isoformat()
 
 
 class UserInfo(UserRecord):
@@ -76,7 +116,8 @@ async def create_user(user: UserInfo):
     :return: Pydantic model representing the newly created user.
     """
     try:
-        user_data = auth.create_user(
+        user_data = await run_sync(
+            auth.create_user,
             uid=user.uid,
             email=user.email,
             password=user.password,
@@ -86,7 +127,11 @@ async def create_user(user: UserInfo):
             disabled=user.disabled,
             email_verified=user.email_verified,
         )
-        return user_record_from_user_data(user_data)
+        record = user_record_from_user_data(user_data)
+        user_cache.set(record, user_cache.token())
+        return JSONResponse(record)
+    except HTTPException:
+        raise
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"FirebaseError creating user: {e}")
     except Exception as e:
@@ -98,16 +143,27 @@ async def create_user(user: UserInfo):
     summary="Read a user in Firebase Authentication",
     response_description="JSON object representing the requested user",
 )
-async def read_user(user: UserInfo):
+async def read_user(user: UserInfo, cache_control: Optional[str] = Header(None)):
     """
     Read a user in Firebase Authentication.
 
+    The user is served from the user cache when it is cached, unless the
+    request sends ``Cache-Control: no-cache``.
+
     :param user: Pydantic model representing the user ID of the user to be retrieved.
-    :return: Pydantic model representing the retrieved user.
+    :param cache_control: The Cache-Control request header.
+    :return: JSON object representing the retrieved user.
     """
     try:
-        user_data = auth.get_user(user.uid)
-        return user_record_from_user_data(user_data)
+        record = None if no_cache(cache_control) else user_cache.get(user.uid)
+        if record is None:
+            token = user_cache.token()
+            user_data = await user_flights.do((user.uid,), run_read, auth.get_user, user.uid)
+            record = user_record_from_user_data(user_data)
+            user_cache.set(record, token)
+        return JSONResponse(record)
+    except HTTPException:
+        raise
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"FirebaseError reading user: {e}")
     except Exception as e:
@@ -125,8 +181,11 @@ class UserDeleteRequest(BaseModel):
 )
 async def delete_user(user: UserDeleteRequest):
     try:
-        auth.delete_user(user.uid)
+        await run_sync(auth.delete_user, user.uid)
+        forget_user(user.uid)
         return {"message": "User deleted successfully"}
+    except HTTPException:
+        raise
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"FirebaseError deleting user: {e}")
     except Exception as e:
@@ -140,7 +199,8 @@ async def delete_user(user: UserDeleteRequest):
 )
 async def update_user(user: UserInfo):
     try:
-        updated_user = auth.update_user(
+        updated_user = await run_sync(
+            auth.update_user,
             user.uid,
             email=user.email,
             password=user.password,
@@ -151,7 +211,12 @@ async def update_user(user: UserInfo):
             custom_claims=user.custom_claims,
             email_verified=user.email_verified,
         )
-        return user_record_from_user_data(updated_user)
+        forget_user(user.uid)
+        record = user_record_from_user_data(updated_user)
+        user_cache.set(record, user_cache.token())
+        return JSONResponse(record)
+    except HTTPException:
+        raise
     except exceptions.FirebaseError as e:
         raise HTTPException(status_code=400, detail=f"FirebaseError updating user: {e}")
     except Exception as e:
@@ -168,9 +233,15 @@ class UserEmailRequest(BaseModel):
 )
 async def send_verification_email(user: UserEmailRequest):
     try:
-        user = auth.get_user_by_email(user.email)
-        auth.generate_email_verification_link(user.email)
-        return {"message": f"Verification email sent to {user.email}"}
+        record = user_cache.get_by_email(user.email)
+        if record is None:
+            token = user_cache.token()
+            record = user_record_from_user_data(await run_read(auth.get_user_by_email, user.email))
+            user_cache.set(record, token)
+        await run_sync(auth.generate_email_verification_link, record["email"])
+        return {"message": f"Verification email sent to {record['email']}"}
+    except HTTPException:
+        raise
     except exceptions.FirebaseError as e:
         raise HTTPException(
             status_code=400, detail=f"FirebaseError sending verification email: {e}"
@@ -179,3 +250,435 @@ async def send_verification_email(user: UserEmailRequest):
         raise HTTPException(
             status_code=400, detail=f"Unknown Error sending verification email: {e}"
         )
+
+# Firebase Auth limits on identifiers per get_users call and users per
+# import_users / delete_users call
+MAX_GET_USERS = 100
+MAX_IMPORT_USERS = 1000
+MAX_DELETE_USERS = 1000
+
+
+class UsersLookupRequest(BaseModel):
+    uids: List[str] = []
+    emails: List[str] = []
+    phone_numbers: List[str] = []
+
+class UserLookupResult(BaseModel):
+    identifier: Dict[str, str]
+    found: bool = False
+    user: Optional[dict] = None
+    error: Optional[str] = None
+
+class UsersLookupResponse(BaseModel):
+    results: List[UserLookupResult]
+    found: int
+    not_found: int
+    failed: int
+
+@router.post(
+    "/get_users",
+    summary="Look up many users in Firebase Authentication by uid, email or phone number",
+    response_description="JSON object representing the lookup result of every identifier"
+)
+async def get_users(users: UsersLookupRequest, cache_control: Optional[str] = Header(None)):
+    """
+    Look up many users with get_users calls of at most 100 identifiers, run concurrently.
+
+    Users cached by uid or email are served from the user cache, unless the
+    request sends ``Cache-Control: no-cache``.
+
+    :param users: Pydantic model representing the uids, emails and phone numbers to look up.
+    :param cache_control: The Cache-Control request header.
+    :return: Pydantic model representing, in request order, the user found for every
+        identifier, or the error of the call that looked it up.
+    """
+    identifiers = (
+        [auth.UidIdentifier(uid) for uid in users.uids]
+        + [auth.EmailIdentifier(email) for email in users.emails]
+        + [auth.PhoneIdentifier(phone_number) for phone_number in users.phone_numbers]
+    )
+    keys = (
+        [{"uid": uid} for uid in users.uids]
+        + [{"email": email} for email in users.emails]
+        + [{"phone_number": phone_number} for phone_number in users.phone_numbers]
+    )
+    results = [UserLookupResult(identifier=key) for key in keys]
+    pending = []
+    for i, key in enumerate(keys):
+        record = None
+        if not no_cache(cache_control):
+            if "uid" in key:
+                record = user_cache.get(key["uid"])
+            elif "email" in key:
+                record = user_cache.get_by_email(key["email"])
+        if record is None:
+            pending.append(i)
+        else:
+            results[i].found = True
+            results[i].user = record
+
+    token = user_cache.token()
+    chunks = [pending[i:i + MAX_GET_USERS] for i in range(0, len(pending), MAX_GET_USERS)]
+    await asyncio.gather(*(_get_users_chunk(chunk, identifiers, results, token) for chunk in chunks))
+
+    found = sum(1 for result in results if result.found)
+    failed = sum(1 for result in results if result.error is not None)
+    return UsersLookupResponse(results=results, found=found, not_found=len(results) - found - failed, failed=failed)
+
+
+async def _get_users_chunk(chunk: List[int], identifiers: list, results: List[UserLookupResult], token: int):
+    """
+    Look up one chunk of identifiers with a single get_users call.
+
+    :param chunk: Indexes of the identifiers to look up.
+    :param identifiers: All the identifiers of the request.
+    :param results: The per-identifier results, updated in place.
+    :param token: The user cache token taken before the lookup.
+    """
+    try:
+        lookup = await run_read(auth.get_users, [identifiers[i] for i in chunk])
+    except Exception as e:
+        for i in chunk:
+            results[i].error = f"Error looking up users: {e}"
+        return
+    by_key = {}
+    for user_data in lookup.users:
+        record = user_record_from_user_data(user_data)
+        user_cache.set(record, token)
+        by_key[("uid", user_data.uid)] = record
+        if user_data.email:
+            by_key[("email", user_data.email.lower())] = record
+        if user_data.phone_number:
+            by_key[("phone_number", user_data.phone_number)] = record
+    for i in chunk:
+        (kind, value), = results[i].identifier.items()
+        record = by_key.get((kind, value.lower() if kind == "email" else value))
+        if record is not None:
+            results[i].found = True
+            results[i].user = record
+
+
+class UserImportHashRequest(BaseModel):
+    """
+    hash algorithm of the imported password hashes,
+    binary parameters are base64 encoded
+    """
+
+    algorithm: constr(regex='^(scrypt|standard_scrypt|bcrypt|hmac_sha512|hmac_sha256|hmac_sha1|hmac_md5|sha512|sha256|sha1|md5|pbkdf_sha1|pbkdf2_sha256)$')
+    key: Optional[str] = None
+    salt_separator: Optional[str] = None
+    rounds: Optional[int] = None
+    memory_cost: Optional[int] = None
+    parallelization: Optional[int] = None
+    block_size: Optional[int] = None
+    derived_key_length: Optional[int] = None
+
+class ImportUser(BaseModel):
+    """a user to import, password hash and salt are base64 encoded"""
+
+    uid: str
+    email: Optional[str] = None
+    email_verified: Optional[bool] = None
+    display_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    photo_url: Optional[str] = None
+    disabled: Optional[bool] = None
+    custom_claims: Optional[dict] = None
+    password_hash: Optional[str] = None
+    password_salt: Optional[str] = None
+
+class UsersImportRequest(BaseModel):
+    users: List[ImportUser]
+    hash: Optional[UserImportHashRequest] = None
+
+class BulkUserResult(BaseModel):
+    index: int
+    uid: str
+    success: bool = False
+    error: Optional[str] = None
+
+class BulkUserResponse(BaseModel):
+    results: List[BulkUserResult]
+    succeeded: int
+    failed: int
+
+@router.post(
+    "/import_users",
+    summary="Import many users into Firebase Authentication",
+    response_description="JSON object representing the result of every imported user"
+)
+async def import_users(users: UsersImportRequest):
+    """
+    Import many users with import_users calls of at most 1000 users, run concurrently.
+
+    A user whose record is invalid fails on its own without affecting the others.
+
+    :param users: Pydantic model representing the users to import and the hash
+        algorithm of their passwords.
+    :return: Pydantic model representing the result of every user.
+    """
+    try:
+        hash_alg = _user_import_hash(users.hash) if users.hash else None
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid hash algorithm: {e}")
+
+    results = [BulkUserResult(index=i, uid=user.uid) for i, user in enumerate(users.users)]
+    staged = []
+    for i, user in enumerate(users.users):
+        try:
+            staged.append((i, _import_user_record(user)))
+        except Exception as e:
+            results[i].error = str(e)
+
+    chunks = [staged[i:i + MAX_IMPORT_USERS] for i in range(0, len(staged), MAX_IMPORT_USERS)]
+    await asyncio.gather(*(_import_users_chunk(chunk, hash_alg, results) for chunk in chunks))
+
+    succeeded = sum(1 for result in results if result.success)
+    return BulkUserResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
+
+
+def _user_import_hash(hash_request: UserImportHashRequest):
+    """
+    Build the UserImportHash of an import request.
+
+    :param hash_request: The hash algorithm and its parameters.
+    :return: A ``firebase_admin.auth.UserImportHash``.
+    """
+    params = hash_request.dict(exclude={"algorithm"}, exclude_none=True)
+    for name in ("key", "salt_separator"):
+        if name in params:
+            params[name] = base64.b64decode(params[name])
+    return getattr(auth.UserImportHash, hash_request.algorithm)(**params)
+
+
+def _import_user_record(user: ImportUser):
+    """
+    Build the ImportUserRecord of a user to import.
+
+    :param user: The user to import.
+    :return: A ``firebase_admin.auth.ImportUserRecord``.
+    """
+    params = user.dict(exclude_none=True)
+    for name in ("password_hash", "password_salt"):
+        if name in params:
+            params[name] = base64.b64decode(params[name])
+    return auth.ImportUserRecord(**params)
+
+
+async def _import_users_chunk(chunk, hash_alg, results: List[BulkUserResult]):
+    """
+    Import one chunk of users with a single import_users call.
+
+    :param chunk: List of (index, ImportUserRecord) tuples.
+    :param hash_alg: The UserImportHash of the passwords, or None.
+    :param results: The per-user results, updated in place.
+    """
+    try:
+        outcome = await run_sync(auth.import_users, [record for _, record in chunk], hash_alg=hash_alg)
+    except Exception as e:
+        for i, _ in chunk:
+            results[i].error = f"Error importing users: {e}"
+        return
+    for i, record in chunk:
+        results[i].success = True
+        # importing an existing uid overwrites that user
+        forget_user(record.uid)
+    for error in outcome.errors:
+        i = chunk[error.index][0]
+        results[i].success = False
+        results[i].error = error.reason
+
+
+class UsersDeleteRequest(BaseModel):
+    uids: List[str]
+
+@router.post(
+    "/delete_users",
+    summary="Delete many users in Firebase Authentication",
+    response_description="JSON object representing the result of every deleted user"
+)
+async def delete_users(users: UsersDeleteRequest):
+    """
+    Delete many users with delete_users calls of at most 1000 uids, run concurrently.
+
+    :param users: Pydantic model representing the uids of the users to delete.
+    :return: Pydantic model representing the result of every uid.
+    """
+    results = [BulkUserResult(index=i, uid=uid) for i, uid in enumerate(users.uids)]
+    chunks = [results[i:i + MAX_DELETE_USERS] for i in range(0, len(results), MAX_DELETE_USERS)]
+    await asyncio.gather(*(_delete_users_chunk(chunk) for chunk in chunks))
+
+    succeeded = sum(1 for result in results if result.success)
+    return BulkUserResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
+
+
+async def _delete_users_chunk(chunk: List[BulkUserResult]):
+    """
+    Delete one chunk of users with a single delete_users call.
+
+    :param chunk: The results of the uids to delete, updated in place.
+    """
+    try:
+        outcome = await run_sync(auth.delete_users, [result.uid for result in chunk])
+    except Exception as e:
+        for result in chunk:
+            result.error = f"Error deleting users: {e}"
+        return
+    for result in chunk:
+        result.success = True
+    for error in outcome.errors:
+        chunk[error.index].success = False
+        chunk[error.index].error = error.reason
+    for result in chunk:
+        forget_user(result.uid)
+
+
+@router.get(
+    "/list_users",
+    summary="List every user in Firebase Authentication",
+    response_description="Newline-delimited JSON, one line per user"
+)
+async def list_users(page_size: conint(gt=0, le=1000) = 1000, page_token: Optional[str] = None):
+    """
+    Stream every user, following the pages of list_users.
+
+    The next page is fetched while the current one is sent. If a page cannot
+    be fetched the last line holds the "error" and the "page_token" to resume
+    from.
+
+    :param page_size: Number of users fetched per list_users call.
+    :param page_token: Token of the page to start from, to resume a listing.
+    :return: Streaming response of newline-delimited JSON.
+    """
+    try:
+        page = await run_read(auth.list_users, page_token, page_size)
+    except HTTPException:
+        raise
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"FirebaseError listing users: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Unknown Error listing users: {e}")
+
+    async def stream_users():
+        nonlocal page
+        next_page = None
+        try:
+            while page is not None:
+                next_page = asyncio.ensure_future(run_read(page.get_next_page)) if page.has_next_page else None
+                for user_data in page.users:
+                    yield ndjson_line(user_record_from_user_data(user_data))
+                token = page.next_page_token
+                try:
+                    page = await next_page if next_page is not None else None
+                except Exception as e:
+                    # the status line is already sent, report the error in-band
+                    yield ndjson_line({"error": f"Error listing users: {e}", "page_token": token})
+                    return
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    return StreamingResponse(stream_users(), media_type="application/x-ndjson")
+
+
+class TokenVerifyRequest(BaseModel):
+    id_token: str
+    check_revoked: bool = True
+
+class TokenVerifyResponse(BaseModel):
+    uid: str
+    claims: dict
+
+@router.post(
+    "/verify_token",
+    summary="Verify a Firebase ID token",
+    response_description="JSON object with the uid and the claims of the token"
+)
+async def verify_token(token: TokenVerifyRequest):
+    """
+    Verify a Firebase ID token locally against the cached Google public keys.
+
+    Verified tokens and the revocation state of their users are cached, so
+    repeated verifications do not reach Firebase.
+
+    :param token: Pydantic model representing the ID token and whether to check
+        that it was not revoked.
+    :return: Pydantic model representing the uid and the claims of the token.
+    """
+    try:
+        claims = await token_verifier.verify(token.id_token, check_revoked=token.check_revoked)
+        return TokenVerifyResponse(uid=claims["uid"], claims=claims)
+    except HTTPException:
+        raise
+    except (auth.InvalidIdTokenError, auth.UserDisabledError, auth.UserNotFoundError) as e:
+        raise HTTPException(status_code=401, detail=f"Invalid ID token: {e}")
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"FirebaseError verifying ID token: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Unknown Error verifying ID token: {e}")
+
+
+@router.post(
+    "/revoke_tokens",
+    summary="Revoke the refresh tokens of a user in Firebase Authentication",
+    response_description="JSON object confirming the revocation"
+)
+async def revoke_tokens(user: UserDeleteRequest):
+    """
+    Revoke the refresh tokens of a user, so that its current ID tokens fail the revocation check.
+
+    :param user: Pydantic model representing the user ID.
+    :return: JSON object confirming the revocation.
+    """
+    try:
+        await run_sync(auth.revoke_refresh_tokens, user.uid)
+        forget_user(user.uid)
+        return {"message": "Tokens revoked successfully"}
+    except HTTPException:
+        raise
+    except exceptions.FirebaseError as e:
+        raise HTTPException(status_code=400, detail=f"FirebaseError revoking tokens: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Unknown Error revoking tokens: {e}")
+
+
+@router.get(
+    "/token_stats",
+    summary="Statistics of the ID token verification caches",
+    response_description="JSON object with the hit and miss counters of the token and revocation caches"
+)
+async def token_stats():
+    """
+    Report the hit and miss counters and the sizes of the ID token verification caches.
+
+    :return: JSON object with the counters and entry counts.
+    """
+    return token_verifier.stats()
+
+
+@router.get(
+    "/cache_stats",
+    summary="Statistics of the user record cache",
+    response_description="JSON object with the hit, miss, eviction and invalidation counters"
+)
+async def cache_stats():
+    """
+    Report the user record cache counters and its number of entries.
+
+    :return: JSON object with the cache counters and entry count.
+    """
+    return user_cache.stats()
+
+
+@router.get(
+    "/coalescing_stats",
+    summary="Statistics of the coalescing of concurrent user lookups",
+    response_description="JSON object with the number of upstream lookups and of requests that shared one"
+)
+async def coalescing_stats():
+    """
+    Report how many user lookups went upstream and how many were coalesced into another one.
+
+    :return: JSON object with the upstream call, coalesced request and in-flight counts.
+    """
+    return user_flights.stats()
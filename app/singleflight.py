@@ -0,0 +1,72 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent upstream calls.
+
+    The first caller for a key starts the call, and callers arriving while it is
+    in flight await the same result instead of making their own call. The call
+    runs as its own task, so a caller that goes away does not cancel it for the
+    others.
+
+    Keys are tuples whose first item is the resource they read (a document path,
+    a uid), so that ``forget()`` can detach in-flight reads of a resource that
+    has just been written.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: tuple, func, *args, **kwargs):
+        """
+        Await ``func(*args, **kwargs)``, sharing the call with concurrent callers of the same key.
+
+        :param key: Identifies the call, e.g. ("users/alice", None).
+        :param func: A coroutine function making the upstream call.
+        :return: The result of the shared call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._discard(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _discard(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # the exception is re-raised to every caller through the shield
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self, resource: str):
+        """
+        Stop sharing in-flight calls of a resource, so that later callers start a fresh call.
+
+        :param resource: The first item of the keys to forget.
+        """
+        for key in [key for key in self._calls if key[0] == resource]:
+            del self._calls[key]
+
+    def forget_prefix(self, path: str):
+        """
+        Stop sharing in-flight calls of a path and of everything below it.
+
+        :param path: A slash-separated collection or document path.
+        """
+        prefix = path.rstrip("/") + "/"
+        for key in [key for key in self._calls if key[0] == path or key[0].startswith(prefix)]:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
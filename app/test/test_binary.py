@@ -0,0 +1,113 @@
+import datetime
+from typing import Dict, List
+
+import msgpack
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException, Response
+from fastapi.testclient import TestClient
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.firestore_v1 import Client, GeoPoint
+from google.cloud.firestore_v1.vector import Vector
+from pydantic import BaseModel
+
+from app import binary
+from app.binary import CborFormat, MsgpackFormat, NegotiatedRoute, negotiate_format
+
+db = Client(project="firebridge-test", credentials=AnonymousCredentials())
+timestamp = DatetimeWithNanoseconds(2024, 1, 2, 3, 4, 5, nanosecond=123456789, tzinfo=datetime.timezone.utc)
+# decoded timestamps have microsecond precision
+decoded_timestamp = datetime.datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc)
+
+
+class Document(BaseModel):
+    path: str
+    tags: List[str]
+    data: Dict
+
+
+router = APIRouter(route_class=NegotiatedRoute)
+
+
+@router.post("/echo")
+async def echo(doc: Document, response: Response):
+    if doc.path == "missing":
+        raise HTTPException(status_code=404, detail="Document not found")
+    response.headers["ETag"] = '"v1"'
+    return Document(path=doc.path, tags=doc.tags, data={**doc.data, "read_time": timestamp})
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+MSGPACK = {"Accept": "application/msgpack", "Content-Type": "application/msgpack"}
+
+
+def test_negotiate_format():
+    assert negotiate_format("") is None
+    assert negotiate_format("*/*") is None
+    assert negotiate_format("application/json") is None
+    assert negotiate_format("application/msgpack") is MsgpackFormat
+    assert negotiate_format("application/x-msgpack, */*") is MsgpackFormat
+    assert negotiate_format("application/json, application/msgpack;q=0.5") is None
+    assert negotiate_format("application/json;q=0.5, application/msgpack") is MsgpackFormat
+    assert negotiate_format("application/msgpack;q=0") is None
+
+
+def test_msgpack_round_trip(monkeypatch):
+    monkeypatch.setattr(binary, "_document", db.document)
+    value = {
+        "at": timestamp,
+        "where": GeoPoint(48.85, 2.35),
+        "owner": db.document("users", "alice"),
+        "embedding": Vector([0.5, -1.0]),
+        "blob": b"\x00\xff",
+        "nested": {"tags": ["a", 1, 2.5, None, True]},
+    }
+    data = MsgpackFormat.encode(value)
+    # the timestamp keeps its nanoseconds on the wire
+    assert msgpack.unpackb(data)["at"] == msgpack.Timestamp(1704164645, 123456789)
+
+    decoded = MsgpackFormat.decode(data)
+    assert decoded["at"] == decoded_timestamp
+    assert decoded["where"] == value["where"] and decoded["owner"] == value["owner"]
+    assert decoded["embedding"] == value["embedding"] and decoded["blob"] == value["blob"]
+    assert decoded["nested"] == value["nested"]
+    assert len(data) < len(binary.json.dumps(value, default=str))
+
+
+def test_cbor_timestamps_keep_their_nanoseconds():
+    pytest.importorskip("cbor2")
+    value = {"at": timestamp, "nested": [{"at": timestamp}], "naive": datetime.datetime(2024, 1, 2, 3, 4, 5, 6)}
+    data = CborFormat.encode(value)
+    assert data.count(b"2024-01-02T03:04:05.123456789Z") == 2 and b"2024-01-02T03:04:05.000006000Z" in data
+
+    decoded = CborFormat.decode(data)
+    assert decoded["at"] == decoded["nested"][0]["at"] == decoded_timestamp
+    assert decoded["naive"] == datetime.datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc)
+
+
+def test_negotiated_route():
+    body = {"path": "users/alice", "tags": ["a"], "data": {"where": GeoPoint(1.0, 2.0)}}
+    response = client.post("/echo", content=MsgpackFormat.encode(body), headers=MSGPACK)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response.headers["etag"] == '"v1"' and response.headers["vary"] == "Accept"
+    decoded = MsgpackFormat.decode(response.content)
+    assert decoded["path"] == "users/alice" and decoded["data"]["where"] == GeoPoint(1.0, 2.0)
+    assert decoded["data"]["read_time"] == decoded_timestamp
+
+    # a binary request may ask for a JSON response, and the other way round
+    response = client.post("/echo", content=MsgpackFormat.encode(body), headers={"Content-Type": "application/msgpack"})
+    assert response.json()["data"]["read_time"] == "2024-01-02T03:04:05.123456+00:00"
+    response = client.post("/echo", json={"path": "users/bob", "tags": [], "data": {}}, headers={"Accept": "application/msgpack"})
+    assert MsgpackFormat.decode(response.content)["path"] == "users/bob"
+
+    # errors are encoded in the negotiated format too
+    response = client.post("/echo", content=MsgpackFormat.encode({**body, "path": "missing"}), headers=MSGPACK)
+    assert response.status_code == 404 and MsgpackFormat.decode(response.content) == {"detail": "Document not found"}
+    response = client.post("/echo", content=MsgpackFormat.encode({"path": "users/alice"}), headers=MSGPACK)
+    assert response.status_code == 422 and MsgpackFormat.decode(response.content)["detail"][0]["loc"] == ["body", "tags"]
+    response = client.post("/echo", content=b"\xc1", headers=MSGPACK)
+    assert response.status_code == 400
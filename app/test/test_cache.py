@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+from app import cache as cache_module
+from app.cache import AggregationCache, DocumentCache, UserCache, no_cache
+from app.routers import firestore
+from benchmarks.fake_firebase import FakeFirestore
+
+
+def new_cache(max_bytes=1000, default_ttl=60, collection_ttls=None):
+    return DocumentCache(max_bytes=max_bytes, default_ttl=default_ttl, collection_ttls=collection_ttls or {})
+
+
+def test_hit_and_miss():
+    cache = new_cache()
+    assert cache.get("users/alice") is None
+    cache.set("users/alice", {"name": "Alice"}, cache.token())
+    assert cache.get("users/alice") == {"name": "Alice"}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_per_collection_ttl():
+    cache = new_cache(default_ttl=0, collection_ttls={"config": 0.05})
+    cache.set("users/alice", {"name": "Alice"}, cache.token())
+    cache.set("config/app", {"version": 1}, cache.token())
+    assert cache.get("users/alice") is None
+    assert cache.get("config/app") == {"version": 1}
+    time.sleep(0.06)
+    assert cache.get("config/app") is None
+
+
+def test_lru_eviction():
+    cache = new_cache(max_bytes=40)
+    cache.set("c/a", {"v": "aaaaaaaa"}, cache.token())
+    cache.set("c/b", {"v": "bbbbbbbb"}, cache.token())
+    cache.get("c/a")
+    cache.set("c/c", {"v": "cccccccc"}, cache.token())
+    assert cache.get("c/b") is None
+    assert cache.get("c/a") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 40
+
+
+def test_invalidate_rejects_stale_insert():
+    cache = new_cache()
+    cache.set("c/a", {"v": 1}, cache.token())
+    token = cache.token()
+    cache.invalidate("c/a")
+    assert cache.get("c/a") is None
+    # a read that started before the write must not repopulate the cache
+    cache.set("c/a", {"v": 1}, token)
+    assert cache.get("c/a") is None
+    cache.set("c/a", {"v": 2}, cache.token())
+    assert cache.get("c/a") == {"v": 2}
+
+
+def test_invalidate_prefix():
+    cache = new_cache()
+    for path in ("c/a", "c/a/sub/x", "c2/b"):
+        cache.set(path, {"v": path}, cache.token())
+    cache.invalidate_prefix("c")
+    assert cache.get("c/a") is None
+    assert cache.get("c/a/sub/x") is None
+    assert cache.get("c2/b") == {"v": "c2/b"}
+
+
+def test_no_cache():
+    assert no_cache("no-cache")
+    assert no_cache("max-age=0, No-Cache")
+    assert not no_cache("max-age=60")
+    assert not no_cache(None)
+
+
+def test_user_cache_by_uid_and_email():
+    cache = UserCache(ttl=60, max_entries=2)
+    cache.set({"uid": "alice", "email": "Alice@example.com"}, cache.token())
+    assert cache.get("alice")["email"] == "Alice@example.com"
+    assert cache.get_by_email("alice@example.com")["uid"] == "alice"
+    # the user's email changed: the old address no longer finds it
+    cache.set({"uid": "alice", "email": "new@example.com"}, cache.token())
+    assert cache.get_by_email("alice@example.com") is None
+    cache.set({"uid": "bob", "email": None}, cache.token())
+    cache.set({"uid": "carol", "email": "carol@example.com"}, cache.token())
+    assert cache.get("alice") is None
+    assert cache.get_by_email("new@example.com") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_user_cache_invalidate_rejects_stale_insert():
+    cache = UserCache(ttl=60, max_entries=10)
+    token = cache.token()
+    cache.invalidate("alice")
+    cache.set({"uid": "alice", "email": "alice@example.com"}, token)
+    assert cache.get("alice") is None
+    assert cache.get_by_email("alice@example.com") is None
+    cache.set({"uid": "alice", "email": "alice@example.com"}, cache.token())
+    assert cache.get("alice") is not None
+
+
+def test_aggregation_cache_invalidation():
+    cache = AggregationCache(ttl=60, max_entries=10)
+    cache.set("users count", ("collection", "users"), {"count": 2}, cache.token())
+    cache.set("devices count", ("group", "devices"), {"count": 5}, cache.token())
+    cache.set("groups count", ("collection", "groups"), {"count": 1}, cache.token())
+    assert cache.get("users count") == {"count": 2}
+
+    # a write to users/bob/devices/phone changes the devices group, not users
+    cache.invalidate("users/bob/devices/phone")
+    assert cache.get("devices count") is None
+    assert cache.get("users count") == {"count": 2}
+
+    token = cache.token()
+    cache.invalidate_prefix("users")
+    assert cache.get("users count") is None
+    assert cache.get("groups count") == {"count": 1}
+    # computed before the invalidation
+    cache.set("users count", ("collection", "users"), {"count": 2}, token)
+    assert cache.get("users count") is None
+    cache.set("users/bob/devices count", ("collection", "users/bob/devices"), {"count": 1}, token)
+    assert cache.get("users/bob/devices count") is None
+
+
+def test_aggregation_cache_invalidation_is_per_scope(monkeypatch):
+    cache = AggregationCache(ttl=60, max_entries=10)
+    token = cache.token()
+    # writes to other collections do not drop a result computed meanwhile
+    cache.invalidate("groups/admins")
+    cache.set("users count", ("collection", "users"), {"count": 2}, token)
+    assert cache.get("users count") == {"count": 2}
+    cache.invalidate("users/alice")
+    cache.set("users count", ("collection", "users"), {"count": 2}, token)
+    assert cache.get("users count") is None
+
+    # once the invalidation of its scope is forgotten, an old result is dropped anyway
+    monkeypatch.setattr(cache_module, "MAX_TRACKED_INVALIDATIONS", 2)
+    token = cache.token()
+    cache.invalidate("users/alice")
+    cache.invalidate("a/1")
+    cache.set("users count", ("collection", "users"), {"count": 2}, token)
+    assert cache.get("users count") is None
+    cache.set("users count", ("collection", "users"), {"count": 2}, cache.token())
+    assert cache.get("users count") == {"count": 2}
+
+
+def test_documents_added_through_the_bridge_invalidate_aggregations(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(firestore, "get_db_ref", lambda path_nodes: db.collection("users"))
+    monkeypatch.setattr(firestore, "aggregation_cache", AggregationCache(ttl=60, max_entries=10))
+    path_nodes = [{"type": "collection", "name": "users"}]
+    firestore.aggregation_cache.set("users count", ("collection", "users"), {"count": 0}, firestore.aggregation_cache.token())
+
+    request = firestore.DocumentCreateRequest(path_nodes=path_nodes, document_data={"name": "alice"})
+    asyncio.run(firestore.create_document(request, None))
+    assert firestore.aggregation_cache.get("users count") is None
+
+
+def test_documents_cached_by_read_documents_keep_their_update_time(monkeypatch):
+    db = FakeFirestore()
+    db.document("users", "alice").set({"name": "alice"})
+    monkeypatch.setattr(firestore, "db", db)
+    monkeypatch.setattr(firestore, "get_db_ref", lambda path_nodes: db.document("users", "alice"))
+    monkeypatch.setattr(firestore, "document_cache", new_cache(default_ttl=60))
+    path_nodes = [{"type": "collection", "name": "users"}, {"type": "document", "name": "alice"}]
+
+    asyncio.run(firestore.read_documents(firestore.DocumentsReadRequest(documents=[path_nodes]), None))
+    assert firestore.document_cache.lookup("users/alice") == ({"name": "alice"}, db.document("users", "alice").get().update_time)
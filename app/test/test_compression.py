@@ -0,0 +1,150 @@
+import gzip
+import json
+import tracemalloc
+import zlib
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.compression import COMPRESSORS, CompressionMiddleware, decompress, negotiate_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100, max_request_size=10000)
+
+big_document = {"document_data": {f"field{i}": "value " * 10 for i in range(50)}}
+
+
+@app.get("/big")
+async def big():
+    return big_document
+
+
+@app.get("/small")
+async def small():
+    return {"detail": "ok"}
+
+
+@app.get("/stream")
+async def stream():
+    async def lines():
+        for i in range(3):
+            yield json.dumps({"line": i, "padding": "x" * 50}).encode() + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/file")
+async def file():
+    return Response(gzip.compress(bytes(range(256)) * 4), media_type="application/gzip")
+
+
+@app.post("/echo")
+async def echo(request: Request):
+    return await request.json()
+
+
+client = TestClient(app)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip") == "gzip"
+    assert negotiate_encoding("gzip;q=0.5, identity") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("") is None
+    assert negotiate_encoding("*") == next(iter(COMPRESSORS))
+
+
+def test_large_response_is_compressed():
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(json.dumps(big_document))
+    assert response.json() == big_document
+
+
+def test_small_response_is_not_compressed():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"detail": "ok"}
+
+
+def test_no_accept_encoding():
+    response = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == big_document
+
+
+def test_streaming_response_is_compressed():
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert [json.loads(line)["line"] for line in response.text.splitlines()] == [0, 1, 2]
+
+
+def test_compressed_file_is_not_compressed_again():
+    response = client.get("/file", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert gzip.decompress(response.content) == bytes(range(256)) * 4
+
+
+def test_compressed_request_body():
+    body = gzip.compress(json.dumps(big_document).encode())
+    response = client.post(
+        "/echo",
+        content=body,
+        headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+    )
+    assert response.status_code == 200, response.text
+    assert response.json() == big_document
+
+    response = client.post(
+        "/echo",
+        content=zlib.compress(json.dumps({"a": 1}).encode()),
+        headers={"Content-Encoding": "deflate", "Content-Type": "application/json"},
+    )
+    assert response.json() == {"a": 1}
+
+
+def test_compressed_request_body_errors():
+    response = client.post("/echo", content=b"not gzip", headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 415
+    response = client.post("/echo", content=b"{}", headers={"Content-Encoding": "compress"})
+    assert response.status_code == 415
+    # decompresses past max_request_size
+    response = client.post("/echo", content=gzip.compress(b" " * 20000), headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+    # every member of a multi-member body counts
+    members = gzip.compress(b" " * 6000) * 4
+    response = client.post("/echo", content=members, headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+    response = client.post("/echo", content=gzip.compress(b"{}") + b"garbage", headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 415
+
+
+def test_multi_member_gzip_request_body():
+    members = gzip.compress(b'{"a": ') + gzip.compress(b'"b"}')
+    assert decompress("gzip", members, 100) == b'{"a": "b"}'
+    response = client.post("/echo", content=members, headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+    assert response.status_code == 200 and response.json() == {"a": "b"}
+
+
+@pytest.mark.skipif("br" not in COMPRESSORS, reason="brotli is not installed")
+def test_brotli_bomb_is_not_inflated():
+    bomb = brotli.compress(bytes(20_000_000), quality=1)
+    assert len(bomb) < 10000
+    tracemalloc.start()
+    with pytest.raises(OverflowError):
+        decompress("br", bomb, 1024)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 100_000
+    assert decompress("br", brotli.compress(b"x" * 5000), 5000) == b"x" * 5000
+    response = client.post("/echo", content=bomb, headers={"Content-Encoding": "br"})
+    assert response.status_code == 413
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import gzip
+import json
+
+import pytest
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.firestore_v1 import Client, GeoPoint
+
+from app.encoding import decode_value, encode_value
+from app.export import (
+    AUTO_ID_CHARACTERS,
+    Export,
+    ExportError,
+    export_file_path,
+    export_to_file,
+    id_ranges,
+    partitioned_queries,
+)
+from benchmarks.fake_firebase import FakeFirestore
+
+
+def test_lossless_encoding():
+    db = Client(project="firebridge-test", credentials=AnonymousCredentials())
+    timestamp = DatetimeWithNanoseconds(2024, 1, 2, 3, 4, 5, nanosecond=123456789, tzinfo=datetime.timezone.utc)
+    value = {
+        "at": timestamp,
+        "where": GeoPoint(48.85, 2.35),
+        "owner": db.document("users", "alice"),
+        "blob": b"\x00\xff",
+        "ratio": float("inf"),
+        "tags": ["a", 1, 2.5, None, True],
+        "raw": {"$timestamp": "not a timestamp"},
+    }
+    encoded = json.loads(json.dumps(encode_value(value), allow_nan=False))
+    assert encoded["at"] == {"$timestamp": "2024-01-02T03:04:05.123456789Z"}
+    assert encoded["owner"] == {"$reference": "users/alice"}
+    assert encoded["raw"] == {"$map": {"$timestamp": "not a timestamp"}}
+
+    decoded = decode_value(encoded, db)
+    assert decoded["at"] == timestamp and decoded["at"].nanosecond == 123456789
+    assert decoded["where"] == value["where"] and decoded["owner"] == value["owner"]
+    assert decoded["blob"] == value["blob"] and decoded["ratio"] == value["ratio"]
+    assert decoded["tags"] == value["tags"] and decoded["raw"] == value["raw"]
+
+
+def read_export(data: bytes):
+    lines = [json.loads(line) for line in gzip.decompress(data).splitlines()]
+    return [line["path"] for line in lines[:-1]], lines[-1]["export"]
+
+
+async def collect(export):
+    return b"".join([chunk async for chunk in export.chunks()])
+
+
+def test_export_pages_through_collections():
+    db = FakeFirestore()
+    for i in range(5):
+        db.document("users", f"u{i}").set({"n": i})
+    db.document("users", "u0", "posts", "p0").set({"n": 0})
+    # a subcollection of a document that does not exist
+    db.document("users", "ghost", "posts", "p1").set({"n": 1})
+    db.document("other", "o0").set({"n": 0})
+
+    paths, trailer = read_export(asyncio.run(collect(Export(db.collection("users"), False, page_size=2))))
+    assert paths == [f"users/u{i}" for i in range(5)]
+    assert trailer == {"documents": 5, "complete": True}
+
+    paths, trailer = read_export(asyncio.run(collect(Export(db.collection("users"), False, True, page_size=2))))
+    assert sorted(paths) == ["users/ghost/posts/p1", "users/u0", "users/u0/posts/p0"] + [f"users/u{i}" for i in range(1, 5)]
+    assert trailer["documents"] == 7
+
+    paths, _ = read_export(asyncio.run(collect(Export(db.document("users", "u0"), True, True, page_size=1))))
+    assert paths == ["users/u0", "users/u0/posts/p0"]
+
+
+def test_export_to_file(tmp_path):
+    db = FakeFirestore()
+    db.document("users", "u0").set({"n": 0})
+    with pytest.raises(ExportError):
+        export_file_path("", "users.ndjson.gz")
+    with pytest.raises(ExportError):
+        export_file_path(str(tmp_path), "../users.ndjson.gz")
+
+    path = export_file_path(str(tmp_path), "users.ndjson.gz")
+    export = Export(db.collection("users"), False)
+    asyncio.run(export_to_file(export, path))
+    assert read_export(open(path, "rb").read()) == (["users/u0"], {"documents": 1, "complete": True})
+    assert export.bytes == len(open(path, "rb").read())
+    assert [p.name for p in tmp_path.iterdir()] == ["users.ndjson.gz"]
+
+
+def test_collection_is_read_in_id_ranges():
+    assert id_ranges(1) == [(None, None)]
+    assert id_ranges(2) == [(None, "V"), ("V", None)]
+    assert len(id_ranges(100)) == len(AUTO_ID_CHARACTERS)
+
+    db = FakeFirestore()
+    ids = [character + "x" for character in AUTO_ID_CHARACTERS] + ["_custom", "0", "zzz"]
+    for doc_id in ids:
+        db.document("users", doc_id).set({"id": doc_id})
+        db.document("users", doc_id, "posts", "p").set({"id": doc_id})
+    for recursive in (False, True):
+        export = Export(db.collection("users"), False, recursive, page_size=5, concurrency=4)
+        paths, trailer = read_export(asyncio.run(collect(export)))
+        expected = [f"users/{doc_id}" for doc_id in ids] + ([f"users/{doc_id}/posts/p" for doc_id in ids] if recursive else [])
+        assert sorted(paths) == sorted(expected) and trailer["documents"] == len(expected)
+
+    # the ranges are document ID cursors of the real client's queries
+    client = Client(project="firebridge-test", credentials=AnonymousCredentials())
+    for recursive in (False, True):
+        queries = partitioned_queries(client.collection("users"), recursive, 3)
+        first, middle, last = (query._to_protobuf() for query in queries)
+        assert first.end_at.before and first.end_at.values[0].reference_value.endswith("/documents/users/K")
+        assert middle.start_at.before and middle.start_at.values[0].reference_value.endswith("/documents/users/K")
+        assert middle.end_at.before and middle.end_at.values[0].reference_value.endswith("/documents/users/f")
+        assert last.start_at.values[0].reference_value.endswith("/documents/users/f")
+        # a recursive query keeps its own bounds of the collection at both ends
+        assert bool(first.start_at.values) == bool(last.end_at.values) == recursive
@@ -1,10 +1,11 @@
 # GPT PROMPT
 # I am using FastAPI to create an API app interacting with Google Firebase. Please help me to write a FastAPI test for this endpoint
 
+import json
+
 from fastapi.testclient import TestClient
 from app.main import app
-from app.routers.firestore import get_db_ref_str
-from app.init_firebase import db
+from app.resolver import get_db_ref, get_db_ref_from_path
 
 client = TestClient(app)
 
@@ -39,6 +40,31 @@ def test_read_main():
     assert response.json() == {"message": "Hello, Firebridge!"}
 
 
+def test_get_db_ref():
+    path_nodes = collection_path_nodes["my_sub_collection"]
+    coll_ref = get_db_ref(path_nodes)
+    assert coll_ref.id == "my_sub_collection"
+    assert coll_ref.parent.path == f"{main_test_coll_name}/my_document"
+    assert get_db_ref_from_path(f"/{main_test_coll_name}/my_document/my_sub_collection/") is coll_ref
+
+    doc_ref = get_db_ref(path_nodes + [{"type": "document", "name": "a_deep_document"}])
+    assert doc_ref.path == f"{main_test_coll_name}/my_document/my_sub_collection/a_deep_document"
+
+
+def test_read_document_invalid_path():
+    # the last node type must match the kind of reference the path resolves to
+    response = client.post(
+        "/firestore/read_document",
+        json={
+            "path_nodes": [
+                {"type": "collection", "name": main_test_coll_name},
+                {"type": "collection", "name": "x').document('y"},
+            ]
+        },
+    )
+    assert response.status_code == 400, "Response: {}".format(response.text)
+
+
 def test_create_document_with_specific_name():
     path_nodes = collection_path_nodes["my_sub_collection"]+[
         {"type": "document", "name": "a_deep_document"}
@@ -62,7 +88,7 @@ def test_create_document_under_collection():
 def test_read_document():
     # Create a new document for testing
     city = {"name": "Tokyo", "country": "Japan"}
-    city_ref = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).add(city)[1]
+    city_ref = get_db_ref(collection_path_nodes["main_test_coll"]).add(city)[1]
 
     # Send a request to read the document
     response = client.post(
@@ -79,10 +105,126 @@ def test_read_document():
     assert response.json() == {"document_data": city}
 
 
+def test_read_document_etag():
+    city_ref = get_db_ref(collection_path_nodes["main_test_coll"]).add({"name": "Tokyo"})[1]
+    payload = {
+        "path_nodes": collection_path_nodes["main_test_coll"]+[
+            {"type": "document", "name": city_ref.id}
+        ]
+    }
+
+    response = client.post("/firestore/read_document", json=payload)
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    etag = response.headers["etag"]
+
+    response = client.post("/firestore/read_document", json=payload, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # a new version gets a new ETag
+    city_ref.update({"name": "New Tokyo"})
+    response = client.post("/firestore/read_document", json=payload, headers={"If-None-Match": etag})
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.headers["etag"] != etag
+
+
+def test_sync_collection():
+    coll_ref = get_db_ref(collection_path_nodes["main_test_coll"])
+    coll_ref.document("sync_old").set({"value": 1})
+    coll_ref.document("sync_deleted").set({"value": 2})
+    first = client.post(
+        "/firestore/sync",
+        json={"path_nodes": collection_path_nodes["main_test_coll"], "since": "2000-01-01T00:00:00Z"},
+    )
+    assert first.status_code == 200, "Response: {}".format(first.text)
+    assert f"{main_test_coll_name}/sync_old" in [d["path"] for d in first.json()["documents"]]
+
+    coll_ref.document("sync_new").set({"value": 3})
+    response = client.request(
+        method="DELETE",
+        url="/firestore/delete_document",
+        json={"path_nodes": collection_path_nodes["main_test_coll"] + [{"type": "document", "name": "sync_deleted"}]},
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+
+    response = client.post(
+        "/firestore/sync",
+        json={"path_nodes": collection_path_nodes["main_test_coll"], "since": first.json()["sync_time"]},
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert [d["path"] for d in response.json()["documents"]] == [f"{main_test_coll_name}/sync_new"]
+    assert [d["path"] for d in response.json()["deleted"]] == [f"{main_test_coll_name}/sync_deleted"]
+
+
+def test_read_document_field_paths():
+    city = {"name": "Tokyo", "country": "Japan", "location": {"lat": 35.68, "lng": 139.69}}
+    city_ref = get_db_ref(collection_path_nodes["main_test_coll"]).add(city)[1]
+
+    response = client.post(
+        "/firestore/read_document",
+        json={
+            "path_nodes": collection_path_nodes["main_test_coll"]+[
+                {"type": "document", "name": city_ref.id}
+            ],
+            "field_paths": ["name", "location.lat"],
+        },
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.json() == {"document_data": {"name": "Tokyo", "location": {"lat": 35.68}}}
+
+
+def test_read_documents():
+    coll_ref = get_db_ref(collection_path_nodes["main_test_coll"])
+    coll_ref.document("read_many_1").set({"name": "Tokyo", "country": "Japan"})
+    coll_ref.document("read_many_2").set({"name": "Paris", "country": "France"})
+
+    response = client.post(
+        "/firestore/read_documents",
+        json={
+            "documents": [
+                collection_path_nodes["main_test_coll"] + [{"type": "document", "name": name}]
+                for name in ("read_many_1", "read_many_2", "read_many_missing")
+            ],
+            "field_paths": ["name"],
+        },
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    documents = response.json()["documents"]
+    assert documents[f"{main_test_coll_name}/read_many_1"] == {"exists": True, "document_data": {"name": "Tokyo"}}
+    assert documents[f"{main_test_coll_name}/read_many_2"] == {"exists": True, "document_data": {"name": "Paris"}}
+    assert documents[f"{main_test_coll_name}/read_many_missing"] == {"exists": False, "document_data": None}
+
+
+def test_query_documents():
+    coll_ref = get_db_ref(collection_path_nodes["main_test_coll"])
+    for i in range(5):
+        coll_ref.document(f"query_doc{i}").set({"kind": "query", "value": i})
+
+    payload = {
+        "path_nodes": collection_path_nodes["main_test_coll"],
+        "where": [{"field": "kind", "op": "==", "value": "query"}],
+        "order_by": [{"field": "value", "direction": "DESCENDING"}],
+        "select": ["value"],
+        "limit": 3,
+    }
+    response = client.post("/firestore/query", json=payload)
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["document_data"] for line in lines[:-1]] == [{"value": 4}, {"value": 3}, {"value": 2}]
+    assert lines[-1]["cursor"]
+
+    # resume after the last document of the first page
+    response = client.post("/firestore/query", json={**payload, "start_after": lines[-1]["cursor"]})
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["document_data"] for line in lines[:-1]] == [{"value": 1}, {"value": 0}]
+    assert lines[-1] == {"cursor": None}
+
+
 def test_update_document():
     # Create a new document for testing
     city = {"name": "Tokyo", "country": "Japan"}
-    city_ref = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).add(city)[1]
+    city_ref = get_db_ref(collection_path_nodes["main_test_coll"]).add(city)[1]
 
     # Update the document with new data
     new_data = {"name": "New Tokyo", "population": 14000000}
@@ -104,7 +246,7 @@ def test_update_document():
     }  # Merge the original data with the updated fields
     assert response.json() == {"detail": "Document updated successfully"}
     updated_doc = (
-        eval(get_db_ref_str(collection_path_nodes["main_test_coll"]))
+        get_db_ref(collection_path_nodes["main_test_coll"])
         .document(city_ref.id)
         .get()
     )
@@ -114,7 +256,7 @@ def test_update_document():
 # https://www.python-httpx.org/compatibility/#request-body-on-http-methods
 def test_delete_document():
     # Create a new document for testing
-    doc_ref = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).document(
+    doc_ref = get_db_ref(collection_path_nodes["main_test_coll"]).document(
         "new_document"
     )
     doc_ref.set({"name": "Test", "age": 42})
@@ -142,7 +284,7 @@ def test_delete_document():
 def test_delete_collection():
     # Create a new collection for testing
     for i in range(10):
-        doc_ref = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).document(
+        doc_ref = get_db_ref(collection_path_nodes["main_test_coll"]).document(
             f"doc{i}"
         )
         doc_ref.set({"name": f"Test Document {i}", "value": i})
@@ -158,20 +300,50 @@ def test_delete_collection():
 
     # Check that the response is successful and contains the expected data
     assert response.status_code == 200, f"Response: {response.text}"
-    assert response.json() == {"detail": "Collection deleted successfully"}
+    assert response.json()["detail"] == "Collection deleted successfully"
+    assert response.json()["documents_deleted"] >= 10
+    assert response.json()["documents_failed"] == 0
 
     # Check that the collection was deleted from Firestore
-    docs = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).limit(1).get()
+    docs = get_db_ref(collection_path_nodes["main_test_coll"]).limit(1).get()
+    assert len(list(docs)) == 0, "Length: {}".format(len(list(docs)))
+
+
+def test_delete_collection_recursive():
+    # Create documents with subcollections, and one document that only exists
+    # as the parent of a subcollection
+    coll_ref = get_db_ref(collection_path_nodes["main_test_coll"])
+    for i in range(3):
+        doc_ref = coll_ref.document(f"parent{i}")
+        doc_ref.set({"value": i})
+        doc_ref.collection("children").document("child").set({"value": i})
+    coll_ref.document("missing_parent").collection("children").document("child").set({"value": -1})
+
+    response = client.request(
+        method="DELETE",
+        url="/firestore/delete_collection",
+        json={
+            "path_nodes": collection_path_nodes["main_test_coll"],
+            "recursive": True,
+            "page_size": 2,
+        },
+    )
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert response.json()["documents_deleted"] >= 8
+
+    assert not coll_ref.document("parent0").collection("children").document("child").get().exists
+    assert not coll_ref.document("missing_parent").collection("children").document("child").get().exists
+    docs = coll_ref.limit(1).get()
     assert len(list(docs)) == 0, "Length: {}".format(len(list(docs)))
 
 
 def test_delete_collection_or_document():
     # Create a test document
-    doc_ref = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).add({"name": "Test Document"})
+    doc_ref = get_db_ref(collection_path_nodes["main_test_coll"]).add({"name": "Test Document"})
     doc_id = doc_ref[1].id
 
     # Create a test collection with documents
-    coll_ref = eval(get_db_ref_str(collection_path_nodes["test_coll"]))
+    coll_ref = get_db_ref(collection_path_nodes["test_coll"])
     for i in range(10):
         coll_ref.add({"name": f"Test Document {i+1}"})
 
@@ -186,11 +358,11 @@ def test_delete_collection_or_document():
     assert response.status_code == 200, "Response: {}".format(response.text)
 
     # # Check that the document is deleted
-    # docs = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).limit(1).get()
+    # docs = get_db_ref(collection_path_nodes["main_test_coll"]).limit(1).get()
     # assert len(list(docs)) == 0, "Length: {}".format(len(list(docs)))
             
     # Check that the document was actually deleted from the database
-    doc_snapshot = eval(get_db_ref_str(collection_path_nodes["main_test_coll"])).document(doc_id).get()
+    doc_snapshot = get_db_ref(collection_path_nodes["main_test_coll"]).document(doc_id).get()
     assert not doc_snapshot.exists
 
 
@@ -205,13 +377,78 @@ def test_delete_collection_or_document():
 
     # # Check that the collection is deleted
     # with pytest.raises(exceptions.NotFoundError):
-    #     eval(get_db_ref_str(collection_path_nodes["test_coll"])).limit(1).get()
+    #     get_db_ref(collection_path_nodes["test_coll"]).limit(1).get()
 
     # Check that the collection was deleted from Firestore
-    docs = eval(get_db_ref_str(collection_path_nodes["test_coll"])).limit(1).get()
+    docs = get_db_ref(collection_path_nodes["test_coll"]).limit(1).get()
     assert len(list(docs)) == 0, "Length: {}".format(len(list(docs)))
 
 
+def test_batch_write():
+    coll_path_nodes = collection_path_nodes["main_test_coll"]
+    doc_path_nodes = coll_path_nodes + [{"type": "document", "name": "batch_doc"}]
+    operations = [
+        {"op": "set", "path_nodes": doc_path_nodes, "data": {"name": "Batch", "value": 1}},
+        {"op": "update", "path_nodes": doc_path_nodes, "data": {"value": 2}},
+        {"op": "add", "path_nodes": coll_path_nodes, "data": {"name": "Added"}},
+        # invalid: add needs a collection path, it fails without affecting the others
+        {"op": "add", "path_nodes": doc_path_nodes, "data": {"name": "Invalid"}},
+    ] + [
+        {"op": "set", "path_nodes": coll_path_nodes + [{"type": "document", "name": f"batch{i}"}], "data": {"value": i}}
+        for i in range(600)
+    ]
+    response = client.post("/firestore/batch_write", json={"operations": operations, "concurrent": True})
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    body = response.json()
+    assert body["succeeded"] == len(operations) - 1
+    assert body["failed"] == 1
+    assert body["results"][3]["success"] is False
+    added_path = body["results"][2]["path"]
+
+    assert get_db_ref(doc_path_nodes).get().to_dict() == {"name": "Batch", "value": 2}
+    assert get_db_ref_from_path(added_path).get().to_dict() == {"name": "Added"}
+    assert get_db_ref(coll_path_nodes).document("batch599").get().exists
+
+
+def test_aggregate():
+    coll_path_nodes = collection_path_nodes["main_test_coll"] + [{"type": "document", "name": "aggregate_doc"}, {"type": "collection", "name": "items"}]
+    for i in range(5):
+        get_db_ref(coll_path_nodes).document(f"item{i}").set({"price": i, "kind": "odd" if i % 2 else "even"})
+    response = client.post("/firestore/aggregate", json={
+        "path_nodes": coll_path_nodes,
+        "where": [{"field": "kind", "op": "==", "value": "even"}],
+        "aggregations": [{"op": "count"}, {"op": "sum", "field": "price"}, {"op": "avg", "field": "price", "alias": "mean"}],
+    })
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.json()["results"] == {"count": 3, "sum_price": 6, "mean": 2.0}
+
+    response = client.post("/firestore/aggregate", json={"path_nodes": coll_path_nodes, "aggregations": [{"op": "sum"}]})
+    assert response.status_code == 400
+
+
+def test_transaction():
+    doc_path_nodes = collection_path_nodes["main_test_coll"] + [{"type": "document", "name": "transaction_doc"}]
+    get_db_ref(doc_path_nodes).set({"balance": 10, "tags": ["a"]})
+    request = {
+        "reads": [{"name": "account", "path_nodes": doc_path_nodes}],
+        "preconditions": [{"read": "account", "field": "balance", "op": ">=", "value": 4}],
+        "writes": [{"op": "update", "path_nodes": doc_path_nodes, "data": {
+            "balance": {"$increment": -4},
+            "previous": {"$ref": "account.balance"},
+            "tags": {"$array_union": ["b"]},
+        }}],
+    }
+    response = client.post("/firestore/transaction", json=request)
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.json()["reads"] == {"account": {"balance": 10, "tags": ["a"]}}
+    assert get_db_ref(doc_path_nodes).get().to_dict() == {"balance": 6, "previous": 10, "tags": ["a", "b"]}
+
+    request["preconditions"][0]["value"] = 7
+    response = client.post("/firestore/transaction", json=request)
+    assert response.status_code == 409
+    assert get_db_ref(doc_path_nodes).get().to_dict()["balance"] == 6
+
+
 def test_clean_up_firestore_testing():
     for key, value in collection_path_nodes.items():
         print(key, value)
@@ -226,5 +463,5 @@ def test_clean_up_firestore_testing():
         assert response.status_code == 200, "Response: {}".format(response.text)
 
         # Check that the collection was deleted from Firestore
-        docs = eval(get_db_ref_str(value)).limit(1).get()
+        docs = get_db_ref(value).limit(1).get()
         assert len(list(docs)) == 0, "Length: {}".format(len(list(docs)))
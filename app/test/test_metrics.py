@@ -0,0 +1,50 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from firebase_admin import auth
+
+from app.metrics import Histogram, MetricsMiddleware, Registry, operation_name, request_duration
+
+
+class DocumentReference:
+    def get(self):
+        pass
+
+
+def test_histogram_render():
+    registry = Registry()
+    histogram = registry.register(Histogram("latency_seconds", "Latency.", ("op",), buckets=(0.1, 1)))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, ('say "hi"',))
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{op="say \\"hi\\"",le="0.1"} 2',
+        'latency_seconds_bucket{op="say \\"hi\\"",le="1"} 3',
+        'latency_seconds_bucket{op="say \\"hi\\"",le="+Inf"} 4',
+        'latency_seconds_sum{op="say \\"hi\\""} 3.65',
+        'latency_seconds_count{op="say \\"hi\\""} 4',
+    ]
+
+
+def test_operation_name():
+    assert operation_name(DocumentReference().get) == "DocumentReference.get"
+    assert operation_name(auth.get_user) == "auth.get_user"
+
+
+def test_middleware_labels_by_route():
+    app = FastAPI()
+
+    @app.post("/items")
+    async def items(body: dict):
+        return body
+
+    app.add_middleware(MetricsMiddleware)
+    client = TestClient(app)
+    client.post("/items", json={"a": 1})
+    client.get("/items")
+    client.get("/random/path")
+
+    labels = set(request_duration._values)
+    assert ("POST", "/items", "200") in labels
+    assert ("GET", "/items", "405") in labels
+    assert ("GET", "unmatched", "404") in labels
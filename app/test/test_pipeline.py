@@ -0,0 +1,72 @@
+import asyncio
+
+from fastapi import APIRouter, FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.routers import pipeline
+
+calls = []
+user = APIRouter()
+firestore = APIRouter()
+
+
+@user.post("/read_user")
+async def read_user(body: dict, authorization: str = Header(None)):
+    calls.append(("start", body["uid"]))
+    await asyncio.sleep(0.05)
+    calls.append(("end", body["uid"]))
+    if body["uid"] == "missing":
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"uid": body["uid"], "team": f"team-{body['uid']}", "authorization": authorization}
+
+
+@firestore.post("/query")
+async def query(body: dict):
+    async def lines():
+        yield b'{"id":"a"}\n'
+        yield b'{"cursor":null}\n'
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+app = FastAPI()
+app.include_router(user, prefix="/user")
+app.include_router(firestore, prefix="/firestore")
+app.include_router(pipeline.router)
+client = TestClient(app)
+
+
+def test_independent_operations_run_concurrently():
+    calls.clear()
+    response = client.post("/pipeline", json={"operations": [
+        {"id": "a", "path": "/user/read_user", "body": {"uid": "alice"}},
+        {"id": "b", "path": "/user/read_user", "body": {"uid": "bob"}},
+        {"path": "/user/read_user", "body": {"uid": {"$result": "a.team"}}},
+        {"path": "/firestore/query", "body": {}},
+    ]}, headers={"Authorization": "Bearer token"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["succeeded"] == 4
+    assert calls[:2] == [("start", "alice"), ("start", "bob")]
+    # the third operation waits for the result of the first
+    assert calls.index(("start", "team-alice")) > calls.index(("end", "alice"))
+    assert body["results"][0]["body"]["authorization"] == "Bearer token"
+    assert body["results"][3]["body"] == [{"id": "a"}, {"cursor": None}]
+
+
+def test_failed_dependency():
+    response = client.post("/pipeline", json={"operations": [
+        {"id": "a", "path": "/user/read_user", "body": {"uid": "missing"}},
+        {"path": "/user/read_user", "body": {"uid": "bob"}, "depends_on": ["a"]},
+        {"path": "/user/read_user", "body": {"uid": "carol"}},
+    ]})
+    assert [result["status"] for result in response.json()["results"]] == [404, 424, 200]
+
+
+def test_unknown_reference():
+    response = client.post("/pipeline", json={"operations": [
+        {"path": "/user/read_user", "body": {"uid": {"$result": "later.uid"}}},
+        {"id": "later", "path": "/user/read_user", "body": {"uid": "alice"}},
+    ]})
+    assert response.status_code == 400
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.realtime import ListenerHub
+
+
+class FakeWatch:
+    def __init__(self):
+        self.unsubscribed = threading.Event()
+
+    def unsubscribe(self):
+        self.unsubscribed.set()
+
+
+class FakeQuery:
+    """Stands in for a Firestore query: records listeners and fires snapshots from a thread."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.watches = []
+
+    def on_snapshot(self, callback):
+        self.callbacks.append(callback)
+        self.watches.append(FakeWatch())
+        return self.watches[-1]
+
+    def fire(self, docs, changes):
+        threads = [threading.Thread(target=callback, args=(docs, changes, None)) for callback in self.callbacks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def fake_doc(doc_id, data):
+    return SimpleNamespace(
+        id=doc_id,
+        reference=SimpleNamespace(path=f"coll/{doc_id}"),
+        exists=True,
+        to_dict=lambda: data,
+        update_time=None,
+    )
+
+
+def parse(event: bytes):
+    name, data = event.decode().strip().split("\n")
+    return name[len("event: "):], json.loads(data[len("data: "):])
+
+
+def test_listeners_are_shared_and_torn_down():
+    async def scenario():
+        hub = ListenerHub()
+        query = FakeQuery()
+        first = await hub.subscribe("q", query)
+        second = await hub.subscribe("q", query)
+        assert len(query.callbacks) == 1
+        assert hub.stats() == {"listeners": 1, "subscribers": 2}
+
+        doc = fake_doc("a", {"v": 1})
+        query.fire([doc], [SimpleNamespace(type=SimpleNamespace(name="ADDED"), document=doc)])
+        for subscriber in (first, second):
+            name, data = parse(await asyncio.wait_for(subscriber.queue.get(), 1))
+            assert name == "snapshot"
+            assert data["documents"][0]["document_data"] == {"v": 1}
+
+        # a late joiner gets the current state, the others only the changes
+        third = await hub.subscribe("q", query)
+        name, data = parse(third.queue.get_nowait())
+        assert name == "snapshot"
+        modified = fake_doc("a", {"v": 2})
+        query.fire([modified], [SimpleNamespace(type=SimpleNamespace(name="MODIFIED"), document=modified)])
+        name, data = parse(await asyncio.wait_for(first.queue.get(), 1))
+        assert name == "changes"
+        assert data["changes"][0]["type"] == "MODIFIED"
+
+        for subscriber in (first, second, third):
+            hub.unsubscribe("q", subscriber)
+        assert hub.stats() == {"listeners": 0, "subscribers": 0}
+        assert query.watches[0].unsubscribed.wait(1)
+
+    asyncio.run(scenario())
+
+
+class SlowQuery(FakeQuery):
+    """A query whose listener takes until ``release`` is set to start, or fails to."""
+
+    def __init__(self, error=None):
+        super().__init__()
+        self.release = threading.Event()
+        self.error = error
+
+    def on_snapshot(self, callback):
+        self.release.wait(1)
+        if self.error is not None:
+            raise self.error
+        return super().on_snapshot(callback)
+
+
+def test_client_leaving_while_the_listener_starts():
+    async def scenario():
+        hub = ListenerHub()
+        query = SlowQuery()
+        stream = hub.stream("q", query)
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        assert hub.stats() == {"listeners": 1, "subscribers": 1}
+        pending.cancel()
+        await asyncio.sleep(0.01)
+        assert hub.stats() == {"listeners": 1, "subscribers": 0}
+
+        # the watch started after the client left is stopped
+        query.release.set()
+        await asyncio.sleep(0.05)
+        assert query.watches[0].unsubscribed.wait(1)
+        assert hub.stats() == {"listeners": 0, "subscribers": 0}
+
+    asyncio.run(scenario())
+
+
+def test_listener_failing_to_start_fails_every_waiting_client():
+    async def scenario():
+        hub = ListenerHub()
+        query = SlowQuery(ValueError("permission denied"))
+        first = asyncio.ensure_future(hub.subscribe("q", query))
+        second = asyncio.ensure_future(hub.subscribe("q", query))
+        await asyncio.sleep(0.01)
+        query.release.set()
+        for waiting in (first, second):
+            with pytest.raises(ValueError):
+                await waiting
+        assert hub.stats() == {"listeners": 0, "subscribers": 0}
+
+        # a stream, whose response has started, reports the error in-band
+        events = [event async for event in hub.stream("q", query)]
+        assert [parse(event) for event in events] == [("error", {"detail": "Error starting listener: permission denied"})]
+        assert hub.stats() == {"listeners": 0, "subscribers": 0}
+
+    asyncio.run(scenario())
@@ -0,0 +1,25 @@
+import pytest
+
+from app.resolver import path_segments
+
+
+def test_path_segments():
+    assert path_segments([{"type": "collection", "name": "users"}]) == ("users",)
+    assert path_segments([
+        {"type": "collection", "name": "users"},
+        {"type": "document", "name": "alice/devices/phone"},
+    ]) == ("users", "alice", "devices", "phone")
+
+
+def test_every_node_type_is_checked():
+    with pytest.raises(ValueError, match="does not resolve to a document"):
+        path_segments([{"type": "document", "name": "users"}])
+    # a document in a collection position, hidden by the parity of the whole path
+    with pytest.raises(ValueError, match="users does not resolve to a document"):
+        path_segments([
+            {"type": "document", "name": "users"},
+            {"type": "collection", "name": "alice"},
+            {"type": "collection", "name": "devices"},
+        ])
+    with pytest.raises(ValueError):
+        path_segments([{"type": "collection", "name": "users/"}])
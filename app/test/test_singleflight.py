@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do(("doc",), fetch, 42) for _ in range(10)))
+        assert results == [42] * 10
+        assert flights.stats() == {"calls": 1, "coalesced": 9, "in_flight": 0}
+        # once the call is done, the next caller starts a new one
+        assert await flights.do(("doc",), fetch, 43) == 43
+
+    asyncio.run(scenario())
+    assert calls == [42, 43]
+
+
+def test_errors_are_shared():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do(("doc",), fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "data"
+
+    async def scenario():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do(("doc",), fetch))
+        second = asyncio.ensure_future(flights.do(("doc",), fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "data"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(scenario())
+
+
+def test_forget():
+    async def fetch(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def scenario():
+        flights = SingleFlight()
+        old = asyncio.ensure_future(flights.do(("doc", None), fetch, "old"))
+        await asyncio.sleep(0)
+        flights.forget("doc")
+        # a read starting after a write does not join the read started before it
+        assert await flights.do(("doc", None), fetch, "new") == "new"
+        assert await old == "old"
+        assert flights.stats()["calls"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_forget_prefix():
+    async def fetch(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def scenario():
+        flights = SingleFlight()
+        reads = [
+            asyncio.ensure_future(flights.do((path, None), fetch, path))
+            for path in ("users/alice", "users/alice/posts/1", "users_archive/bob")
+        ]
+        await asyncio.sleep(0)
+        flights.forget_prefix("users")
+        assert flights.stats()["in_flight"] == 1
+        assert await asyncio.gather(*reads) == ["users/alice", "users/alice/posts/1", "users_archive/bob"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+import threading
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app import init_firebase
+from app.routers import firestore
+from app.main import app
+
+
+def test_client_is_created_on_first_use(monkeypatch):
+    clients = []
+
+    class Client:
+        def collection(self, name):
+            return name
+
+    def client(firebase_app=None):
+        clients.append(Client())
+        return clients[-1]
+
+    monkeypatch.setattr(init_firebase, "_client", None)
+    monkeypatch.setattr(init_firebase.firebase_admin, "get_app", lambda: object())
+    monkeypatch.setattr(init_firebase.firestore, "client", client)
+    assert not init_firebase.initialized()
+    assert init_firebase.db.collection("users") == "users"
+    assert init_firebase.db.collection("groups") == "groups"
+    assert len(clients) == 1 and init_firebase.initialized()
+
+
+def test_health_checks_before_initialization(monkeypatch):
+    monkeypatch.setattr(init_firebase, "_client", None)
+    monkeypatch.setattr(init_firebase, "_error", "RuntimeError: GOOGLE_APPLICATION_CREDENTIALS is not set")
+    client = TestClient(app)
+    assert client.get("/healthz").json() == {"status": "ok"}
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["error"] == "RuntimeError: GOOGLE_APPLICATION_CREDENTIALS is not set"
+
+    monkeypatch.setattr(init_firebase, "_error", None)
+    assert client.get("/readyz").json() == {"initialized": False, "prewarmed": False, "error": None, "ready": True}
+
+
+def test_firestore_endpoints_initialize_off_the_event_loop(monkeypatch):
+    initialized_by = []
+
+    def get_app():
+        initialized_by.append(threading.current_thread().name)
+        return object()
+
+    def get_db_ref(path_nodes):
+        # resolving a reference uses the client
+        assert init_firebase.initialized()
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    monkeypatch.setattr(init_firebase, "_client", None)
+    monkeypatch.setattr(init_firebase.firebase_admin, "get_app", get_app)
+    monkeypatch.setattr(init_firebase.firestore, "client", lambda firebase_app=None: object())
+    monkeypatch.setattr(firestore, "get_db_ref", get_db_ref)
+    path_nodes = [{"type": "collection", "name": "users"}, {"type": "document", "name": "alice"}]
+    response = TestClient(app).post("/firestore/read_document", json={"path_nodes": path_nodes}, headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 404
+    assert len(initialized_by) == 1 and initialized_by[0].startswith("firebridge")
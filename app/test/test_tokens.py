@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from firebase_admin import auth
+
+from app import init_firebase, upstream
+from app.tokens import IdTokenMiddleware, TokenVerifier
+from app.upstream import CircuitBreaker, UpstreamError
+
+
+@pytest.fixture
+def fake_auth(monkeypatch):
+    """Replaces the firebase_admin calls with fakes that count how often they run."""
+    calls = {"verify": 0, "get_user": 0}
+    users = {"alice": SimpleNamespace(disabled=False, tokens_valid_after_timestamp=0)}
+    now = int(time.time())
+
+    def verify_id_token(id_token):
+        calls["verify"] += 1
+        if not id_token.startswith("token-"):
+            raise auth.InvalidIdTokenError("Invalid token")
+        return {"uid": id_token[len("token-"):], "iat": now, "exp": now + 3600}
+
+    def get_user(uid):
+        calls["get_user"] += 1
+        if uid not in users:
+            raise auth.UserNotFoundError("No user record found")
+        return users[uid]
+
+    monkeypatch.setattr(auth, "verify_id_token", verify_id_token)
+    monkeypatch.setattr(auth, "get_user", get_user)
+    return SimpleNamespace(calls=calls, users=users, now=now)
+
+
+def test_verify_caches_tokens_and_revocation_state(fake_auth):
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=100)
+
+    async def scenario():
+        for _ in range(3):
+            claims = await verifier.verify("token-alice")
+            assert claims["uid"] == "alice"
+
+    asyncio.run(scenario())
+    assert fake_auth.calls == {"verify": 1, "get_user": 1}
+    assert verifier.stats()["token_hits"] == 2
+    assert verifier.stats()["revocation_hits"] == 2
+
+
+def test_verify_does_not_wait_for_the_circuit_breaker(fake_auth, monkeypatch):
+    breaker = CircuitBreaker(1, 60)
+    breaker.record_failure()
+    monkeypatch.setattr(upstream, "breaker", breaker)
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=100)
+
+    # signatures are checked locally, only the revocation lookup needs Firebase
+    assert asyncio.run(verifier.verify("token-alice", check_revoked=False))["uid"] == "alice"
+    with pytest.raises(UpstreamError):
+        asyncio.run(verifier.verify("token-alice"))
+    assert fake_auth.calls == {"verify": 1, "get_user": 0}
+
+
+def test_verify_initializes_firebase_off_the_event_loop(fake_auth, monkeypatch):
+    initialized_by = []
+
+    def get_app():
+        initialized_by.append(threading.current_thread().name)
+        return object()
+
+    monkeypatch.setattr(init_firebase, "_client", None)
+    monkeypatch.setattr(init_firebase.firebase_admin, "get_app", get_app)
+    monkeypatch.setattr(init_firebase.firestore, "client", lambda app: object())
+    verify_id_token = auth.verify_id_token
+
+    def verify_with_default_app(id_token):
+        if not init_firebase.initialized():
+            raise ValueError("The default Firebase app does not exist.")
+        return verify_id_token(id_token)
+
+    monkeypatch.setattr(auth, "verify_id_token", verify_with_default_app)
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=100)
+    assert asyncio.run(verifier.verify("token-alice", check_revoked=False))["uid"] == "alice"
+    assert len(initialized_by) == 1 and initialized_by[0].startswith("firebridge")
+
+
+def test_invalidate_rechecks_revocation(fake_auth):
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=100)
+
+    async def scenario():
+        await verifier.verify("token-alice")
+        # the bridge revokes the user's tokens, then drops what it cached
+        fake_auth.users["alice"].tokens_valid_after_timestamp = (fake_auth.now + 1) * 1000
+        verifier.invalidate("alice")
+        with pytest.raises(auth.RevokedIdTokenError):
+            await verifier.verify("token-alice")
+        fake_auth.users["alice"].disabled = True
+        verifier.invalidate("alice")
+        with pytest.raises(auth.UserDisabledError):
+            await verifier.verify("token-alice")
+        # without the revocation check the token is still valid
+        assert (await verifier.verify("token-alice", check_revoked=False))["uid"] == "alice"
+
+    asyncio.run(scenario())
+    assert fake_auth.calls == {"verify": 3, "get_user": 3}
+
+
+def test_token_cache_is_bounded(fake_auth):
+    fake_auth.users.update({f"user{i}": fake_auth.users["alice"] for i in range(10)})
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=4)
+
+    async def scenario():
+        for i in range(10):
+            await verifier.verify(f"token-user{i}")
+
+    asyncio.run(scenario())
+    assert verifier.stats()["tokens"] == 4
+    assert verifier.stats()["revocations"] == 4
+    assert sum(len(keys) for keys in verifier._tokens_by_uid.values()) == 4
+
+
+def test_middleware(fake_auth):
+    app = FastAPI()
+
+    @app.get("/whoami")
+    async def whoami(request: Request):
+        return {"uid": request.state.user["uid"]}
+
+    @app.get("/public")
+    async def public():
+        return {"ok": True}
+
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=100)
+    app.add_middleware(IdTokenMiddleware, exempt_paths=["/public"], verifier=verifier)
+    client = TestClient(app)
+
+    assert client.get("/public").status_code == 200
+    assert client.get("/whoami").status_code == 401
+    assert client.get("/whoami", headers={"Authorization": "Bearer garbage"}).status_code == 401
+    assert client.get("/whoami", headers={"Authorization": "Bearer token-mallory"}).status_code == 401
+    response = client.get("/whoami", headers={"Authorization": "Bearer token-alice"})
+    assert response.status_code == 200
+    assert response.json() == {"uid": "alice"}
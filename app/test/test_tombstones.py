@@ -0,0 +1,31 @@
+import datetime
+
+from app.tombstones import TombstoneLog
+
+
+def at(second):
+    return datetime.datetime(2030, 1, 1, 0, 0, second, tzinfo=datetime.timezone.utc)
+
+
+def test_deleted_since():
+    log = TombstoneLog(max_size=10)
+    log.record("users/alice", at(1))
+    log.record("users/bob", at(2))
+    log.record("users/alice/devices/phone", at(3))
+    log.record("groups/admins", at(4))
+    assert log.deleted_since("users", at(1)) == [("users/bob", at(2))]
+    assert log.deleted_since("/users/", at(0)) == [("users/alice", at(1)), ("users/bob", at(2))]
+    assert log.deleted_since("users/alice/devices", at(0)) == [("users/alice/devices/phone", at(3))]
+
+
+def test_complete_since():
+    log = TombstoneLog(max_size=2)
+    # nothing before the log was created is known
+    assert not log.complete_since(datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+    assert log.complete_since(at(0))
+    log.record("users/a", at(1))
+    log.record("users/b", at(2))
+    log.record("users/c", at(3))
+    assert log.deleted_since("users", at(0)) == [("users/b", at(2)), ("users/c", at(3))]
+    assert not log.complete_since(at(0))
+    assert log.complete_since(at(1))
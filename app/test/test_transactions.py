@@ -0,0 +1,66 @@
+import pytest
+from google.cloud.firestore_v1 import DELETE_FIELD, Increment
+
+from app import transactions
+from app.transactions import PreconditionFailed, check_precondition, resolve_value
+from benchmarks.fake_firebase import FakeFirestore
+
+
+def test_resolve_value():
+    reads = {"account": {"balance": 10, "owner": {"name": "alice"}}, "missing": None}
+    resolved = resolve_value({
+        "balance": {"$ref": "account.balance"},
+        "owner": {"$ref": "account.owner"},
+        "count": {"$increment": 2},
+        "old": {"$delete": True},
+        "literal": {"$unknown": 1},
+        "items": [{"$ref": "account.owner.name"}],
+    }, reads)
+    assert resolved["balance"] == 10 and resolved["owner"] == {"name": "alice"}
+    assert isinstance(resolved["count"], Increment) and resolved["count"].value == 2
+    assert resolved["old"] is DELETE_FIELD
+    assert resolved["literal"] == {"$unknown": 1}
+    assert resolved["items"] == ["alice"]
+    with pytest.raises(PreconditionFailed):
+        resolve_value({"$ref": "missing.balance"}, reads)
+    with pytest.raises(ValueError):
+        resolve_value({"$ref": "other"}, reads)
+
+
+def test_check_precondition():
+    reads = {"account": {"balance": 10, "tags": ["a"]}, "missing": None}
+    check_precondition(reads, "account", None, "exists", None)
+    check_precondition(reads, "missing", None, "missing", None)
+    check_precondition(reads, "account", "balance", ">=", 10)
+    check_precondition(reads, "account", "tags", "array-contains", "a")
+    with pytest.raises(PreconditionFailed, match="account.balance > 10"):
+        check_precondition(reads, "account", "balance", ">", 10)
+    with pytest.raises(PreconditionFailed):
+        check_precondition(reads, "account", "balance", "<", "text")
+    with pytest.raises(PreconditionFailed):
+        check_precondition(reads, "account", "owner", "==", None)
+
+
+def test_transfer(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(transactions, "db", db)
+    src, dst = db.document("accounts", "a"), db.document("accounts", "b")
+    src.set({"balance": 10})
+    dst.set({"balance": 0})
+
+    def transfer(amount):
+        return transactions.run_transaction(
+            [("src", src), ("dst", dst)],
+            [("src", "balance", ">=", amount)],
+            [
+                ("update", src, {"balance": {"$increment": -amount}}, False),
+                ("update", dst, {"balance": {"$increment": amount}, "previous": {"$ref": "dst.balance"}}, False),
+            ],
+        )
+
+    values, attempts = transfer(4)
+    assert values == {"src": {"balance": 10}, "dst": {"balance": 0}} and attempts == 1
+    assert dst.get().to_dict() == {"balance": 4, "previous": 0}
+    with pytest.raises(PreconditionFailed):
+        transfer(7)
+    assert src.get().to_dict() == {"balance": 6}
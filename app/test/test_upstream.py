@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from firebase_admin import auth, exceptions
+from google.api_core.exceptions import DeadlineExceeded, NotFound, ResourceExhausted, ServiceUnavailable
+
+from app import upstream
+from app.executor import run_read, run_sync
+from app.main import app
+from app.upstream import AdaptiveLimiter, CircuitBreaker, RetryBudget, UpstreamError
+
+
+@pytest.fixture
+def fresh_upstream(monkeypatch):
+    monkeypatch.setattr(upstream, "limiter", AdaptiveLimiter(4))
+    monkeypatch.setattr(upstream, "breaker", CircuitBreaker(3, 0.05))
+    monkeypatch.setattr(upstream, "retry_budget", RetryBudget(10, 0.1))
+    monkeypatch.setattr(upstream, "backoff_delay", lambda attempt: 0)
+
+
+def test_limiter_adapts_to_overload():
+    async def scenario():
+        limiter = AdaptiveLimiter(4, max_queue=1, queue_timeout=0.05)
+        started = [await limiter.acquire() for _ in range(4)]
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamError) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 429
+
+        # a burst of overload errors from calls started together halves the limit once
+        limiter.release(started[0], overloaded=True)
+        limiter.release(started[1], overloaded=True)
+        assert limiter.limit == 2 and limiter.decreases == 1 and limiter.in_flight == 2
+        assert not waiting.done()
+
+        # a success at the limit grows it, and hands the slot over to the waiting call
+        limiter.release(started[2])
+        await asyncio.sleep(0.01)
+        assert waiting.done() and limiter.in_flight == 2 and limiter.limit == 2.5
+        limiter.release(started[3])
+        limiter.release(waiting.result())
+        assert limiter.in_flight == 0 and limiter.limit == pytest.approx(2.9)
+
+        await limiter.acquire()
+        await limiter.acquire()
+        with pytest.raises(UpstreamError, match="Timed out"):
+            await limiter.acquire()
+        assert limiter.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(2, 0.05)
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(UpstreamError) as error:
+        breaker.check()
+    assert error.value.status_code == 503 and error.value.headers["Retry-After"] == "1"
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.check()  # the probe
+    with pytest.raises(UpstreamError):
+        breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 2
+
+    time.sleep(0.06)
+    breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_retries_and_errors(fresh_upstream):
+    calls = []
+
+    def flaky(failures, error):
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+
+    assert asyncio.run(run_read(flaky, 2, ServiceUnavailable("down"))) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(UpstreamError) as error:
+        asyncio.run(run_read(flaky, 5, ResourceExhausted("quota")))
+    assert error.value.status_code == 429 and "Retry-After" in error.value.headers
+    assert len(calls) == 3 and upstream.limiter.limit < 4
+
+    calls.clear()
+    with pytest.raises(NotFound):
+        asyncio.run(run_read(flaky, 1, NotFound("missing")))
+    assert len(calls) == 1
+
+    # retries stop once the budget is spent, and the breaker opens
+    calls.clear()
+    for _ in range(3):
+        with pytest.raises(UpstreamError) as error:
+            asyncio.run(run_read(flaky, 5, ServiceUnavailable("down")))
+        assert error.value.status_code == 503
+    assert len(calls) == 3 and upstream.breaker.state == "open"
+    with pytest.raises(UpstreamError, match="failing fast"):
+        asyncio.run(run_read(flaky, 5, ServiceUnavailable("down")))
+    assert len(calls) == 3
+
+
+def test_writes_are_only_retried_when_refused(fresh_upstream):
+    calls = []
+
+    def increment(error):
+        calls.append(1)
+        if len(calls) == 1:
+            raise error
+        return "ok"
+
+    # the first attempt may have been committed when its deadline passed
+    with pytest.raises(UpstreamError) as error:
+        asyncio.run(run_sync(increment, DeadlineExceeded("deadline")))
+    assert error.value.status_code == 503 and len(calls) == 1
+
+    # an overloaded Firebase refused the call without running it
+    calls.clear()
+    assert asyncio.run(run_sync(increment, ResourceExhausted("quota"))) == "ok"
+    assert len(calls) == 2
+
+
+def test_unavailable_maps_to_503(fresh_upstream, monkeypatch):
+    def get_user(uid):
+        raise exceptions.UnavailableError("Firebase Auth is unavailable")
+
+    monkeypatch.setattr(auth, "get_user", get_user)
+    response = TestClient(app).post("/user/read_user", json={"uid": "alice"}, headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert "unavailable" in response.json()["detail"]
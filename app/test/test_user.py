@@ -152,6 +152,41 @@ def test_delete_user():
     
     delete_user_only(uid)
 
+# test import users, get users and delete users endpoints
+def test_bulk_users():
+    emails = [random_email() for _ in range(3)]
+    uids = ["bulk" + "".join(random.choices(string.ascii_lowercase, k=12)) for _ in emails]
+
+    response = client.post(
+        "/user/import_users",
+        json={
+            "users": [{"uid": uid, "email": email} for uid, email in zip(uids, emails)]
+        }
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.json()["succeeded"] == 3, "Response: {}".format(response.text)
+
+    response = client.post(
+        "/user/get_users",
+        json={
+            "uids": uids[:2],
+            "emails": [emails[2], random_email()]
+        }
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.json()["found"] == 3
+    assert response.json()["not_found"] == 1
+    assert response.json()["results"][2]["user"]["uid"] == uids[2]
+
+    response = client.post(
+        "/user/delete_users",
+        json={
+            "uids": uids
+        }
+    )
+    assert response.status_code == 200, "Response: {}".format(response.text)
+    assert response.json()["succeeded"] == 3, "Response: {}".format(response.text)
+
 def delete_user_only(uid):
     # delete the user
     response = client.request(
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from app import writebehind
+from app.upstream import UpstreamError
+from app.writebehind import PendingWrite, QueueFullError, WriteBehindQueue, merge_updates
+
+
+class DocumentReference:
+    def __init__(self, path):
+        self.path = path
+
+
+class WriteBatch:
+    def __init__(self, commits):
+        self.commits = commits
+        self.writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.writes.append(("set", doc_ref.path, data, merge))
+
+    def update(self, doc_ref, data):
+        self.writes.append(("update", doc_ref.path, data))
+
+    def delete(self, doc_ref):
+        self.writes.append(("delete", doc_ref.path))
+
+    def commit(self):
+        if any("fail" in write[1] for write in self.writes):
+            raise ValueError("rejected")
+        self.commits.append(self.writes)
+
+
+class Client:
+    def __init__(self):
+        self.commits = []
+
+    def batch(self):
+        return WriteBatch(self.commits)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = Client()
+    monkeypatch.setattr(writebehind, "db", client)
+    return client
+
+
+def folded(*writes):
+    pending = PendingWrite(DocumentReference("a/b"), *writes[0])
+    for write in writes[1:]:
+        pending.fold(*write)
+    return pending.op, pending.data
+
+
+def test_fold():
+    assert folded(("update", {"n": 1}, False), ("update", {"n": 2, "m": 1}, False)) == ("update", {"n": 2, "m": 1})
+    assert folded(("set", {"a": {"x": 1}}, False), ("update", {"a.y": 2}, False)) == ("set", {"a": {"x": 1, "y": 2}})
+    assert folded(("set", {"a": {"x": 1}}, False), ("set", {"a": {"x": 2}}, True)) == ("set", {"a": {"x": 2}})
+    assert folded(("update", {"n": 1}, False), ("delete", None, False)) == ("delete", None)
+    assert folded(("delete", None, False), ("update", {"n": 1}, False)) == ("delete", None)
+    assert folded(("delete", None, False), ("set", {"n": 1}, True)) == ("set", {"n": 1})
+    assert folded(("update", {"n": 1}, False), ("set", {"a": {"x": 1}}, True)) == ("update", {"n": 1, "a.x": 1})
+
+
+def test_merge_updates():
+    assert merge_updates({"a.x": 1, "a.y": 2, "b": 1}, {"a": {"z": 3}}) == {"b": 1, "a": {"z": 3}}
+    assert merge_updates({"a": {"x": 1}}, {"a.y.z": 2}) == {"a": {"x": 1, "y": {"z": 2}}}
+
+
+def test_writes_are_coalesced_and_batched(client):
+    committed = []
+    queue = WriteBehindQueue(window=0.05, max_pending=10, on_committed=lambda path, op: committed.append((path, op)))
+
+    async def scenario():
+        for n in range(5):
+            queue.enqueue(DocumentReference("stats/hot"), "update", {"count": n})
+        queue.enqueue(DocumentReference("stats/cold"), "delete")
+        assert queue.stats()["depth"] == 2
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+    assert client.commits == [[("update", "stats/hot", {"count": 4}), ("delete", "stats/cold")]]
+    assert committed == [("stats/hot", "update"), ("stats/cold", "delete")]
+    stats = queue.stats()
+    assert (stats["depth"], stats["coalesced"], stats["committed"], stats["commits"]) == (0, 4, 6, 1)
+
+
+def test_failed_write_does_not_fail_the_batch(client):
+    queue = WriteBehindQueue(window=60, max_pending=2)
+
+    async def scenario():
+        queue.enqueue(DocumentReference("stats/ok"), "update", {"n": 1})
+        queue.enqueue(DocumentReference("stats/fail"), "update", {"n": 1})
+        with pytest.raises(QueueFullError):
+            queue.enqueue(DocumentReference("stats/other"), "update", {"n": 1})
+        # drain commits without waiting for the window
+        await queue.drain()
+
+    asyncio.run(scenario())
+    assert client.commits == [[("update", "stats/ok", {"n": 1})]]
+    stats = queue.stats()
+    assert (stats["committed"], stats["failed"]) == (1, 1)
+    assert stats["last_error"] == "stats/fail: rejected"
+
+
+def test_writes_the_upstream_layer_rejects_are_requeued(client, monkeypatch):
+    queue = WriteBehindQueue(window=0, max_pending=10)
+    run_sync = writebehind.run_sync
+    rejections = [UpstreamError(503, "Firebase is unavailable, failing fast", 1)]
+
+    async def failing_run_sync(func, *args):
+        if rejections:
+            raise rejections.pop()
+        return await run_sync(func, *args)
+
+    monkeypatch.setattr(writebehind, "run_sync", failing_run_sync)
+    monkeypatch.setattr(writebehind, "backoff_delay", lambda rounds: 0)
+
+    async def scenario():
+        queue.enqueue(DocumentReference("stats/a"), "update", {"n": 1})
+        await queue.flush()
+        stats = queue.stats()
+        assert (stats["depth"], stats["requeued"], stats["failed"]) == (1, 1, 0)
+        assert "failing fast" in stats["last_error"]
+        # a write queued meanwhile is folded after the requeued one
+        queue.enqueue(DocumentReference("stats/a"), "update", {"m": 2})
+        await queue.drain()
+
+    asyncio.run(scenario())
+    assert client.commits == [[("update", "stats/a", {"n": 1, "m": 2})]]
+    assert queue.stats()["committed"] == 2
+
+    # writes are given up on after failing to drain max_failed_rounds times
+    rejections.extend([UpstreamError(503, "down", 1)] * 3)
+
+    async def shutdown():
+        queue.enqueue(DocumentReference("stats/b"), "delete")
+        await queue.drain(max_failed_rounds=3)
+
+    asyncio.run(shutdown())
+    stats = queue.stats()
+    assert (stats["depth"], stats["failed"], stats["requeued"]) == (0, 1, 4)
+    assert len(client.commits) == 1 and not rejections
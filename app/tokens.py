@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import auth, exceptions
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from app.constants import (
+    ID_TOKEN_CACHE_SIZE,
+    ID_TOKEN_CACHE_TTL,
+    ID_TOKEN_EXEMPT_PATHS,
+    REVOCATION_CACHE_TTL,
+)
+from app.executor import ensure_initialized, executor, run_read
+from app.singleflight import SingleFlight
+from app.upstream import UpstreamError
+
+
+class TokenVerifier:
+    """
+    Verifies Firebase ID tokens, caching the verified claims and the revocation state of users.
+
+    Signatures are checked locally by ``auth.verify_id_token``, which keeps the
+    Google public keys cached for as long as their Cache-Control allows. The
+    revocation check needs the user record, so instead of the upstream
+    ``get_user`` call that ``check_revoked=True`` makes on every token, the
+    disabled flag and the tokens-valid-after time of each user are cached for
+    ``revocation_ttl`` seconds.
+
+    Verified claims are cached for ``token_ttl`` seconds, never past the
+    token's own expiry. ``invalidate(uid)`` drops everything known about a user;
+    the bridge calls it whenever it updates, deletes or revokes that user.
+    """
+
+    def __init__(self, token_ttl: float, revocation_ttl: float, max_entries: int):
+        self.token_ttl = token_ttl
+        self.revocation_ttl = revocation_ttl
+        self.max_entries = max_entries
+        self._tokens = OrderedDict()  # token hash -> (expires_at, claims)
+        self._tokens_by_uid = {}  # uid -> set of token hashes
+        self._revocations = OrderedDict()  # uid -> (expires_at, disabled, valid_after_millis)
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self.token_hits = 0
+        self.token_misses = 0
+        self.revocation_hits = 0
+        self.revocation_misses = 0
+
+    async def verify(self, id_token: str, check_revoked: bool = True) -> dict:
+        """
+        Verify an ID token and return its claims.
+
+        :param id_token: The encoded ID token.
+        :param check_revoked: Also reject tokens of disabled users and revoked tokens.
+        :return: The decoded claims of the token.
+        :raises auth.InvalidIdTokenError: If the token is invalid, expired or revoked.
+        :raises auth.UserDisabledError: If ``check_revoked`` is set and the user is disabled.
+        """
+        key = hashlib.sha256(id_token.encode()).hexdigest()
+        claims = self._cached_claims(key)
+        if claims is None:
+            # a local signature check, kept out of the upstream call layer,
+            # but it needs the default Firebase app
+            await ensure_initialized()
+            claims = await asyncio.get_running_loop().run_in_executor(executor, auth.verify_id_token, id_token)
+            self._store_claims(key, claims)
+        if check_revoked:
+            disabled, valid_after = await self._revocation_state(claims["uid"])
+            if disabled:
+                raise auth.UserDisabledError("The user record is disabled.")
+            if claims["iat"] * 1000 < valid_after:
+                raise auth.RevokedIdTokenError("The Firebase ID token has been revoked.")
+        return claims
+
+    def invalidate(self, uid: str):
+        """
+        Forget the cached tokens and revocation state of a user.
+        """
+        with self._lock:
+            self._invalidations += 1
+            self._revocations.pop(uid, None)
+            for key in self._tokens_by_uid.pop(uid, ()):
+                self._tokens.pop(key, None)
+        self._flights.forget(uid)
+
+    def _cached_claims(self, key: str):
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.token_misses += 1
+                return None
+            self._tokens.move_to_end(key)
+            self.token_hits += 1
+            return entry[1]
+
+    def _store_claims(self, key: str, claims: dict):
+        lifetime = min(self.token_ttl, claims["exp"] - time.time())
+        if lifetime <= 0:
+            return
+        uid = claims["uid"]
+        with self._lock:
+            self._tokens[key] = (time.monotonic() + lifetime, claims)
+            self._tokens.move_to_end(key)
+            self._tokens_by_uid.setdefault(uid, set()).add(key)
+            while len(self._tokens) > self.max_entries:
+                old_key, (_, old_claims) = self._tokens.popitem(last=False)
+                keys = self._tokens_by_uid.get(old_claims["uid"])
+                if keys is not None:
+                    keys.discard(old_key)
+                    if not keys:
+                        del self._tokens_by_uid[old_claims["uid"]]
+
+    async def _revocation_state(self, uid: str):
+        with self._lock:
+            entry = self._revocations.get(uid)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._revocations.move_to_end(uid)
+                self.revocation_hits += 1
+                return entry[1], entry[2]
+            self.revocation_misses += 1
+            token = self._invalidations
+        user = await self._flights.do((uid,), run_read, auth.get_user, uid)
+        state = (user.disabled, user.tokens_valid_after_timestamp or 0)
+        with self._lock:
+            # a user changed while it was being fetched may be stale, do not cache it
+            if self._invalidations == token and self.revocation_ttl > 0:
+                self._revocations[uid] = (time.monotonic() + self.revocation_ttl, *state)
+                self._revocations.move_to_end(uid)
+                while len(self._revocations) > self.max_entries:
+                    self._revocations.popitem(last=False)
+        return state
+
+    def stats(self) -> dict:
+        return {
+            "token_hits": self.token_hits,
+            "token_misses": self.token_misses,
+            "revocation_hits": self.revocation_hits,
+            "revocation_misses": self.revocation_misses,
+            "tokens": len(self._tokens),
+            "revocations": len(self._revocations),
+        }
+
+
+token_verifier = TokenVerifier(ID_TOKEN_CACHE_TTL, REVOCATION_CACHE_TTL, ID_TOKEN_CACHE_SIZE)
+
+
+class IdTokenMiddleware:
+    """
+    ASGI middleware requiring a valid Firebase ID token on every request.
+
+    The token is read from an "Authorization: Bearer <token>" header and checked
+    with ``token_verifier``, including the revocation check. Requests without a
+    valid token get a 401, or a 503 when the token could not be checked (429
+    when Firebase is overloaded). The claims of the token are available to
+    endpoints as ``request.state.user``.
+    """
+
+    def __init__(self, app, exempt_paths=ID_TOKEN_EXEMPT_PATHS, verifier: TokenVerifier = None):
+        self.app = app
+        self.exempt_paths = set(exempt_paths)
+        self.verifier = verifier or token_verifier
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        scheme, _, id_token = Headers(scope=scope).get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not id_token:
+            await self._unauthorized("Missing bearer ID token")(scope, receive, send)
+            return
+        try:
+            claims = await self.verifier.verify(id_token.strip())
+        except UpstreamError as e:
+            # Firebase is overloaded or unavailable, the client may retry
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+        except (auth.InvalidIdTokenError, auth.UserDisabledError, auth.UserNotFoundError, ValueError) as e:
+            await self._unauthorized(f"Invalid ID token: {e}")(scope, receive, send)
+            return
+        except exceptions.FirebaseError as e:
+            # e.g. the public keys or the user could not be fetched
+            response = JSONResponse({"detail": f"Error verifying ID token: {e}"}, status_code=503)
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["user"] = claims
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _unauthorized(detail: str):
+        return JSONResponse({"detail": detail}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
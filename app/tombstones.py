@@ -0,0 +1,70 @@
+import datetime
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.constants import TOMBSTONE_LOG_SIZE
+
+
+class TombstoneLog:
+    """
+    Bounded log of the documents deleted through this bridge process.
+
+    Only deletions made by the bridge itself are seen, and only the most recent
+    ``max_size`` of them are kept. ``complete_since()`` tells whether the log
+    still covers a given point in time.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._deleted = OrderedDict()  # path -> deletion time, oldest first
+        self._by_collection = {}  # collection path -> {document path: deletion time}
+        self._started = datetime.datetime.now(datetime.timezone.utc)
+        self._forgotten = None  # deletion time of the newest entry dropped from the log
+        self._lock = threading.Lock()
+
+    def record(self, path: str, deleted_at: Optional[datetime.datetime] = None):
+        """
+        Remember that a document was deleted.
+
+        :param path: The document path.
+        :param deleted_at: When it was deleted, defaults to now.
+        """
+        deleted_at = deleted_at or datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            self._deleted.pop(path, None)
+            self._deleted[path] = deleted_at
+            self._by_collection.setdefault(path.rpartition("/")[0], {})[path] = deleted_at
+            if len(self._deleted) > self.max_size:
+                forgotten_path, self._forgotten = self._deleted.popitem(last=False)
+                collection = self._by_collection[forgotten_path.rpartition("/")[0]]
+                del collection[forgotten_path]
+                if not collection:
+                    del self._by_collection[forgotten_path.rpartition("/")[0]]
+
+    def complete_since(self, since: datetime.datetime) -> bool:
+        """
+        Whether every deletion made through this process after ``since`` is still in the log.
+        """
+        with self._lock:
+            if since < self._started:
+                return False
+            return self._forgotten is None or self._forgotten <= since
+
+    def deleted_since(self, collection_path: str, since: datetime.datetime) -> List[Tuple[str, datetime.datetime]]:
+        """
+        List the documents of a collection deleted after ``since``.
+
+        :param collection_path: Slash-separated collection path.
+        :param since: Only deletions after this time are returned.
+        :return: List of (document path, deletion time).
+        """
+        with self._lock:
+            return [
+                (path, deleted_at)
+                for path, deleted_at in self._by_collection.get(collection_path.strip("/"), {}).items()
+                if deleted_at > since
+            ]
+
+
+tombstones = TombstoneLog(TOMBSTONE_LOG_SIZE)
@@ -0,0 +1,170 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.api_core.exceptions import Aborted
+from google.cloud.firestore_v1 import (
+    DELETE_FIELD,
+    SERVER_TIMESTAMP,
+    ArrayRemove,
+    ArrayUnion,
+    Increment,
+    Maximum,
+    Minimum,
+    transactional,
+)
+
+from app.init_firebase import db
+
+# Write data may hold tagged values, objects with a single "$" key:
+#   {"$ref": "account.balance"}   the value read, "account" alone for the whole document
+#   {"$increment": 5}             and "$maximum", "$minimum": numeric transforms
+#   {"$array_union": [1, 2]}      and "$array_remove": array transforms
+#   {"$server_timestamp": true}   the commit time
+#   {"$delete": true}             removes the field, in updates
+# Objects with any other "$" key are written as they are.
+TRANSFORMS = {
+    "$increment": Increment,
+    "$maximum": Maximum,
+    "$minimum": Minimum,
+    "$array_union": ArrayUnion,
+    "$array_remove": ArrayRemove,
+}
+
+MISSING = object()
+
+
+class PreconditionFailed(Exception):
+    pass
+
+
+class TransactionContention(Exception):
+    pass
+
+
+def resolve_value(value: Any, reads: Dict[str, Optional[dict]]) -> Any:
+    """
+    Replace the tagged values in write data, see above.
+
+    :param value: The write data, or a value in it.
+    :param reads: The data of every document read, by name; None when it does not exist.
+    :raises PreconditionFailed: If a "$ref" names a missing document or field.
+    """
+    if isinstance(value, dict):
+        if len(value) == 1:
+            tag, argument = next(iter(value.items()))
+            if tag == "$ref":
+                resolved = read_value(reads, argument)
+                if resolved is MISSING:
+                    raise PreconditionFailed(f"Precondition failed: {argument} does not exist")
+                return resolved
+            if tag in TRANSFORMS:
+                return TRANSFORMS[tag](argument)
+            if tag == "$server_timestamp":
+                return SERVER_TIMESTAMP
+            if tag == "$delete":
+                return DELETE_FIELD
+        return {key: resolve_value(item, reads) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_value(item, reads) for item in value]
+    return value
+
+
+def read_value(reads: Dict[str, Optional[dict]], reference: str) -> Any:
+    """
+    The value at "name" or "name.field.path" in the documents read, or MISSING.
+    """
+    name, _, field_path = reference.partition(".")
+    if name not in reads:
+        raise ValueError(f"Unknown read: {name}")
+    value = reads[name]
+    if value is None:
+        return MISSING
+    for part in field_path.split(".") if field_path else ():
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def check_precondition(reads: Dict[str, Optional[dict]], read: str, field: Optional[str], op: str, value: Any):
+    """
+    :raises PreconditionFailed: If the document or field read does not satisfy ``op``.
+    """
+    target = f"{read}.{field}" if field else read
+    actual = read_value(reads, target)
+    if op == "exists":
+        satisfied = actual is not MISSING
+    elif op == "missing":
+        satisfied = actual is MISSING
+    elif actual is MISSING:
+        satisfied = False
+    else:
+        try:
+            satisfied = {
+                "==": lambda: actual == value,
+                "!=": lambda: actual != value,
+                "<": lambda: actual < value,
+                "<=": lambda: actual <= value,
+                ">": lambda: actual > value,
+                ">=": lambda: actual >= value,
+                "in": lambda: actual in value,
+                "not-in": lambda: actual not in value,
+                "array-contains": lambda: isinstance(actual, list) and value in actual,
+            }[op]()
+        except TypeError:
+            satisfied = False
+    if not satisfied:
+        condition = op if op in ("exists", "missing") else f"{op} {value!r}"
+        raise PreconditionFailed(f"Precondition failed: {target} {condition}")
+
+
+def run_transaction(reads: List[Tuple[str, Any]], preconditions: List[tuple], writes: List[tuple],
+                    max_attempts: int = 5) -> Tuple[Dict[str, Optional[dict]], int]:
+    """
+    Read documents, check preconditions on them and write, in one transaction.
+
+    Firestore aborts the transaction when a document read is written by
+    someone else before the commit; the transaction is then run again, up to
+    ``max_attempts`` times, with fresh reads.
+
+    :param reads: (name, document reference) of every document to read.
+    :param preconditions: (read name, field path or None, op, value) to check on the documents read.
+    :param writes: (op, document reference, data, merge) of every write, op
+        being "set", "create", "update" or "delete".
+    :param max_attempts: Attempts before giving up on contention.
+    :return: The data of the documents read by the committed attempt, by name,
+        and the number of attempts.
+    :raises PreconditionFailed: If a precondition does not hold; nothing is written.
+    :raises TransactionContention: If the transaction was aborted ``max_attempts`` times.
+    """
+    attempts = 0
+
+    @transactional
+    def attempt(transaction):
+        nonlocal attempts
+        attempts += 1
+        snapshots = db.get_all([ref for _, ref in reads], transaction=transaction) if reads else []
+        by_path = {snapshot.reference.path: snapshot for snapshot in snapshots}
+        values = {}
+        for name, ref in reads:
+            snapshot = by_path.get(ref.path)
+            values[name] = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+        for precondition in preconditions:
+            check_precondition(values, *precondition)
+        for op, ref, data, merge in writes:
+            if op == "delete":
+                transaction.delete(ref)
+            elif op == "update":
+                transaction.update(ref, resolve_value(data, values))
+            elif op == "create":
+                transaction.create(ref, resolve_value(data, values))
+            else:
+                transaction.set(ref, resolve_value(data, values), merge=merge)
+        return values
+
+    try:
+        values = attempt(db.transaction(max_attempts=max_attempts))
+    except ValueError as e:
+        if isinstance(e.__cause__, Aborted):
+            raise TransactionContention(str(e)) from e
+        raise
+    return values, attempts
@@ -0,0 +1,363 @@
+import asyncio
+import collections
+import math
+import random
+import time
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from firebase_admin import exceptions as firebase_exceptions
+from google.api_core import exceptions as api_exceptions
+
+from app.constants import (
+    CIRCUIT_BREAKER_FAILURES,
+    CIRCUIT_BREAKER_RESET_SECONDS,
+    FIREBASE_THREAD_POOL_SIZE,
+    UPSTREAM_BACKOFF_BASE,
+    UPSTREAM_BACKOFF_MAX,
+    UPSTREAM_MAX_ATTEMPTS,
+    UPSTREAM_MAX_QUEUE,
+    UPSTREAM_MIN_CONCURRENCY,
+    UPSTREAM_QUEUE_TIMEOUT,
+    UPSTREAM_RETRY_TOKEN_RATIO,
+    UPSTREAM_RETRY_TOKENS,
+)
+from app.metrics import Counter, Gauge, registry
+
+# Every Firebase call made through app.executor goes through this layer: an
+# adaptive limit on the calls in flight, retries with backoff, and a circuit
+# breaker failing calls fast while Firebase is unreachable. Like the metrics,
+# its state is only touched from the event loop thread, so it takes no lock.
+#
+# Only an overloaded error (RESOURCE_EXHAUSTED) means Firebase refused the
+# call without running it. After a deadline or an unavailable error the call
+# may have run, so only idempotent calls, i.e. reads, are retried on those.
+
+# errors of a call Firebase refused or could not run, and the status they map to
+OVERLOADED_ERRORS = (api_exceptions.ResourceExhausted, firebase_exceptions.ResourceExhaustedError)
+UNAVAILABLE_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    firebase_exceptions.UnavailableError,
+    firebase_exceptions.DeadlineExceededError,
+)
+
+# the statuses a call is retried on: reads are retried on both, other calls
+# only when Firebase refused them, and pulls from a stream on neither
+RETRY_IDEMPOTENT = (429, 503)
+RETRY_REFUSED = (429,)
+RETRY_NEVER = ()
+
+concurrency_limit = registry.register(Gauge(
+    "firebridge_upstream_concurrency_limit",
+    "Current adaptive limit on the Firebase calls in flight.",
+))
+retries = registry.register(Counter(
+    "firebridge_upstream_retries_total",
+    "Firebase calls retried, by the status their error maps to.",
+    ("status",),
+))
+rejections = registry.register(Counter(
+    "firebridge_upstream_rejections_total",
+    "Firebase calls failed without being run, by reason: queue_full, queue_timeout or circuit_open.",
+    ("reason",),
+))
+circuit_open = registry.register(Gauge(
+    "firebridge_upstream_circuit_open",
+    "1 while the circuit breaker fails Firebase calls fast, 0 otherwise.",
+))
+
+
+class UpstreamError(HTTPException):
+    """
+    A Firebase call failed because Firebase is overloaded (429) or
+    unavailable (503). It is an HTTPException, so the endpoints pass it on to
+    the client as it is, with a Retry-After header.
+    """
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.detail
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """
+    The status an upstream error maps to: 429 when Firebase is overloaded,
+    503 when it is unavailable, None for every other error.
+    """
+    if isinstance(error, OVERLOADED_ERRORS):
+        return 429
+    if isinstance(error, UNAVAILABLE_ERRORS):
+        return 503
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Seconds to wait before retrying after ``attempt`` failed attempts:
+    exponential, capped, with full jitter so that retries do not synchronize.
+    """
+    return random.uniform(0, backoff_ceiling(attempt))
+
+
+def backoff_ceiling(attempt: int) -> float:
+    return min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt)
+
+
+class AdaptiveLimiter:
+    """
+    Limit on the concurrent upstream calls, adapted with AIMD: it grows by one
+    per limit's worth of successful calls while it is reached, and is cut by
+    ``decrease_ratio`` when Firebase reports overload. Calls started before
+    the last cut do not cut it again, so one burst of errors halves the limit
+    once.
+
+    Calls over the limit wait in a FIFO queue of at most ``max_queue`` calls,
+    for at most ``queue_timeout`` seconds.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, decrease_ratio: float = 0.5,
+                 max_queue: int = 1000, queue_timeout: float = 10.0):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.decrease_ratio = decrease_ratio
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.decreases = 0
+        self._waiters = collections.deque()
+        self._last_decrease = 0.0
+        concurrency_limit.set(self.limit)
+
+    async def acquire(self) -> float:
+        """
+        Wait for a slot.
+
+        :return: The time the call started, to pass to ``release``.
+        :raises UpstreamError: 429 if the queue is full or the wait times out.
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return time.monotonic()
+        if len(self._waiters) >= self.max_queue:
+            rejections.inc(("queue_full",))
+            raise UpstreamError(429, "Too many Firebase calls queued", self.queue_timeout)
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timed_out = False
+
+        def expire():
+            nonlocal timed_out
+            if not waiter.done():
+                timed_out = True
+                waiter.cancel()
+
+        # a timer rather than asyncio.wait_for, which would start a task per queued call
+        timer = loop.call_later(self.queue_timeout, expire)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over as the caller was cancelled
+                self._release_slot()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if timed_out:
+                rejections.inc(("queue_timeout",))
+                raise UpstreamError(429, "Timed out waiting for a Firebase call slot", self.queue_timeout) from None
+            raise
+        finally:
+            timer.cancel()
+        return time.monotonic()
+
+    def release(self, started: float, overloaded: bool = False):
+        """
+        Free the slot of a call and adapt the limit to its outcome.
+
+        :param started: What ``acquire`` returned.
+        :param overloaded: Whether Firebase reported overload.
+        """
+        if overloaded:
+            if started >= self._last_decrease:
+                self.limit = max(self.minimum, self.limit * self.decrease_ratio)
+                self._last_decrease = time.monotonic()
+                self.decreases += 1
+        elif self.in_flight >= int(self.limit) and self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        concurrency_limit.set(self.limit)
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "decreases": self.decreases,
+        }
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after ``failure_threshold`` consecutive calls found
+    Firebase unavailable. After ``reset_timeout`` seconds one probe call is let
+    through: it closes the circuit when it succeeds and opens it again when
+    it fails.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def check(self):
+        """
+        :raises UpstreamError: 503 while the circuit is open, or half open with a probe running.
+        """
+        state = self.state
+        if state == "closed":
+            return
+        now = time.monotonic()
+        # a probe whose outcome never came, e.g. a cancelled request, expires
+        if state == "half_open" and (self._probe_started is None or now - self._probe_started > self.reset_timeout):
+            self._probe_started = now
+            return
+        rejections.inc(("circuit_open",))
+        raise UpstreamError(503, "Firebase is unavailable, failing fast", self.retry_after())
+
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(1.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        circuit_open.set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_started is not None or (self._opened_at is None and self.failures >= self.failure_threshold):
+            self.trips += 1
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+            circuit_open.set(1)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+class RetryBudget:
+    """
+    Token bucket bounding retries to a share of the calls, as gRPC retry
+    throttling does: a failure takes a token, a success gives back
+    ``token_ratio``, and retries are only made while more than half the
+    tokens are left. Under a sustained outage retries stop, instead of
+    multiplying the load on Firebase.
+    """
+
+    def __init__(self, max_tokens: float = 10, token_ratio: float = 0.1):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+
+    def record_success(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.token_ratio)
+
+    def record_failure(self):
+        self.tokens = max(0.0, self.tokens - 1)
+
+    def allow_retry(self) -> bool:
+        return self.tokens > self.max_tokens / 2
+
+
+limiter = AdaptiveLimiter(
+    FIREBASE_THREAD_POOL_SIZE, UPSTREAM_MIN_CONCURRENCY, max_queue=UPSTREAM_MAX_QUEUE, queue_timeout=UPSTREAM_QUEUE_TIMEOUT
+)
+breaker = CircuitBreaker(CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET_SECONDS)
+retry_budget = RetryBudget(UPSTREAM_RETRY_TOKENS, UPSTREAM_RETRY_TOKEN_RATIO)
+
+
+async def call_upstream(attempt, retry: Tuple[int, ...] = RETRY_REFUSED):
+    """
+    Make an upstream call through the circuit breaker and the concurrency
+    limit, retrying it with jittered exponential backoff on the errors
+    mapping to a status of ``retry``.
+
+    :param attempt: Coroutine function making one attempt of the call.
+    :param retry: The statuses the call is retried on: ``RETRY_IDEMPOTENT``
+        for reads, ``RETRY_REFUSED`` for calls that must not run twice, e.g.
+        writes, and ``RETRY_NEVER`` for calls that are not repeatable, e.g.
+        pulling the next items of a stream.
+    :return: What ``attempt`` returns.
+    :raises UpstreamError: 429 or 503 when Firebase is overloaded or
+        unavailable and the attempts or the retry budget are spent.
+    """
+    attempts = 0
+    while True:
+        breaker.check()
+        started = await limiter.acquire()
+        status = None
+        try:
+            result = await attempt()
+        except Exception as e:
+            status = error_status(e)
+            if status is None:
+                # e.g. NotFound: Firebase answered
+                breaker.record_success()
+                raise
+            attempts += 1
+            retry_budget.record_failure()
+            if status == 503:
+                breaker.record_failure()
+            else:
+                # Firebase answered, it is reachable
+                breaker.record_success()
+            if status not in retry or attempts >= UPSTREAM_MAX_ATTEMPTS or not retry_budget.allow_retry():
+                problem = "overloaded" if status == 429 else "unavailable"
+                retry_after = max(breaker.retry_after(), backoff_ceiling(attempts))
+                raise UpstreamError(status, f"Firebase is {problem}: {e}", retry_after) from e
+        finally:
+            limiter.release(started, overloaded=status == 429)
+        if status is None:
+            breaker.record_success()
+            retry_budget.record_success()
+            return result
+        retries.inc((str(status),))
+        await asyncio.sleep(backoff_delay(attempts))
+
+
+def stats() -> dict:
+    return {
+        "concurrency": limiter.stats(),
+        "circuit_breaker": breaker.stats(),
+        "retry_tokens": round(retry_budget.tokens, 2),
+    }
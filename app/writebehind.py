@@ -0,0 +1,337 @@
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from app.constants import UPSTREAM_MAX_ATTEMPTS
+from app.executor import run_sync
+from app.init_firebase import db
+from app.metrics import Counter, Gauge, registry
+from app.upstream import backoff_delay
+
+queue_depth = registry.register(Gauge(
+    "firebridge_write_behind_queue_depth",
+    "Documents with a queued write not committed yet.",
+))
+queued_writes = registry.register(Counter(
+    "firebridge_write_behind_writes_total",
+    "Writes accepted by the write-behind queue, by outcome: coalesced into a queued write, committed, failed or requeued.",
+    ("outcome",),
+))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class PendingWrite:
+    """
+    The writes queued for one document, folded into a single set, update or delete.
+    """
+
+    __slots__ = ("doc_ref", "op", "data", "merge", "queued_at", "writes")
+
+    def __init__(self, doc_ref, op: str, data: Optional[dict], merge: bool):
+        self.doc_ref = doc_ref
+        self.op = op
+        self.data = data
+        self.merge = merge
+        self.queued_at = time.monotonic()
+        self.writes = 1
+
+    def fold(self, op: str, data: Optional[dict], merge: bool):
+        """
+        Fold a later write to the same document into this one, so that
+        committing the result leaves the document as applying both in order would.
+        """
+        self.writes += 1
+        if op == "delete" or (op == "set" and not merge):
+            self.op, self.data, self.merge = op, data, merge
+        elif self.op == "delete":
+            # an update of a deleted document fails and leaves it deleted
+            if op == "set":
+                self.op, self.data, self.merge = "set", data, False
+        elif self.op == "set":
+            if op == "update":
+                self.data = apply_update(self.data, data)
+            else:
+                self.data = merge_data(self.data, data)
+        elif op == "update":
+            self.data = merge_updates(self.data, data)
+        else:
+            # a merging set after an update: the set's leaves as more updates
+            self.data = merge_updates(self.data, flatten(data))
+
+
+def apply_update(document: dict, field_updates: dict) -> dict:
+    """
+    Apply update() field paths, e.g. {"a.b": 1}, to a copy of document data.
+    """
+    document = copy.deepcopy(document)
+    for field_path, value in field_updates.items():
+        target = document
+        parts = field_path.split(".")
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        target[parts[-1]] = value
+    return document
+
+
+def merge_data(document: dict, data: dict) -> dict:
+    """
+    Merge set(merge=True) data into a copy of document data.
+    """
+    document = copy.deepcopy(document)
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            document[key] = merge_data(document[key], value)
+        else:
+            document[key] = value
+    return document
+
+
+def merge_updates(first: dict, second: dict) -> dict:
+    """
+    Combine two update() field maps into one, the second taking precedence.
+
+    Firestore rejects an update naming both a field and one of its
+    descendants, so a later path replaces the earlier paths below it, and a
+    later path below an earlier one is written into the earlier value.
+    """
+    merged = dict(first)
+    for field_path, value in second.items():
+        for existing in [key for key in merged if key == field_path or key.startswith(field_path + ".")]:
+            del merged[existing]
+        parent = next((key for key in merged if field_path.startswith(key + ".")), None)
+        if parent is None:
+            merged[field_path] = value
+        else:
+            merged[parent] = apply_update({"value": merged[parent]}, {"value." + field_path[len(parent) + 1:]: value})["value"]
+    return merged
+
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    """
+    Field paths of the leaves of set() data, e.g. {"a": {"b": 1}} -> {"a.b": 1}.
+    """
+    fields = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and value:
+            fields.update(flatten(value, f"{prefix}{key}."))
+        else:
+            fields[f"{prefix}{key}"] = value
+    return fields
+
+
+class WriteBehindQueue:
+    """
+    Queue of document writes committed in the background.
+
+    Writes to a document are held for ``window`` seconds after the first one
+    is queued, and every write to the same document in that time is folded
+    into it, so a hot document is written at most once per window. Due writes
+    are committed in batches of ``batch_size``. If a batch fails, its writes
+    are retried one by one so that one bad write does not fail the others.
+    Batches the upstream call layer fails before committing them, e.g. while
+    the circuit breaker is open, are queued again and retried with backoff.
+
+    Writes are held in memory: they are lost if the process dies, and a read
+    may not see a queued write until it is committed. ``drain()`` commits
+    everything on shutdown.
+
+    :param on_committed: Called with the path and the operation of every
+        committed write, e.g. to invalidate caches.
+    """
+
+    def __init__(self, window: float, max_pending: int, batch_size: int = 500,
+                 on_committed: Optional[Callable[[str, str], None]] = None):
+        self.window = window
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.on_committed = on_committed
+        self._pending = OrderedDict()  # path -> PendingWrite, oldest first
+        self._in_flight = set()
+        self._task = None
+        self.queued = 0
+        self.coalesced = 0
+        self.committed = 0
+        self.failed = 0
+        self.commits = 0
+        self.requeued = 0
+        self.last_error = None
+        self._failed_rounds = 0  # consecutive flushes that had to requeue writes
+
+    def enqueue(self, doc_ref, op: str, data: Optional[dict] = None, merge: bool = False) -> bool:
+        """
+        Queue a set, update or delete of a document.
+
+        :param doc_ref: The document reference.
+        :param op: "set", "update" or "delete".
+        :param data: The document data of a set, or the field paths of an update.
+        :param merge: Whether a set merges into the existing document.
+        :return: Whether the write was folded into one already queued for the document.
+        :raises QueueFullError: If ``max_pending`` documents already have queued writes.
+        """
+        self.queued += 1
+        pending = self._pending.get(doc_ref.path)
+        if pending is not None:
+            pending.fold(op, data, merge)
+            self.coalesced += 1
+            queued_writes.inc(("coalesced",))
+            return True
+        if len(self._pending) >= self.max_pending:
+            self.queued -= 1
+            raise QueueFullError(f"Write-behind queue is full ({self.max_pending} documents)")
+        self._pending[doc_ref.path] = PendingWrite(doc_ref, op, data, merge)
+        queue_depth.inc()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return False
+
+    async def _run(self):
+        while self._pending:
+            wait = self._pending[next(iter(self._pending))].queued_at + self.window - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.flush(due_only=True)
+            if self._failed_rounds:
+                await asyncio.sleep(backoff_delay(self._failed_rounds))
+
+    async def flush(self, due_only: bool = False):
+        """
+        Commit the queued writes.
+
+        :param due_only: Only commit the writes whose window has passed.
+        """
+        now = time.monotonic()
+        due = []
+        for path, pending in list(self._pending.items()):
+            if due_only and pending.queued_at + self.window > now:
+                break
+            # a document's next write waits for the previous one to commit
+            if path in self._in_flight:
+                continue
+            due.append(self._pending.pop(path))
+            self._in_flight.add(path)
+        if not due:
+            # only writes waiting for an in-flight commit of their document
+            await asyncio.sleep(0.01)
+            return
+        chunks = [due[i:i + self.batch_size] for i in range(0, len(due), self.batch_size)]
+        try:
+            results = await asyncio.gather(*(run_sync(self._commit, chunk) for chunk in chunks), return_exceptions=True)
+        finally:
+            for pending in due:
+                self._in_flight.discard(pending.doc_ref.path)
+            queue_depth.dec(amount=len(due))
+        failed_round = False
+        for chunk, errors in zip(chunks, results):
+            if isinstance(errors, Exception):
+                # _commit reports the errors of Firebase, so the upstream call
+                # layer failed the call before the batch was committed
+                self._requeue(chunk, errors)
+                failed_round = True
+                continue
+            for pending, error in zip(chunk, errors):
+                if error is None:
+                    self.committed += pending.writes
+                    queued_writes.inc(("committed",), pending.writes)
+                    if self.on_committed is not None:
+                        self.on_committed(pending.doc_ref.path, pending.op)
+                else:
+                    self.failed += pending.writes
+                    queued_writes.inc(("failed",), pending.writes)
+                    self.last_error = f"{pending.doc_ref.path}: {error}"
+        self._failed_rounds = self._failed_rounds + 1 if failed_round else 0
+
+    def _requeue(self, chunk: List[PendingWrite], error: Exception):
+        """
+        Queue the writes of a chunk that was not committed again, ahead of the
+        writes queued for the same documents since.
+        """
+        self.last_error = f"Batch not committed: {error}"
+        for pending in reversed(chunk):
+            path = pending.doc_ref.path
+            later = self._pending.pop(path, None)
+            if later is None:
+                queue_depth.inc()
+            else:
+                writes = pending.writes + later.writes
+                pending.fold(later.op, later.data, later.merge)
+                pending.writes = writes
+            self._pending[path] = pending
+            self._pending.move_to_end(path, last=False)
+            self.requeued += pending.writes
+            queued_writes.inc(("requeued",), pending.writes)
+
+    def _commit(self, chunk: List[PendingWrite]) -> List[Optional[str]]:
+        """
+        Commit a chunk of writes as one batch, or one by one if the batch fails.
+
+        :return: The error of every write, None when it was committed.
+        """
+        try:
+            self._commit_batch(chunk)
+            return [None] * len(chunk)
+        except Exception:
+            pass
+        errors = []
+        for pending in chunk:
+            try:
+                self._commit_batch([pending])
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e))
+        return errors
+
+    def _commit_batch(self, chunk: List[PendingWrite]):
+        batch = db.batch()
+        for pending in chunk:
+            if pending.op == "set":
+                batch.set(pending.doc_ref, pending.data, merge=pending.merge)
+            elif pending.op == "update":
+                batch.update(pending.doc_ref, pending.data)
+            else:
+                batch.delete(pending.doc_ref)
+        batch.commit()
+        self.commits += 1
+
+    async def drain(self, max_failed_rounds: int = UPSTREAM_MAX_ATTEMPTS):
+        """
+        Commit every queued write now, e.g. on shutdown.
+
+        :param max_failed_rounds: Consecutive flushes that may fail to commit
+            before the writes left are counted as failed and dropped, so that
+            an unreachable Firebase does not hold up the shutdown forever.
+        """
+        while self._pending or self._in_flight:
+            await self.flush()
+            if self._failed_rounds >= max_failed_rounds:
+                self._drop_pending()
+            elif self._failed_rounds:
+                await asyncio.sleep(backoff_delay(self._failed_rounds))
+
+    def _drop_pending(self):
+        for pending in self._pending.values():
+            self.failed += pending.writes
+            queued_writes.inc(("failed",), pending.writes)
+        queue_depth.dec(amount=len(self._pending))
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        oldest = next(iter(self._pending.values()), None)
+        return {
+            "depth": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "oldest_age_seconds": round(time.monotonic() - oldest.queued_at, 3) if oldest else 0,
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "committed": self.committed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "commits": self.commits,
+            "last_error": self.last_error,
+        }
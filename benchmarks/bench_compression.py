@@ -0,0 +1,88 @@
+"""
+Bytes on the wire and estimated latency of typical bridge responses for each
+response encoding supported by ``app.compression``.
+
+Latency is estimated as compression time + transfer time on a link of the given
+bandwidth + decompression time.
+
+    python -m benchmarks.bench_compression --kbps 256
+"""
+import argparse
+import json
+import random
+import string
+import time
+import zlib
+
+from app.compression import COMPRESSORS, brotli, new_compressor, zstandard
+
+
+def random_text(rng, length):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(200)]
+    return " ".join(rng.choices(words, k=length))
+
+
+def profile_document(rng, i):
+    return {
+        "uid": "".join(rng.choices(string.ascii_letters + string.digits, k=28)),
+        "display_name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "created_at": "2023-04-01T12:00:00.000000+00:00",
+        "settings": {"theme": "dark", "language": "fa", "notifications": rng.random() > 0.5},
+        "bio": random_text(rng, 40),
+        "tags": rng.sample(["news", "sport", "music", "tech", "art", "travel", "food"], 3),
+        "score": rng.randint(0, 10000),
+    }
+
+
+def payloads():
+    rng = random.Random(42)
+    read_document = json.dumps({"document_data": profile_document(rng, 0)}).encode()
+    read_documents = json.dumps({"documents": {
+        f"users/{i}": {"exists": True, "document_data": profile_document(rng, i)} for i in range(100)
+    }}).encode()
+    query = b"".join(
+        json.dumps({"id": str(i), "path": f"users/{i}", "document_data": profile_document(rng, i)}).encode() + b"\n"
+        for i in range(1000)
+    )
+    return {"read_document": read_document, "read_documents x100": read_documents, "query x1000 (NDJSON)": query}
+
+
+def decompress(encoding, data):
+    if encoding == "gzip":
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == "br":
+        return brotli.decompress(data)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kbps", type=float, default=256, help="link bandwidth in kilobits per second")
+    args = parser.parse_args()
+    bytes_per_second = args.kbps * 1000 / 8
+
+    print(f"{'payload':<22} {'encoding':<9} {'bytes':>9} {'ratio':>6} {'comp ms':>8} {'decomp ms':>9} {'est. ms':>9}")
+    for name, body in payloads().items():
+        for encoding in ["identity"] + list(COMPRESSORS):
+            start = time.perf_counter()
+            if encoding == "identity":
+                data = body
+            else:
+                compressor = new_compressor(encoding)
+                data = compressor.compress(body) + compressor.finish()
+            compress_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            assert decompress(encoding, data) == body
+            decompress_seconds = time.perf_counter() - start
+            total = compress_seconds + len(data) / bytes_per_second + decompress_seconds
+            print(
+                f"{name:<22} {encoding:<9} {len(data):>9} {len(body) / len(data):>6.1f} "
+                f"{compress_seconds * 1000:>8.2f} {decompress_seconds * 1000:>9.2f} {total * 1000:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Concurrent-request throughput of an endpoint that makes a slow synchronous
+upstream call, served directly on the event loop (the old behaviour) versus
+through the shared thread pool in ``app.executor``.
+
+The upstream RPC is simulated with ``time.sleep`` so the benchmark runs
+without Firebase credentials.
+
+    python -m benchmarks.bench_concurrency --requests 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+from fastapi import FastAPI
+
+
+def build_app(pool_size, latency):
+    # app.constants reads the pool size when app.executor is imported
+    os.environ["FIREBASE_THREAD_POOL_SIZE"] = str(pool_size)
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "{}")
+    from app.executor import run_sync
+
+    def upstream_call():
+        time.sleep(latency)
+        return {"foo": "bar"}
+
+    app = FastAPI()
+
+    @app.get("/blocking")
+    async def blocking():
+        return upstream_call()
+
+    @app.get("/pooled")
+    async def pooled():
+        return await run_sync(upstream_call)
+
+    return app
+
+
+async def measure(app, path, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+
+        async def one():
+            async with semaphore:
+                response = await client.get(path)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated RPC seconds")
+    parser.add_argument("--pool-size", type=int, default=32)
+    args = parser.parse_args()
+
+    app = build_app(args.pool_size, args.latency)
+    for label, path in (("blocking (before)", "/blocking"), ("thread pool (after)", "/pooled")):
+        elapsed = asyncio.run(measure(app, path, args.requests, args.concurrency))
+        print(
+            f"{label:<22} {args.requests} requests in {elapsed:.2f}s "
+            f"-> {args.requests / elapsed:.1f} req/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
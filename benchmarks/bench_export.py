@@ -0,0 +1,72 @@
+"""
+Throughput and peak memory of ``app.export`` on collections of growing size,
+read from the in-memory Firestore stand-in with a fixed latency per page.
+
+Peak memory is traced while the export runs, after the collection is seeded:
+it should stay flat as the collection grows, bounded by the page size and
+concurrency rather than by the number of documents. The stand-in scans the
+whole collection to answer every page, so its own share of the peak, and the
+run time, grow with the collection; use the emulator or a real project for
+large collections.
+
+    python -m benchmarks.bench_export --documents 1000,10000 --latency 0.02
+"""
+import argparse
+import asyncio
+import datetime
+import time
+import tracemalloc
+
+from app.export import Export, export_encodings
+from benchmarks.fake_firebase import FakeFirestore
+
+
+def seed(db, count):
+    for i in range(count):
+        db.document("items", f"item{i:08}").set({
+            "n": i,
+            "name": f"Item {i}",
+            "tags": ["a", "b", "c"],
+            "created_at": datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=i),
+        })
+
+
+async def drain(export):
+    # a consumer that discards the chunks, as fast as the export produces them
+    async for _ in export.chunks():
+        pass
+
+
+def run_once(db, encoding, page_size, concurrency):
+    export = Export(db.collection("items"), False, False, page_size, concurrency, encoding)
+    tracemalloc.start()
+    start = time.perf_counter()
+    asyncio.run(drain(export))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return export, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", default="1000,10000", help="comma separated collection sizes")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fake Firestore RPC")
+    args = parser.parse_args()
+
+    print(f"{'documents':>10} {'encoding':<9} {'docs/s':>10} {'MB out':>8} {'peak MB':>8}")
+    for count in (int(size) for size in args.documents.split(",")):
+        db = FakeFirestore(latency=args.latency)
+        seed(db, count)
+        for encoding in export_encodings():
+            export, elapsed, peak = run_once(db, encoding, args.page_size, args.concurrency)
+            print(
+                f"{count:>10} {encoding:<9} {export.documents / elapsed:>10.0f} "
+                f"{export.bytes / 1e6:>8.2f} {peak / 1e6:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Cold start of a worker: time to import the app, to initialize Firebase, and
+from launching uvicorn to the first answered health and readiness checks.
+
+Importing the app and answering /healthz need no credentials. Initializing
+Firebase and --prewarm need GOOGLE_APPLICATION_CREDENTIALS, and --prewarm
+makes one Firestore read per run.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --runs 5 --prewarm
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import app.main
+print(time.perf_counter() - start)
+"""
+
+INITIALIZE_SCRIPT = """
+import time
+import app.main
+from app.init_firebase import initialize
+start = time.perf_counter()
+initialize()
+print(time.perf_counter() - start)
+"""
+
+
+def run_python(script, env):
+    output = subprocess.run(
+        [sys.executable, "-c", script], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.split()[-1])
+
+
+def slowest_imports(env, count):
+    """
+    The top-level imports of app.main taking the longest, from ``python -X importtime``.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"], env=env, check=True, capture_output=True, text=True
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        # only the modules imported directly by the app and its dependencies' roots
+        if match and len(match.group(2)) <= 2:
+            imports.append((int(match.group(1)) / 1e6, match.group(3)))
+    return sorted(imports, reverse=True)[:count]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(client, url, process, deadline):
+    while time.perf_counter() < deadline and process.poll() is None:
+        try:
+            if client.get(url).status_code == 200:
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    return False
+
+
+def serve_once(env, timeout):
+    """
+    Launch uvicorn and time the first answered /healthz and /readyz.
+    """
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            deadline = start + timeout
+            healthy = time.perf_counter() - start if wait_for(client, "/healthz", process, deadline) else None
+            ready = time.perf_counter() - start if wait_for(client, "/readyz", process, deadline) else None
+        return healthy, ready
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summary(samples):
+    samples = [sample for sample in samples if sample is not None]
+    if not samples:
+        return "n/a"
+    return f"median {statistics.median(samples) * 1000:8.1f} ms  min {min(samples) * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--prewarm", action="store_true", help="start the workers with FIREBASE_PREWARM")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), FIREBASE_PREWARM=str(args.prewarm).lower())
+    has_credentials = bool(env.get("GOOGLE_APPLICATION_CREDENTIALS"))
+
+    print(f"{'import app.main':<22} {summary([run_python(IMPORT_SCRIPT, env) for _ in range(args.runs)])}")
+    if has_credentials:
+        print(f"{'initialize()':<22} {summary([run_python(INITIALIZE_SCRIPT, env) for _ in range(args.runs)])}")
+    served = [serve_once(env, args.timeout) for _ in range(args.runs)]
+    print(f"{'launch to /healthz':<22} {summary([healthy for healthy, _ in served])}")
+    print(f"{'launch to /readyz':<22} {summary([ready for _, ready in served])}")
+
+    print("\nslowest imports:")
+    for seconds, module in slowest_imports(env, 8):
+        print(f"  {seconds * 1000:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
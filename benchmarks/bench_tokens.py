@@ -0,0 +1,111 @@
+"""
+ID token verification throughput of ``auth.verify_id_token(check_revoked=True)``
+on every request (the revocation check fetches the user each time) versus
+``app.tokens.TokenVerifier`` with its caches cold and warm.
+
+Tokens are real RS256 JWTs checked with google-auth, as firebase_admin does,
+against a locally generated key. The upstream get_user call is simulated with
+``time.sleep`` so the benchmark runs without Firebase credentials.
+
+    python -m benchmarks.bench_tokens --tokens 2000 --users 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+
+PROJECT_ID = "firebridge-bench"
+
+
+def build_keys():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return crypt.RSASigner.from_string(private_pem, key_id="bench"), {"bench": public_pem}
+
+
+def build_tokens(signer, count, users):
+    now = int(time.time())
+    return [
+        jwt.encode(signer, {
+            "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+            "aud": PROJECT_ID,
+            "sub": f"user{i % users}",
+            "uid": f"user{i % users}",
+            "iat": now,
+            "exp": now + 3600,
+        }).decode()
+        for i in range(count)
+    ]
+
+
+def patch_auth(certs, latency):
+    from firebase_admin import auth
+
+    def verify_id_token(id_token, check_revoked=False):
+        claims = jwt.decode(id_token, certs=certs, audience=PROJECT_ID)
+        if check_revoked:
+            get_user(claims["uid"])
+        return claims
+
+    def get_user(uid):
+        time.sleep(latency)
+        return SimpleNamespace(uid=uid, disabled=False, tokens_valid_after_timestamp=0)
+
+    auth.verify_id_token = verify_id_token
+    auth.get_user = get_user
+
+
+async def measure(verify, tokens, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(token):
+        async with semaphore:
+            await verify(token)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(token) for token in tokens))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated get_user seconds")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "{}")
+    from firebase_admin import auth
+    from app.executor import run_sync
+    from app.tokens import TokenVerifier
+
+    signer, certs = build_keys()
+    patch_auth(certs, args.latency)
+    tokens = build_tokens(signer, args.tokens, args.users)
+    verifier = TokenVerifier(token_ttl=300, revocation_ttl=30, max_entries=len(tokens))
+
+    async def uncached(token):
+        await run_sync(auth.verify_id_token, token, check_revoked=True)
+
+    for label, verify in (
+        ("verify_id_token (before)", uncached),
+        ("cache cold", verifier.verify),
+        ("cache warm", verifier.verify),
+    ):
+        elapsed = asyncio.run(measure(verify, tokens, args.concurrency))
+        print(f"{label:<26} {len(tokens)} tokens in {elapsed:.2f}s -> {len(tokens) / elapsed:.1f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Payload size and encode/decode time of the wire formats of ``app.binary``
+against JSON, on Firestore-like documents: one document, and a page of many.
+
+JSON is encoded as the endpoints encode it, with the Firestore values turned
+into strings; the binary formats keep them as extension types or tags. Sizes
+are given raw and gzipped, as they would go over a compressed connection.
+
+    python -m benchmarks.bench_wire --documents 1,100,1000
+"""
+import argparse
+import datetime
+import gzip
+import json
+import time
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+
+from app.binary import FORMATS
+from app.encoding import firestore_json_default
+
+
+class JsonFormat:
+    media_type = "application/json"
+
+    @staticmethod
+    def encode(content) -> bytes:
+        return json.dumps(content, default=firestore_json_default, separators=(",", ":")).encode()
+
+    @staticmethod
+    def decode(data: bytes):
+        return json.loads(data)
+
+
+def document(i: int) -> dict:
+    return {
+        "name": f"Place {i}",
+        "rating": 4.5,
+        "visits": i * 37,
+        "open": i % 2 == 0,
+        "tags": ["food", "outdoor", "family"],
+        "location": GeoPoint(48.85 + i / 1e4, 2.35 - i / 1e4),
+        "created_at": DatetimeWithNanoseconds(2024, 1, 1, 12, 30, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=i),
+        "address": {"street": f"{i} Rue de Rivoli", "city": "Paris", "zip": "75001"},
+        "hours": [{"day": day, "open": "09:00", "close": "18:00"} for day in range(7)],
+    }
+
+
+def timed(function, argument, repeat: int) -> float:
+    # the best of ``repeat`` runs, in microseconds
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", default="1,100,1000", help="comma separated numbers of documents per payload")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    formats = [JsonFormat] + list(dict.fromkeys(FORMATS.values()))
+    print(f"{'documents':>10} {'format':<20} {'bytes':>9} {'gzip':>9} {'encode us':>10} {'decode us':>10}")
+    for count in (int(size) for size in args.documents.split(",")):
+        payload = {"documents": {f"places/p{i}": document(i) for i in range(count)}}
+        for wire_format in formats:
+            data = wire_format.encode(payload)
+            print(
+                f"{count:>10} {wire_format.media_type:<20} {len(data):>9} {len(gzip.compress(data)):>9} "
+                f"{timed(wire_format.encode, payload, args.repeat):>10.0f} {timed(wire_format.decode, data, args.repeat):>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,815 @@
+"""
+In-memory stand-in for the Firestore client and the firebase_admin.auth
+functions used by the bridge, so that the load tests run fully offline.
+
+It implements the subset of the client API the routers call, with Firestore's
+semantics where they matter to the bridge (document and collection paths,
+missing parent documents, query filters, ordering and cursors, atomic batches),
+and an optional fixed latency per RPC to stand in for the network.
+
+``install()`` must run before the app makes its first Firebase call: it
+initializes the default Firebase app with fake credentials and makes
+``firestore.client()`` return the fake client.
+"""
+import copy
+import datetime
+import json
+import sys
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from firebase_admin import credentials
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import Aborted
+from google.cloud.firestore_v1 import (
+    DELETE_FIELD,
+    SERVER_TIMESTAMP,
+    ArrayRemove,
+    ArrayUnion,
+    Increment,
+    Maximum,
+    Minimum,
+)
+from google.auth.credentials import AnonymousCredentials
+
+DOCUMENT_ID = "__name__"
+
+
+def _now():
+    return DatetimeWithNanoseconds.now(datetime.timezone.utc)
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+def _delete_field(data, field_path):
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+
+def _transformed(current, value, update_time):
+    """
+    The value of a field holding ``current`` (None when absent) once ``value``,
+    maybe a transform such as Increment, is written to it.
+    """
+    number = current if isinstance(current, (int, float)) and not isinstance(current, bool) else None
+    if value is SERVER_TIMESTAMP:
+        return update_time
+    if isinstance(value, Increment):
+        return (number or 0) + value.value
+    if isinstance(value, Maximum):
+        return value.value if number is None else max(number, value.value)
+    if isinstance(value, Minimum):
+        return value.value if number is None else min(number, value.value)
+    if isinstance(value, ArrayUnion):
+        array = list(current) if isinstance(current, list) else []
+        return array + [item for item in value.values if item not in array]
+    if isinstance(value, ArrayRemove):
+        return [item for item in current if item not in value.values] if isinstance(current, list) else []
+    return copy.deepcopy(value)
+
+
+def _merge(target, source, update_time=None):
+    for key, value in source.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            _merge(target[key], value, update_time)
+        else:
+            target[key] = _transformed(target.get(key), value, update_time)
+
+
+def _project(data, field_paths):
+    projected = {}
+    for field_path in field_paths:
+        try:
+            _set_field(projected, field_path, _get_field(data, field_path))
+        except KeyError:
+            pass
+    return projected
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _get_field(self._data, field_path)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, collection_id):
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._get(self, field_paths)
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([("set", self, document_data, merge)])[0]
+
+    def create(self, document_data):
+        return self._client._commit([("create", self, document_data, False)])[0]
+
+    def update(self, field_updates):
+        return self._client._commit([("update", self, field_updates, False)])[0]
+
+    def delete(self):
+        return self._client._commit([("delete", self, None, False)])[0]
+
+    def collections(self):
+        self._client._rpc()
+        return [FakeCollectionReference(self._client, path) for path in self._client._child_collections(self.path)]
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("The fake backend does not support listeners")
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class FakeQuery:
+    def __init__(self, client, parent_path=None, collection_id=None, all_descendants=False,
+                 filters=(), orders=(), limit=None, projection=None, cursor=None, descendants_of=None,
+                 start_at=None, end_before=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._collection_id = collection_id
+        self._all_descendants = all_descendants
+        # path of the collection a recursive() query reads every document below
+        self._descendants_of = descendants_of
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._projection = projection
+        self._cursor = cursor
+        # document path bounds, only document ID cursors are supported
+        self._start_at = start_at
+        self._end_before = end_before
+
+    def _copy(self, **changes):
+        state = {
+            "parent_path": self._parent_path,
+            "collection_id": self._collection_id,
+            "all_descendants": self._all_descendants,
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "projection": self._projection,
+            "cursor": self._cursor,
+            "descendants_of": self._descendants_of,
+            "start_at": self._start_at,
+            "end_before": self._end_before,
+        }
+        state.update(changes)
+        return FakeQuery(self._client, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def start_at(self, document_fields):
+        return self._copy(start_at=self._document_bound(document_fields))
+
+    def end_before(self, document_fields):
+        return self._copy(end_before=self._document_bound(document_fields))
+
+    def _document_bound(self, document_fields):
+        name = document_fields[DOCUMENT_ID]
+        if isinstance(name, str):
+            return f"{self._parent_path}/{self._collection_id}/{name}".lstrip("/")
+        return name.path
+
+    def recursive(self):
+        return self._copy(descendants_of=f"{self._parent_path}/{self._collection_id}".lstrip("/"))
+
+    def count(self, alias=None):
+        return FakeAggregationQuery(self).count(alias)
+
+    def sum(self, field_path, alias=None):
+        return FakeAggregationQuery(self).sum(field_path, alias)
+
+    def avg(self, field_path, alias=None):
+        return FakeAggregationQuery(self).avg(field_path, alias)
+
+    def stream(self, transaction=None):
+        return iter(self.get())
+
+    def get(self, transaction=None):
+        return self._client._run_query(self)
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("The fake backend does not support listeners")
+
+
+class FakeAggregationQuery:
+    def __init__(self, query):
+        self._query = query
+        self._aggregations = []
+
+    def count(self, alias=None):
+        self._aggregations.append(("count", None, alias or "count"))
+        return self
+
+    def sum(self, field_path, alias=None):
+        self._aggregations.append(("sum", field_path, alias or f"sum_{field_path}"))
+        return self
+
+    def avg(self, field_path, alias=None):
+        self._aggregations.append(("avg", field_path, alias or f"avg_{field_path}"))
+        return self
+
+    def get(self, transaction=None):
+        snapshots = self._query._client._run_query(self._query)
+        read_time = _now()
+        results = []
+        for op, field_path, alias in self._aggregations:
+            if op == "count":
+                value = len(snapshots)
+            else:
+                # like Firestore, only numeric values are aggregated
+                numbers = []
+                for snapshot in snapshots:
+                    number = _get_field(snapshot._data, field_path) if _has_field(snapshot._data, field_path) else None
+                    if isinstance(number, (int, float)) and not isinstance(number, bool):
+                        numbers.append(number)
+                if op == "sum":
+                    value = sum(numbers)
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+            results.append(SimpleNamespace(alias=alias, value=value, read_time=read_time))
+        return [results]
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        parent_path, _, collection_id = path.rpartition("/")
+        super().__init__(client, parent_path=parent_path, collection_id=collection_id)
+        self._path = path
+        self.id = collection_id
+
+    @property
+    def parent(self):
+        if not self._parent_path:
+            return None
+        return FakeDocumentReference(self._client, self._parent_path)
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        doc_ref = self.document(document_id)
+        return doc_ref.create(document_data), doc_ref
+
+    def list_documents(self, page_size=None):
+        self._client._rpc()
+        return [FakeDocumentReference(self._client, path) for path in self._client._child_documents(self._path)]
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference, document_data, False))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        return self._client._commit(self._writes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Optimistic transaction: the commit is aborted when a document read by the
+    transaction changed since, and the SDK's ``transactional`` retries it.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._rpc()
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        try:
+            return self._client._commit(self._writes, self._read_versions)
+        finally:
+            self._clean_up()
+
+
+class FakeBulkWriter:
+    def __init__(self, client):
+        self._client = client
+        self._on_result = None
+        self._on_error = None
+
+    def on_write_result(self, callback):
+        self._on_result = callback
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def delete(self, reference):
+        result = self._client._commit([("delete", reference, None, False)])[0]
+        if self._on_result is not None:
+            self._on_result(reference, result, self)
+
+    def close(self):
+        pass
+
+
+class FakeFirestore:
+    """
+    In-memory Firestore client. Documents are stored by path, and every RPC
+    sleeps for ``latency`` seconds before running under a single lock.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._documents = {}  # path -> (data, create_time, update_time)
+        self._lock = threading.Lock()
+
+    def _rpc(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, *segments):
+        return FakeCollectionReference(self, "/".join(segments))
+
+    def document(self, *segments):
+        return FakeDocumentReference(self, "/".join(segments))
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, parent_path="", collection_id=collection_id, all_descendants=True)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeTransaction(self, max_attempts, read_only)
+
+    def bulk_writer(self, options=None):
+        return FakeBulkWriter(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._rpc()
+        with self._lock:
+            snapshots = [self._snapshot(reference, field_paths) for reference in references]
+        if transaction is not None:
+            for snapshot in snapshots:
+                transaction._read_versions[snapshot.reference.path] = snapshot.update_time
+        return snapshots
+
+    def _get(self, reference, field_paths=None):
+        self._rpc()
+        with self._lock:
+            return self._snapshot(reference, field_paths)
+
+    def _snapshot(self, reference, field_paths=None):
+        stored = self._documents.get(reference.path)
+        if stored is None:
+            return FakeSnapshot(reference, None, read_time=_now())
+        data, create_time, update_time = stored
+        if field_paths is not None:
+            data = _project(data, field_paths)
+        return FakeSnapshot(reference, data, create_time, update_time, _now())
+
+    def _commit(self, writes, read_versions=None):
+        self._rpc()
+        with self._lock:
+            for path, update_time in (read_versions or {}).items():
+                stored = self._documents.get(path)
+                if (stored[2] if stored else None) != update_time:
+                    raise Aborted(f"Transaction lock timeout or contention on {path}")
+            for op, reference, data, _ in writes:
+                exists = reference.path in self._documents
+                if op == "create" and exists:
+                    raise ValueError(f"Document already exists: {reference.path}")
+                if op == "update" and not exists:
+                    raise ValueError(f"No document to update: {reference.path}")
+            results = []
+            update_time = _now()
+            for op, reference, data, merge in writes:
+                stored = self._documents.get(reference.path)
+                create_time = stored[1] if stored else update_time
+                if op == "delete":
+                    self._documents.pop(reference.path, None)
+                elif op == "update":
+                    updated = copy.deepcopy(stored[0])
+                    for field_path, value in data.items():
+                        if value is DELETE_FIELD:
+                            _delete_field(updated, field_path)
+                        else:
+                            current = _get_field(updated, field_path) if _has_field(updated, field_path) else None
+                            _set_field(updated, field_path, _transformed(current, value, update_time))
+                    self._documents[reference.path] = (updated, create_time, update_time)
+                else:
+                    written = copy.deepcopy(stored[0]) if merge and stored else {}
+                    _merge(written, data, update_time)
+                    self._documents[reference.path] = (written, create_time, update_time)
+                results.append(SimpleNamespace(update_time=update_time))
+            return results
+
+    def _child_documents(self, collection_path):
+        prefix = collection_path + "/"
+        with self._lock:
+            children = set()
+            for path in self._documents:
+                if path.startswith(prefix):
+                    children.add(prefix + path[len(prefix):].split("/", 1)[0])
+        return sorted(children)
+
+    def _child_collections(self, document_path):
+        prefix = document_path + "/"
+        with self._lock:
+            return sorted({
+                prefix + path[len(prefix):].split("/", 1)[0]
+                for path in self._documents if path.startswith(prefix)
+            })
+
+    def _run_query(self, query):
+        self._rpc()
+        with self._lock:
+            read_time = _now()
+            matches = []
+            for path, (data, create_time, update_time) in self._documents.items():
+                parent_path, _, _ = path.rpartition("/")
+                collection_parent, _, collection_id = parent_path.rpartition("/")
+                if query._descendants_of is not None:
+                    if not path.startswith(query._descendants_of + "/"):
+                        continue
+                elif collection_id != query._collection_id:
+                    continue
+                elif not query._all_descendants and collection_parent != query._parent_path:
+                    continue
+                if query._start_at is not None and path < query._start_at:
+                    continue
+                if query._end_before is not None and path >= query._end_before:
+                    continue
+                if all(_matches(path, data, *condition) for condition in query._filters):
+                    matches.append((path, data, create_time, update_time))
+
+        orders = list(query._orders)
+        for field_path, _ in orders:
+            if field_path != DOCUMENT_ID:
+                matches = [match for match in matches if _has_field(match[1], field_path)]
+        if not any(field_path == DOCUMENT_ID for field_path, _ in orders):
+            orders.append((DOCUMENT_ID, orders[-1][1] if orders else "ASCENDING"))
+        for field_path, direction in reversed(orders):
+            matches.sort(key=lambda match: _sort_key(match, field_path), reverse=direction == "DESCENDING")
+
+        if query._cursor is not None:
+            cursor_path = query._cursor.reference.path
+            paths = [match[0] for match in matches]
+            matches = matches[paths.index(cursor_path) + 1:] if cursor_path in paths else matches
+        if query._limit is not None:
+            matches = matches[:query._limit]
+        snapshots = []
+        for path, data, create_time, update_time in matches:
+            if query._projection is not None:
+                data = _project(data, [field for field in query._projection if field != DOCUMENT_ID])
+            snapshots.append(FakeSnapshot(FakeDocumentReference(self, path), data, create_time, update_time, read_time))
+        return snapshots
+
+
+def _has_field(data, field_path):
+    try:
+        _get_field(data, field_path)
+        return True
+    except KeyError:
+        return False
+
+
+def _sort_key(match, field_path):
+    if field_path == DOCUMENT_ID:
+        return match[0]
+    value = _get_field(match[1], field_path)
+    # order values of different types by type first, as Firestore does
+    return (type(value).__name__, value)
+
+
+def _matches(path, data, field_path, op, value):
+    if field_path == DOCUMENT_ID:
+        actual = path
+    else:
+        try:
+            actual = _get_field(data, field_path)
+        except KeyError:
+            return False
+    try:
+        if op == "==":
+            return actual == value
+        if op == "!=":
+            return actual != value
+        if op == "<":
+            return actual < value
+        if op == "<=":
+            return actual <= value
+        if op == ">":
+            return actual > value
+        if op == ">=":
+            return actual >= value
+        if op == "in":
+            return actual in value
+        if op == "not-in":
+            return actual not in value
+        if op == "array-contains":
+            return isinstance(actual, list) and value in actual
+        if op == "array-contains-any":
+            return isinstance(actual, list) and any(item in actual for item in value)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class FakeAuth:
+    """
+    In-memory Firebase Authentication with the functions of ``firebase_admin.auth``
+    that the bridge calls. ID tokens are "fake-token:<uid>:<issued at>" strings.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        from firebase_admin import auth
+
+        self.latency = latency
+        self._auth = auth
+        self._users = {}  # uid -> REST representation of the user
+        self._lock = threading.Lock()
+
+    def _rpc(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _record(self, uid):
+        from firebase_admin import _user_mgt
+
+        data = self._users.get(uid)
+        if data is None:
+            raise self._auth.UserNotFoundError(f"No user record found for the provided user ID: {uid}.")
+        return _user_mgt.ExportedUserRecord(dict(data))
+
+    def _uid_by(self, field, value):
+        for uid, data in self._users.items():
+            if data.get(field) == value:
+                return uid
+        return None
+
+    def create_user(self, uid=None, email=None, password=None, display_name=None, photo_url=None,
+                    phone_number=None, disabled=None, email_verified=None, **kwargs):
+        self._rpc()
+        with self._lock:
+            uid = uid or uuid.uuid4().hex[:28]
+            if uid in self._users:
+                raise self._auth.UidAlreadyExistsError("The user with the provided uid already exists.", None, None)
+            if email and self._uid_by("email", email.lower()) is not None:
+                raise self._auth.EmailAlreadyExistsError("The user with the provided email already exists.", None, None)
+            now = str(int(time.time() * 1000))
+            self._users[uid] = {
+                "localId": uid,
+                "email": email.lower() if email else None,
+                "displayName": display_name,
+                "photoUrl": photo_url,
+                "phoneNumber": phone_number,
+                "disabled": bool(disabled),
+                "emailVerified": bool(email_verified),
+                "createdAt": now,
+                "validSince": str(int(time.time())),
+            }
+            return self._record(uid)
+
+    def get_user(self, uid):
+        self._rpc()
+        with self._lock:
+            return self._record(uid)
+
+    def get_user_by_email(self, email):
+        self._rpc()
+        with self._lock:
+            uid = self._uid_by("email", email.lower())
+            if uid is None:
+                raise self._auth.UserNotFoundError(f"No user record found for the provided email: {email}.")
+            return self._record(uid)
+
+    def update_user(self, uid, email=None, password=None, display_name=None, photo_url=None,
+                    phone_number=None, disabled=None, custom_claims=None, email_verified=None, **kwargs):
+        self._rpc()
+        with self._lock:
+            self._record(uid)
+            data = self._users[uid]
+            changes = {
+                "email": email.lower() if email else None,
+                "displayName": display_name,
+                "photoUrl": photo_url,
+                "phoneNumber": phone_number,
+                "disabled": disabled,
+                "emailVerified": email_verified,
+            }
+            data.update({key: value for key, value in changes.items() if value is not None})
+            if custom_claims is not None:
+                data["customAttributes"] = json.dumps(custom_claims)
+            return self._record(uid)
+
+    def delete_user(self, uid):
+        self._rpc()
+        with self._lock:
+            self._record(uid)
+            del self._users[uid]
+
+    def get_users(self, identifiers):
+        self._rpc()
+        with self._lock:
+            users, not_found = {}, []
+            for identifier in identifiers:
+                if isinstance(identifier, self._auth.UidIdentifier):
+                    uid = identifier.uid if identifier.uid in self._users else None
+                elif isinstance(identifier, self._auth.EmailIdentifier):
+                    uid = self._uid_by("email", identifier.email.lower())
+                else:
+                    uid = self._uid_by("phoneNumber", identifier.phone_number)
+                if uid is None:
+                    not_found.append(identifier)
+                else:
+                    users[uid] = self._record(uid)
+            return SimpleNamespace(users=list(users.values()), not_found=not_found)
+
+    def import_users(self, users, hash_alg=None):
+        self._rpc()
+        with self._lock:
+            for user in users:
+                self._users[user.uid] = {
+                    "localId": user.uid,
+                    "email": user.email,
+                    "displayName": user.display_name,
+                    "phoneNumber": user.phone_number,
+                    "photoUrl": user.photo_url,
+                    "disabled": bool(user.disabled),
+                    "emailVerified": bool(user.email_verified),
+                    "createdAt": str(int(time.time() * 1000)),
+                    "validSince": str(int(time.time())),
+                }
+            return SimpleNamespace(success_count=len(users), failure_count=0, errors=[])
+
+    def delete_users(self, uids):
+        self._rpc()
+        with self._lock:
+            for uid in uids:
+                self._users.pop(uid, None)
+            return SimpleNamespace(success_count=len(uids), failure_count=0, errors=[])
+
+    def list_users(self, page_token=None, max_results=1000):
+        self._rpc()
+        with self._lock:
+            uids = sorted(self._users)
+            start = uids.index(page_token) + 1 if page_token in self._users else 0
+            page = [self._record(uid) for uid in uids[start:start + max_results]]
+        has_next = start + max_results < len(uids)
+        return SimpleNamespace(
+            users=page,
+            has_next_page=has_next,
+            next_page_token=page[-1].uid if has_next else None,
+            get_next_page=lambda: self.list_users(page[-1].uid, max_results) if has_next else None,
+        )
+
+    def revoke_refresh_tokens(self, uid):
+        self._rpc()
+        with self._lock:
+            self._record(uid)
+            self._users[uid]["validSince"] = str(int(time.time()))
+
+    def generate_email_verification_link(self, email, action_code_settings=None):
+        self.get_user_by_email(email)
+        return f"https://example.com/verify?email={email}"
+
+    def id_token(self, uid):
+        """
+        Issue an ID token for a user, accepted by ``verify_id_token``.
+        """
+        return f"fake-token:{uid}:{int(time.time())}"
+
+    def verify_id_token(self, id_token, check_revoked=False, clock_skew_seconds=0):
+        kind, _, rest = id_token.partition(":")
+        uid, _, issued_at = rest.rpartition(":")
+        if kind != "fake-token" or not uid or not issued_at.isdigit():
+            raise self._auth.InvalidIdTokenError("Invalid fake ID token")
+        claims = {"uid": uid, "sub": uid, "iat": int(issued_at), "exp": int(issued_at) + 3600}
+        if check_revoked:
+            user = self.get_user(uid)
+            if user.disabled:
+                raise self._auth.UserDisabledError("The user record is disabled.")
+            if claims["iat"] * 1000 < user.tokens_valid_after_timestamp:
+                raise self._auth.RevokedIdTokenError("The Firebase ID token has been revoked.")
+        return claims
+
+
+class FakeCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+AUTH_FUNCTIONS = (
+    "create_user", "get_user", "get_user_by_email", "update_user", "delete_user", "get_users",
+    "import_users", "delete_users", "list_users", "revoke_refresh_tokens",
+    "generate_email_verification_link", "verify_id_token",
+)
+
+
+def install(latency: float = 0.0):
+    """
+    Replace Firebase with the in-memory fakes for the rest of the process.
+
+    :param latency: Seconds every fake RPC takes.
+    :return: The fake Firestore client and the fake Auth backend.
+    """
+    import firebase_admin
+    from firebase_admin import auth, firestore
+
+    init_firebase = sys.modules.get("app.init_firebase")
+    if init_firebase is not None and init_firebase.initialized():
+        raise RuntimeError("install() must run before the app initializes Firebase")
+    db = FakeFirestore(latency)
+    fake_auth = FakeAuth(latency)
+    firebase_admin.initialize_app(FakeCredential(), {"projectId": "firebridge-fake"})
+    firestore.client = lambda app=None: db
+    for name in AUTH_FUNCTIONS:
+        setattr(auth, name, getattr(fake_auth, name))
+    return db, fake_auth
@@ -0,0 +1,413 @@
+"""
+Load test driving every request/response endpoint of the bridge under
+configurable concurrency, reporting throughput, p50/p95/p99 latency and memory
+per scenario, and failing when results regress against a stored baseline.
+
+Two backends are supported:
+
+* ``fake`` (default): an in-memory Firestore and Auth stand-in, see
+  ``benchmarks.fake_firebase``, fully offline. ``--latency`` adds a fixed
+  delay to every fake RPC to stand in for the network.
+* ``emulator``: the real SDK against the Firebase emulators, after
+  ``source emulator_env.sh``. GOOGLE_APPLICATION_CREDENTIALS must still be set.
+
+The streaming change feeds (``/firestore/listen``) are long-lived and are not
+part of the load test.
+
+    python -m benchmarks.load --requests 500 --concurrency 32
+    python -m benchmarks.load --scenarios read_document,query --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --baseline benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+
+def path_nodes(*names):
+    return [
+        {"type": "collection" if i % 2 == 0 else "document", "name": name}
+        for i, name in enumerate(names)
+    ]
+
+
+class Context:
+    """
+    Names and seed sizes shared by the scenarios of one run. Every run writes
+    below its own collections, so runs against an emulator do not collide.
+    """
+
+    def __init__(self, requests, documents, users, id_token):
+        self.requests = requests
+        self.documents = documents
+        self.users = users
+        self.run = uuid.uuid4().hex[:8]
+        self.docs = f"bench_{self.run}_docs"
+        self.writes = f"bench_{self.run}_writes"
+        self.start = datetime.now(timezone.utc)
+        self.id_token = id_token
+        self.seeded = set()
+
+    def doc(self, i):
+        return path_nodes(self.docs, f"doc{i % self.documents}")
+
+    def uid(self, i):
+        return f"bench{self.run}user{i % self.users}"
+
+    def email(self, i):
+        return f"bench{self.run}user{i % self.users}@example.com"
+
+
+async def seed_documents(client, collection, count, size=200):
+    for start in range(0, count, 500):
+        operations = [
+            {
+                "op": "set",
+                "path_nodes": path_nodes(collection, f"doc{i}"),
+                "data": {"n": i, "group": i % 10, "payload": "x" * size},
+            }
+            for i in range(start, min(start + 500, count))
+        ]
+        response = await client.post("/firestore/batch_write", json={"operations": operations})
+        response.raise_for_status()
+
+
+async def seed_users(client, ctx, prefix, count):
+    users = [
+        {"uid": f"bench{ctx.run}{prefix}{i}", "email": f"bench{ctx.run}{prefix}{i}@example.com"}
+        for i in range(count)
+    ]
+    for start in range(0, count, 1000):
+        response = await client.post("/user/import_users", json={"users": users[start:start + 1000]})
+        response.raise_for_status()
+
+
+async def setup_documents(client, ctx):
+    # shared by the scenarios reading ctx.docs, seeded by the first one that runs
+    if "documents" not in ctx.seeded:
+        ctx.seeded.add("documents")
+        await seed_documents(client, ctx.docs, ctx.documents)
+
+
+async def setup_users(client, ctx):
+    if "users" not in ctx.seeded:
+        ctx.seeded.add("users")
+        await seed_users(client, ctx, "user", ctx.users)
+
+
+async def setup_users_and_documents(client, ctx):
+    await setup_users(client, ctx)
+    await setup_documents(client, ctx)
+
+
+async def setup_deletions(client, ctx):
+    await seed_documents(client, f"{ctx.writes}_delete", ctx.requests)
+
+
+async def setup_collections(client, ctx):
+    for i in range(ctx.requests):
+        await seed_documents(client, f"{ctx.writes}_coll{i}", 20, size=20)
+
+
+async def setup_deleted_users(client, ctx):
+    await seed_users(client, ctx, "del", ctx.requests)
+
+
+async def setup_bulk_deleted_users(client, ctx):
+    await seed_users(client, ctx, "bulkdel", ctx.requests * 10)
+
+
+# name -> (setup, request builder); a request builder returns (method, url, json body)
+SCENARIOS = {
+    "create_document": (None, lambda ctx, i: (
+        "POST", "/firestore/create_document",
+        {"path_nodes": path_nodes(ctx.writes, f"doc{i}"), "document_data": {"n": i, "payload": "y" * 200}},
+    )),
+    "read_document": (setup_documents, lambda ctx, i: (
+        "POST", "/firestore/read_document", {"path_nodes": ctx.doc(i * 7919)},
+    )),
+    "read_document_masked": (setup_documents, lambda ctx, i: (
+        "POST", "/firestore/read_document", {"path_nodes": ctx.doc(i * 7919), "field_paths": ["n", "group"]},
+    )),
+    "read_documents": (setup_documents, lambda ctx, i: (
+        "POST", "/firestore/read_documents", {"documents": [ctx.doc(i * 50 + j) for j in range(50)]},
+    )),
+    "query": (setup_documents, lambda ctx, i: (
+        "POST", "/firestore/query",
+        {"path_nodes": path_nodes(ctx.docs), "where": [{"field": "group", "op": "==", "value": i % 10}], "limit": 50},
+    )),
+    "aggregate": (setup_documents, lambda ctx, i: (
+        "POST", "/firestore/aggregate",
+        {
+            "path_nodes": path_nodes(ctx.docs), "where": [{"field": "group", "op": "==", "value": i % 10}],
+            "aggregations": [{"op": "count"}, {"op": "sum", "field": "n"}],
+        },
+    )),
+    "sync": (None, lambda ctx, i: (
+        "POST", "/firestore/sync", {"path_nodes": path_nodes(ctx.writes), "since": ctx.start.isoformat()},
+    )),
+    "update_document": (setup_documents, lambda ctx, i: (
+        "PUT", "/firestore/update_document", {"path_nodes": ctx.doc(i), "update_data": {"n": -i}},
+    )),
+    "batch_write": (None, lambda ctx, i: (
+        "POST", "/firestore/batch_write",
+        {"operations": [
+            {"op": "set", "path_nodes": path_nodes(ctx.writes, f"batch{i}_{j}"), "data": {"j": j}}
+            for j in range(100)
+        ]},
+    )),
+    "transaction": (setup_documents, lambda ctx, i: (
+        "POST", "/firestore/transaction",
+        {
+            "reads": [{"name": "src", "path_nodes": ctx.doc(i * 7919)}, {"name": "dst", "path_nodes": ctx.doc(i * 7919 + 1)}],
+            "preconditions": [{"read": "src", "field": "group", "op": "exists"}],
+            "writes": [
+                {"op": "update", "path_nodes": ctx.doc(i * 7919), "data": {"n": {"$increment": -1}}},
+                {"op": "update", "path_nodes": ctx.doc(i * 7919 + 1), "data": {"n": {"$increment": 1}, "from": {"$ref": "src.group"}}},
+            ],
+        },
+    )),
+    "delete_document": (setup_deletions, lambda ctx, i: (
+        "DELETE", "/firestore/delete_document", {"path_nodes": path_nodes(f"{ctx.writes}_delete", f"doc{i}")},
+    )),
+    "delete_collection": (setup_collections, lambda ctx, i: (
+        "DELETE", "/firestore/delete_collection", {"path_nodes": path_nodes(f"{ctx.writes}_coll{i}")},
+    )),
+    "pipeline": (setup_users_and_documents, lambda ctx, i: (
+        "POST", "/pipeline",
+        {"operations": [
+            {"id": "user", "path": "/user/read_user", "body": {"uid": ctx.uid(i)}},
+        ] + [
+            {"path": "/firestore/read_document", "body": {"path_nodes": ctx.doc(i * 7919 + j)}} for j in range(8)
+        ] + [
+            {"path": "/firestore/create_document", "body": {
+                "path_nodes": path_nodes(ctx.writes, f"pipeline{i}"), "document_data": {"email": {"$result": "user.email"}},
+            }},
+        ]},
+    )),
+    "create_user": (None, lambda ctx, i: (
+        "POST", "/user/create_user", {"uid": f"bench{ctx.run}new{i}", "email": f"bench{ctx.run}new{i}@example.com"},
+    )),
+    "read_user": (setup_users, lambda ctx, i: (
+        "POST", "/user/read_user", {"uid": ctx.uid(i * 7919)},
+    )),
+    "update_user": (setup_users, lambda ctx, i: (
+        "PUT", "/user/update_user", {"uid": ctx.uid(i), "display_name": f"User {i}"},
+    )),
+    "get_users": (setup_users, lambda ctx, i: (
+        "POST", "/user/get_users", {"uids": [ctx.uid(i * 100 + j) for j in range(100)]},
+    )),
+    "send_verification_email": (setup_users, lambda ctx, i: (
+        "POST", "/user/send_verification_email", {"email": ctx.email(i)},
+    )),
+    "verify_token": (setup_users, lambda ctx, i: (
+        "POST", "/user/verify_token", {"id_token": ctx.id_token(ctx.uid(i))},
+    )),
+    "list_users": (setup_users, lambda ctx, i: (
+        "GET", "/user/list_users?page_size=100", None,
+    )),
+    "delete_user": (setup_deleted_users, lambda ctx, i: (
+        "DELETE", "/user/delete_user", {"uid": f"bench{ctx.run}del{i}"},
+    )),
+    "delete_users": (setup_bulk_deleted_users, lambda ctx, i: (
+        "POST", "/user/delete_users", {"uids": [f"bench{ctx.run}bulkdel{i * 10 + j}" for j in range(10)]},
+    )),
+}
+
+
+def build_app(args):
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "{}")
+    if args.cache_ttl is not None:
+        os.environ["FIRESTORE_CACHE_DEFAULT_TTL"] = str(args.cache_ttl)
+        os.environ["USER_CACHE_TTL"] = str(args.cache_ttl)
+    if args.backend == "fake":
+        from benchmarks.fake_firebase import install
+
+        _, fake_auth = install(latency=args.latency)
+        id_token = fake_auth.id_token
+    else:
+        if not os.getenv("FIRESTORE_EMULATOR_HOST") or not os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+            sys.exit("The emulator backend needs the variables of emulator_env.sh")
+        id_token = emulator_id_token
+    from app.main import app
+
+    return app, id_token
+
+
+def emulator_id_token(uid):
+    # the Auth emulator accepts unsigned ID tokens
+    import firebase_admin
+
+    project_id = firebase_admin.get_app().project_id
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{project_id}",
+        "aud": project_id,
+        "sub": uid,
+        "uid": uid,
+        "iat": now,
+        "auth_time": now,
+        "exp": now + 3600,
+    }
+
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode()
+
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(claims)}."
+
+
+def memory_mb():
+    # current resident set size where /proc is available, else the peak
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def failed(response) -> bool:
+    """
+    Whether a request failed, including errors reported in-band by streams and
+    per-item failures of the bulk endpoints.
+    """
+    if response.status_code >= 400:
+        return True
+    content_type = response.headers.get("content-type", "")
+    if content_type.startswith("application/x-ndjson"):
+        lines = response.content.strip().splitlines()
+        return bool(lines) and "error" in json.loads(lines[-1])
+    if content_type.startswith("application/json") and response.content:
+        body = response.json()
+        return isinstance(body, dict) and bool(body.get("failed"))
+    return False
+
+
+async def run_scenario(client, ctx, build_request, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one(i):
+        method, url, body = build_request(ctx, i)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+        if failed(response):
+            errors.append(f"{response.status_code} {response.text[:200]}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+        "memory_mb": round(memory_mb(), 1),
+    }
+
+
+async def run(app, id_token, args, names):
+    ctx = Context(args.requests, args.documents, args.users, id_token)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in names:
+            setup, build_request = SCENARIOS[name]
+            if setup is not None:
+                await setup(client, ctx)
+            results[name] = await run_scenario(client, ctx, build_request, args.requests, args.concurrency)
+            result = results[name]
+            print(
+                f"{name:<24} {result['throughput']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  "
+                f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                f"{result['memory_mb']:>7.1f} MB  {result['errors']} errors"
+            )
+            if result["first_error"]:
+                print(f"    first error: {result['first_error']}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    List the scenarios that regressed against a baseline.
+
+    :return: One message per regression: errors, throughput below
+        ``1 - tolerance`` of the baseline, or p95 latency above ``1 + tolerance``.
+    """
+    regressions = []
+    for name, result in results.items():
+        if result["errors"]:
+            regressions.append(f"{name}: {result['errors']} failed requests")
+        expected = baseline.get("scenarios", {}).get(name)
+        if expected is None:
+            continue
+        if result["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']} < baseline {expected['throughput']}")
+        if result["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms > baseline {expected['p95_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", choices=("fake", "emulator"), default="fake")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, in run order")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--documents", type=int, default=1000, help="documents seeded for the read scenarios")
+    parser.add_argument("--users", type=int, default=500, help="users seeded for the user scenarios")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fake RPC")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="enable the document and user caches")
+    parser.add_argument("--baseline", help="fail if results regress against this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--save-baseline", help="write the results to this baseline file")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    app, id_token = build_app(args)
+    results = asyncio.run(run(app, id_token, args, names))
+    settings = {
+        key: getattr(args, key)
+        for key in ("backend", "requests", "concurrency", "documents", "users", "latency", "cache_ttl")
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"settings": settings, "scenarios": results}, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print(f"warning: baseline settings differ: {baseline.get('settings')}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()